@@ -0,0 +1,340 @@
+"""
+Recording the API calls of a release to a cassette file, and replaying them from it, offline.
+
+Replaying runs the release's API calls in milliseconds, without a token or a network,
+e.g. to test the release pipeline in a sandboxed CI or to benchmark it. Latency can be added
+to every replayed response to simulate a slow network, and a rate limit can be simulated.
+
+Cassettes plug in under the clients: as PyGithub's connection classes for GitHub,
+and as the transport adapter of the session of the other hosts (see deliverit.remotes).
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Callable
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import json
+import os
+import threading
+import time
+
+import github
+import github.Requester
+import requests
+from pydantic import BaseModel
+
+import deliverit.redaction
+from deliverit.remotes import GitHubRemote, HTTPRemote, Remote
+
+# Response headers that describe the transfer rather than the response
+DROPPED_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+}
+CHUNK_SIZE = 1 << 16
+
+
+class CassetteError(Exception):
+    """A request that the cassette has no recorded response for"""
+
+
+class Interaction(BaseModel):
+    method: str
+    url: str
+    # None for streamed bodies (uploads), which are not recorded
+    body: Optional[str] = None
+    status: int
+    headers: dict[str, str]
+    response: str
+    # Seconds the response took when it was recorded
+    duration: float = 0.0
+
+
+class Cassette:
+    """
+    Replays the interactions of filepath if it exists, records them to it otherwise.
+
+    A request is answered with the first interaction not replayed yet with the same method, URL
+    (query parameters in any order) and body (JSON in any formatting). GET requests made more
+    often than when recording get the last matching response again.
+
+    `latency` is added to each replayed response: a number of seconds, or "recorded"
+    to take as long as when recording. `rate_limit` ("CALLS/SECONDS", e.g. "100/60")
+    makes replayed responses report a budget of CALLS calls reset every SECONDS,
+    and answer rate limit errors once it is spent.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        latency: Union[None, float, str] = None,
+        rate_limit: Optional[str] = None,
+    ) -> None:
+        self.filepath = filepath
+        self.recording = not Path(filepath).exists()
+        self.interactions: list[Interaction] = (
+            []
+            if self.recording
+            else [
+                Interaction(**i) for i in json.loads(Path(filepath).read_text("utf-8"))
+            ]
+        )
+        self.latency = latency
+        self.rate_limit: Optional[tuple[int, float]] = None
+        if rate_limit:
+            calls, _, seconds = rate_limit.partition("/")
+            self.rate_limit = int(calls), float(seconds or 3600)
+        self._replayed: set[int] = set()
+        # (method, url, body) -> index of the last interaction replayed for it
+        self._last_replayed: dict[tuple[str, str, Optional[str]], int] = {}
+        self._window: tuple[float, int] = (0.0, 0)  # (start, calls made in it)
+        self._lock = threading.Lock()
+
+    def exchange(
+        self,
+        method: str,
+        url: str,
+        body: Any,
+        send: Callable[[], tuple[int, dict[str, str], str]],
+    ) -> Interaction:
+        """
+        The response to the request: replayed, or obtained from send() and recorded.
+        send returns (status, headers, response body).
+        """
+        url = _normalize_url(url)
+        if self.recording:
+            started_at = time.perf_counter()
+            status, headers, response = send()
+            interaction = Interaction(
+                method=method,
+                url=url,
+                body=_normalize_body(body),
+                status=status,
+                headers={
+                    k.lower(): v
+                    for k, v in headers.items()
+                    if k.lower() not in DROPPED_HEADERS
+                },
+                response=deliverit.redaction.redact(response),
+                duration=time.perf_counter() - started_at,
+            )
+            with self._lock:
+                self.interactions.append(interaction)
+                self._save()
+            return interaction
+
+        # Read what would have been uploaded, so that the readers hashing it see all of it
+        if hasattr(body, "read"):
+            while body.read(CHUNK_SIZE):
+                pass
+        refused, rate_limiting = self._count_call() if self.rate_limit else (False, {})
+        if refused:
+            # Refused calls don't use up their interaction, they are made again later
+            interaction = Interaction(
+                method=method,
+                url=url,
+                status=403,
+                headers={"content-type": "application/json"},
+                response=json.dumps(
+                    {"message": "API rate limit exceeded (simulated by the cassette)"}
+                ),
+            )
+        else:
+            interaction = self._match(method, url, _normalize_body(body))
+        if self.latency == "recorded":
+            time.sleep(interaction.duration)
+        elif self.latency:
+            time.sleep(float(self.latency))
+        if rate_limiting:
+            headers = {
+                k: v
+                for k, v in interaction.headers.items()
+                if not k.startswith(("x-ratelimit-", "ratelimit-"))
+            }
+            return interaction.copy(update={"headers": {**headers, **rate_limiting}})
+        return interaction
+
+    def _match(self, method: str, url: str, body: Optional[str]) -> Interaction:
+        key = (method, url, body)
+        with self._lock:
+            for index, interaction in enumerate(self.interactions):
+                if (
+                    index in self._replayed
+                    or (interaction.method, interaction.url) != (method, url)
+                    # Streamed bodies were not recorded, they match any body
+                    or interaction.body not in (None, body)
+                ):
+                    continue
+                self._replayed.add(index)
+                self._last_replayed[key] = index
+                return interaction
+            if method == "GET" and key in self._last_replayed:
+                return self.interactions[self._last_replayed[key]]
+        raise CassetteError(
+            f"No response recorded in {self.filepath} for {method} {url}"
+            + (f" with body {body}" if body else "")
+        )
+
+    def _count_call(self) -> tuple[bool, dict[str, str]]:
+        """
+        Counts a call in the simulated rate limit's window.
+        Returns whether it is refused, and the rate limit headers of its response.
+        """
+        calls, seconds = self.rate_limit
+        with self._lock:
+            start, made = self._window
+            if time.time() >= start + seconds:
+                start, made = time.time(), 0
+            refused = made >= calls
+            if not refused:
+                made += 1
+            self._window = start, made
+        return refused, {
+            "x-ratelimit-limit": str(calls),
+            "x-ratelimit-remaining": str(calls - made),
+            "x-ratelimit-reset": str(int(start + seconds) + 1),
+        }
+
+    def _save(self):
+        temporary = Path(f"{self.filepath}.{os.getpid()}.tmp")
+        temporary.write_text(
+            json.dumps([i.dict() for i in self.interactions], indent=2), "utf-8"
+        )
+        temporary.replace(self.filepath)
+
+    def attach(self, remote: Remote):
+        """Routes the calls of remote through the cassette"""
+        if isinstance(remote, HTTPRemote):
+            adapter = CassetteAdapter(self)
+            remote.session.mount("http://", adapter)
+            remote.session.mount("https://", adapter)
+        elif isinstance(remote, GitHubRemote) and not self.recording:
+            # PyGithub spaces requests out, for GitHub's secondary rate limits:
+            # there are none to respect when replaying
+            remote.gh = github.Github(
+                remote.token,
+                base_url=remote.api_url,
+                pool_size=remote.pool_size,
+                seconds_between_requests=None,
+                seconds_between_writes=None,
+            )
+
+
+class _Response:
+    """What PyGithub reads from the responses of its connections"""
+
+    def __init__(self, interaction: Interaction) -> None:
+        self.status = interaction.status
+        self.headers = interaction.headers
+        self._text = interaction.response
+
+    def getheaders(self) -> Any:
+        return self.headers.items()
+
+    def read(self) -> str:
+        return self._text
+
+    def iter_content(self, chunk_size: Optional[int] = 1) -> Any:
+        data = self._text.encode("utf-8")
+        size = chunk_size or len(data) or 1
+        return (data[i : i + size] for i in range(0, len(data), size))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise requests.HTTPError(f"{self.status} error")
+
+
+def _connection_class(cassette: Cassette, base: type) -> type:
+    class CassetteConnection(base):  # type: ignore
+        def getresponse(self) -> _Response:
+            def send() -> tuple[int, dict[str, str], str]:
+                response = super(CassetteConnection, self).getresponse()
+                return response.status, dict(response.headers), response.read()
+
+            return _Response(
+                cassette.exchange(
+                    self.verb,
+                    f"{self.protocol}://{self.host}:{self.port}{self.url}",
+                    self.input,
+                    send,
+                )
+            )
+
+    return CassetteConnection
+
+
+class CassetteAdapter(requests.adapters.BaseAdapter):
+    """Transport adapter of requests' sessions going through a cassette"""
+
+    def __init__(self, cassette: Cassette) -> None:
+        super().__init__()
+        self.cassette = cassette
+        self._adapter = requests.adapters.HTTPAdapter()
+
+    def send(
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        def send() -> tuple[int, dict[str, str], str]:
+            response = self._adapter.send(request, **kwargs)
+            return response.status_code, dict(response.headers), response.text
+
+        interaction = self.cassette.exchange(
+            request.method or "GET", request.url or "", request.body, send
+        )
+        response = requests.Response()
+        response.status_code = interaction.status
+        response.headers = requests.structures.CaseInsensitiveDict(interaction.headers)
+        response._content = interaction.response.encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url or ""
+        response.request = request
+        return response
+
+    def close(self):
+        self._adapter.close()
+
+
+active: Optional[Cassette] = None
+
+
+def use(cassette: Optional[Cassette]):
+    """
+    Routes the API calls made from now on through cassette (None to stop).
+    GitHub clients created before are not affected.
+    """
+    global active
+    active = cassette
+    if cassette is None:
+        github.Requester.Requester.resetConnectionClasses()
+        return
+    github.Requester.Requester.injectConnectionClasses(
+        _connection_class(cassette, github.Requester.HTTPRequestsConnectionClass),
+        _connection_class(cassette, github.Requester.HTTPSRequestsConnectionClass),
+    )
+
+
+def _normalize_url(url: str) -> str:
+    """The URL without default ports, with query parameters in order"""
+    parts = urlsplit(url)
+    netloc = parts.netloc
+    if (parts.scheme, parts.port) in (("https", 443), ("http", 80)):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, netloc, parts.path, query, ""))
+
+
+def _normalize_body(body: Any) -> Optional[str]:
+    """The body as text, JSON reformatted consistently. None for streamed bodies"""
+    if body is None or hasattr(body, "read"):
+        return None
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    if not isinstance(body, str):
+        return None
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True)
+    except ValueError:
+        pass
+    return deliverit.redaction.redact(body)
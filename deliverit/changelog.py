@@ -7,9 +7,13 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Any, Optional, Union
 
+import keepachangelog
+from chachacha.configuration import Configuration as ChangelogConfiguration
 from chachacha.drivers.kac import ChangelogFormat
 
+import deliverit.history
 from deliverit.context import Context
+from deliverit.transaction import FileTransaction
 from deliverit.ui import *
 from deliverit.version import Version
 
@@ -29,15 +33,105 @@ def get_release_notes_for_version(version: Version, changelog_contents: str) ->
     return "\n".join(release_notes_lines)
 
 
-def update(ctx: Context, changelog_path: str, tag_template: str):
-    changelog = ChangelogFormat(changelog_path)
-    if not Path(changelog_path).is_file():
-        changelog.init()
-    changelog_config = changelog.get_config(init=True)
+def get_release_notes_from_commits(
+    previous_tag: Optional[str],
+    package_directory: str = "",
+    updated_dependencies: Optional[list[str]] = None,
+) -> str:
+    return deliverit.history.render_release_notes(
+        _sections_since(previous_tag, package_directory, updated_dependencies)
+    )
+
+
+def _sections_since(
+    previous_tag: Optional[str],
+    package_directory: str = "",
+    updated_dependencies: Optional[list[str]] = None,
+) -> dict[str, list[str]]:
+    """
+    The changelog entries of the conventional commits since previous_tag that changed
+    files in package_directory, and of the package's dependencies released with it
+    """
+    if previous_tag and deliverit.history.resolve(previous_tag) is None:
+        print(warn(f"Tag {previous_tag!r} not found, using the whole history"))
+        previous_tag = None
+    commits = deliverit.history.touching(
+        deliverit.history.commits_between(previous_tag), package_directory
+    )
+    sections = deliverit.history.group_by_section(commits)
+    if updated_dependencies:
+        sections.setdefault("changed", []).append(
+            f"dependencies: {', '.join(updated_dependencies)}"
+        )
+    return {
+        section: sections[section]
+        for section in deliverit.history.SECTIONS_ORDER
+        if section in sections
+    }
+
+
+def _with_entries(
+    current: dict[str, Any], sections: dict[str, list[str]]
+) -> dict[str, Any]:
+    """Adds entries to the Unreleased version of a keepachangelog dict"""
+    if "Unreleased" not in current:
+        current = {
+            "Unreleased": {"version": "Unreleased", "release_date": None},
+            **current,
+        }
+    for section, entries in sections.items():
+        existing = current["Unreleased"].setdefault(section, [])
+        existing += [entry for entry in entries if entry not in existing]
+    return current
+
+
+def update(
+    ctx: Context,
+    changelog_path: str,
+    tag_template: str,
+    release_notes_from: str = "changelog",
+    previous_tag: Optional[str] = None,
+    files: Optional[FileTransaction] = None,
+    package_directory: str = "",
+    updated_dependencies: Optional[list[str]] = None,
+):
+    """
+    Releases the Unreleased changes of the changelog.
+    With release_notes_from="commits", changes are first added from conventional commits made since previous_tag
+    that changed files in package_directory, and from the dependencies released with the package.
+    The changelog is modified through `files`, or atomically on its own if not given.
+    """
+    if files is None:
+        with FileTransaction() as files:
+            return update(
+                ctx,
+                changelog_path,
+                tag_template,
+                release_notes_from,
+                previous_tag,
+                files,
+                package_directory,
+                updated_dependencies,
+            )
+
+    exists = Path(changelog_path).is_file()
+    # chachacha modifies the file in place: give it a staged copy
+    staged_path = files.path_for_update(changelog_path)
+    changelog = ChangelogFormat(staged_path)
+    if not exists:
+        changelog.init(overwrite=True)
+    # Changelogs not created by chachacha have no configuration yet
+    changelog_config = changelog.get_config(init=True) or ChangelogConfiguration.empty()
     changelog_config.git_provider = "GH"
     changelog_config.repo_name = ctx.repository_full_name
     changelog_config.tag_template = tag_template
-    changelog.write(config=changelog_config)
+    current = None
+    if release_notes_from == "commits":
+        current = _with_entries(
+            keepachangelog.to_dict(staged_path, show_unreleased=True),
+            _sections_since(previous_tag, package_directory, updated_dependencies),
+        )
+    changelog.write(current=current, config=changelog_config)
     try:
         changelog.release(ctx.version_bump)
     except SystemExit:
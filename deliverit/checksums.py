@@ -0,0 +1,61 @@
+"""
+Functions related to release assets' checksums
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, BinaryIO
+from pathlib import Path
+import hashlib
+import os
+
+# Names of the checksums files, by algorithm
+CHECKSUMS_FILENAMES = {
+    "md5": "MD5SUMS",
+    "sha1": "SHA1SUMS",
+    "sha256": "SHA256SUMS",
+    "sha512": "SHA512SUMS",
+}
+
+
+class HashingReader:
+    """
+    Wraps a binary file so that everything read from it goes through
+    one or more hash functions: the digests are computed while the file
+    is read (e.g. by an upload), in one pass and in constant memory.
+    """
+
+    def __init__(self, fileobj: BinaryIO, algorithms: list[str]) -> None:
+        self._fileobj = fileobj
+        self._size = os.fstat(fileobj.fileno()).st_size
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._fileobj.read(size)
+        for hash in self.hashes.values():
+            hash.update(chunk)
+        return chunk
+
+    def __len__(self) -> int:
+        return self._size
+
+    def hexdigests(self) -> dict[str, str]:
+        return {algorithm: hash.hexdigest() for algorithm, hash in self.hashes.items()}
+
+
+def hash_file(
+    filepath: str, algorithms: list[str], chunk_size: int = 1 << 20
+) -> dict[str, str]:
+    """Computes the file's digests without uploading it"""
+    with open(filepath, "rb") as file:
+        reader = HashingReader(file, algorithms)
+        while reader.read(chunk_size):
+            pass
+    return reader.hexdigests()
+
+
+def format_checksums(digests: dict[str, str]) -> str:
+    """
+    Formats {filename: hexdigest} like sha256sum and friends do,
+    so that `sha256sum --check SHA256SUMS` works
+    """
+    return "".join(f"{digest}  {name}\n" for name, digest in sorted(digests.items()))
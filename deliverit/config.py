@@ -13,6 +13,8 @@ BASE_DEFAULTS = {
     "package_name": None,  # used when manifest_file == None
     "manifest_file": None,
     "repository_url": None,
+    "remote": None,
+    "remote_api_url": None,
     "registry": None,
     "commit_message": "Release {new}",
     "tag_name": "v{new}",
@@ -26,12 +28,19 @@ BASE_DEFAULTS = {
             "delete_after": True,
         }
     ],
+    "release_checksums": [],
+    "sign_checksums_with": None,
     "changelog": "CHANGELOG.md",
+    "release_notes_from": "changelog",
     "version_declarations": [],
+    "packages": [],
+    "publish_concurrency": 4,
+    "secrets": [],
+    "sync_release": False,
     "steps": {
         "update_changelog": True,
         "update_code_version": True,
-        "bump_manifest_version": "",
+        "bump_manifest_version": True,
         "git_add": True,
         "git_commit": True,
         "git_tag": True,
@@ -50,7 +59,6 @@ LANGUAGE_BASED_DEFAULTS = {
         "manifest_file": "package.json",
         "registry": "npmjs.com",
         "steps": {
-            "bump_manifest_version": "npm version {bump}",
             "publish_to_registry": "npm publish {package}-{new}.tar.gz",
         },
     },
@@ -88,7 +96,7 @@ LANGUAGE_BASED_DEFAULTS = {
 class Steps(BaseModel):
     update_changelog: Union[bool, str] = True
     update_code_version: Union[bool, str] = True
-    bump_manifest_version: str = ""
+    bump_manifest_version: Union[bool, str] = True
     git_add: bool = True
     git_commit: bool = True
     git_tag: bool = True
@@ -119,14 +127,29 @@ class Configuration(BaseModel):
     package_name: Optional[str]
     manifest_file: Optional[str]
     repository_url: Optional[str]
+    # github, gitlab or gitea. Detected from repository_url if not set
+    remote: Optional[str] = None
+    # Detected from repository_url if not set
+    remote_api_url: Optional[str] = None
     registry: Optional[str]
     commit_message: Optional[str]
     tag_name: Optional[str]
     milestone_title: Optional[str]
     release_title: Optional[str]
     changelog: Optional[str]
+    release_notes_from: str = "changelog"
     release_assets: list[ReleaseAsset]
+    release_checksums: list[str] = []
+    sign_checksums_with: Optional[str] = None
     version_declarations: list[VersionDeclaration]
+    # Manifest files of the packages, when the repository has several
+    packages: list[str] = []
+    # How many packages can be published at the same time
+    publish_concurrency: int = 4
+    # Environment variables whose values are hidden from the output
+    secrets: list[str] = []
+    # Reuse the release if it exists, only upload the assets it does not have already
+    sync_release: bool = False
     steps: Steps
 
 
@@ -218,26 +241,20 @@ def apply_defaults(user_config: dict[str, Any], has_git_remote: bool) -> dict[st
 def _to_models(config: dict[str, Any]) -> Configuration:
     config["release_assets"] = [ReleaseAsset(**i) for i in config["release_assets"]]
     config["steps"] = Steps(**config["steps"])
+    # Language defaults are not sanitized: their "in" becomes "in_" too
     config["version_declarations"] = [
-        VersionDeclaration(**i) for i in _remove_trailing_underscore_from_keys(config["version_declarations"])
+        VersionDeclaration(**sanitize_keys(i)) for i in config["version_declarations"]
     ]
     return Configuration(**config)
 
-def _remove_trailing_underscore_from_keys(o: dict[str, Any]) -> dict[str, Any]:
-    new_dict = smart_deepcopy(o)
-    for key, value in o.items():
-        if isinstance(value, dict):
-            value = _remove_trailing_underscore_from_keys(value)
-        new_dict[key.removesuffix("_")] = value
-    return new_dict
-
 
 def override_with_cli_args(
     config: dict[str, Any], cli_args: dict[str, Any]
 ) -> dict[str, Any]:
     for key, value in cli_args.items():
         config_key = key.replace("--", "").replace("-", "_")
-        if config_key in BASE_DEFAULTS.keys() and value is not None:
+        # Flags that are not given are False, they don't override anything either
+        if config_key in BASE_DEFAULTS.keys() and value not in (None, False):
             config = {
                 **config,
                 **yaml.load(f"{config_key}: {value}", Loader=yaml.SafeLoader),
@@ -245,14 +262,43 @@ def override_with_cli_args(
     return config
 
 
+# (resolved path, mtime in ns) -> parsed configuration file
+_cache: dict[tuple[str, int], Any] = {}
+
+
+def read(filepath: str) -> dict[str, Any]:
+    """
+    Parses the configuration file. Parsed files are cached until they get modified.
+    """
+    resolved = Path(filepath).resolve()
+    key = (str(resolved), resolved.stat().st_mtime_ns)
+    if key not in _cache:
+        for cached_key in [k for k in _cache if k[0] == key[0]]:
+            del _cache[cached_key]
+        _cache[key] = yaml.load(
+            resolved.read_text(encoding="utf-8"), Loader=yaml.SafeLoader
+        )
+    return smart_deepcopy(_cache[key])
+
+
+def cached(filepaths: list[str]) -> dict[tuple[str, int], Any]:
+    """The cache entries of the files among filepaths, to preload() in another process"""
+    resolved = {str(Path(filepath).resolve()) for filepath in filepaths}
+    return {key: parsed for key, parsed in _cache.items() if key[0] in resolved}
+
+
+def preload(entries: dict[tuple[str, int], Any]):
+    """Adds files parsed by another process to the cache (see deliverit.server)"""
+    _cache.update(entries)
+
+
 def load(
     filepath: str, cli_args: dict[str, Any], has_git_remote: bool
 ) -> Configuration:
     if not Path(filepath).exists():
         return _to_models(resolve_defaults_steps(BASE_DEFAULTS, has_git_remote))
 
-    config = Path(filepath).read_text(encoding="utf-8")
-    config = yaml.load(config, Loader=yaml.SafeLoader)
+    config = read(filepath)
     config = sanitize_keys(config)
     config = apply_defaults(config, has_git_remote)
     config = override_with_cli_args(config, cli_args)
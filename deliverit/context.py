@@ -16,6 +16,9 @@ class Context(BaseModel):
     repository_full_name: Optional[str] = None
     repository_name: Optional[str] = None
     repository_owner: Optional[str] = None
+    # The host of the repository (see deliverit.remotes) and its API's URL
+    remote: Optional[str] = None
+    remote_api_url: Optional[str] = None
     new_version: Optional[Version] = None
     old_version: Optional[Version] = None
     version_bump: Optional[str] = None
@@ -1,15 +1,32 @@
 """Release new versions of your package with ease.
 
 Usage:
-    deliverit (major|minor|patch) [-y] [options] [--disable-step=STEP_ID...]
+    deliverit (major|minor|patch|auto) [-y] [options] [--disable-step=STEP_ID...]
+    deliverit affected [options]
+    deliverit serve [--socket=PATH] [--max-jobs=N] [options]
+    deliverit fleet FLEET_FILE [--retry-failed] [--max-jobs=N] [options] [--disable-step=STEP_ID...]
+    deliverit --execute-plan=FILEPATH [-y] [options]
 
 Options:
     -y --yes                   Don't ask for confirmation before each step
     --verbose                  Show more info
     --debug                    Show even more info
-    --dry-run                  Don't actually run commands
+    --dry-run                  Show the changes, commands and API calls of the release without making any
     --config-file=FILEPATH     Path to the configuration file.
+    --skip-preflight           Don't check that the release can go through before starting it
+    --sync-release             Keep the release if it exists already, only upload the assets it is missing or that changed
+    --plan=FILEPATH            Save every step of the release to FILEPATH, ask to approve it once, and stop
+    --execute-plan=FILEPATH    Run a plan saved with --plan. Approved plans run without confirmations
     -! --disable-step=STEP_ID  Disables the step with id STEP_ID. See Step IDs
+    --metrics-file=FILEPATH    Write metrics to FILEPATH in the Prometheus text format (e.g. for node_exporter's textfile collector)
+    --metrics-push=URL         Push metrics to the Prometheus Pushgateway at URL
+    --cassette=FILEPATH        Record the API calls to FILEPATH, or replay them from it if it exists, offline
+    --cassette-latency=SECONDS Add SECONDS to each replayed API call ("recorded" to take as long as when recording)
+    --cassette-rate-limit=CALLS/SECONDS  Simulate a rate limit of CALLS API calls every SECONDS when replaying
+    --profile                  Profile the CPU time and memory allocations of each step, see Profiles
+    --socket=PATH              The unix socket deliverit serve listens on, $XDG_RUNTIME_DIR/deliverit.sock by default
+    --max-jobs=N               How many releases deliverit serve or deliverit fleet run at the same time [default: 4]
+    --retry-failed             Only release the repositories of the fleet whose release failed in the previous run
 
 Configuration file overrides:
     --language=TEXT            The package's programming language
@@ -20,7 +37,7 @@ Configuration file overrides:
     --commit-message=TEXT      *The bump commit's message.
     --tag-name=TEXT            *The git tag's name.
     --milestone-title=TEXT     *The title of the milestone to close
-    --release-title=TEXT       *The github release's title
+    --release-title=TEXT       *The release's title
     --changelog=FILE           The changelog file's location (must follow the Keep A Changelog standard)
 
 Placeholders: (available to *-marked options)
@@ -31,43 +48,71 @@ Placeholders: (available to *-marked options)
     {repo} is the repository's name (WITHOUT the owner part)
     {owner} is the repository's owner name (or the organization's name).
     {repo_url} is the repository's full URL
+
+Bumps:
+    auto infers the bump from the conventional commits that changed the package
+    since the latest tag: major if any is breaking, minor for features, patch for fixes.
+
+Fleets:
+    deliverit fleet releases every repository listed in FLEET_FILE, one per line,
+    followed by the bump (auto if omitted), e.g. "../http-client patch".
+    The outcome of each release is saved to FLEET_FILE.report.json.
+
+Profiles:
+    Profiling writes a CPU profile of each step, readable with pstats or snakeviz, and a summary
+    of the steps' time (in deliverit, waiting for commands, waiting for the rest) and of the
+    functions and lines that took the most time and memory, to $XDG_STATE_HOME/deliverit/profiles.
+    Steps run one after the other while profiled.
+
+Packages:
+    When packages is set, only the packages that changed since their latest tag
+    (and the packages that depend on them) are released.
+    deliverit affected lists their manifest files.
 """
+
+from __future__ import annotations
+
 # TODO: custom commands
 # TODO: rename version_declarations: to codemods:
 # TODO: codemods.in: support glob patterns
 
 from urllib.parse import urlparse
-from deliverit.changelog import get_release_notes_for_version
-from deliverit.version import Version, get_current_version_from_git_tag
-from deliverit.git_remote import (
-    close_milestone,
-    create_github_release,
-    is_hosted_on_github,
-    split_repository_name,
-    upload_assets_to_release,
+from deliverit.version import (
+    Version,
+    get_current_version_from_git_tag,
+    get_latest_tag,
 )
-from deliverit.git import get_latest_commit_hash
-from os import getenv
+from deliverit.git_remote import split_repository_name
 from pathlib import Path
-from subprocess import CalledProcessError
-from __future__ import annotations
-from typing import Union, Optional, Any
+import os
+from typing import Union, Optional, Any, Callable
 
 from docopt import docopt
 from dotenv import load_dotenv
-from github.MainClass import Github
 
 from deliverit.context import Context
 import deliverit
 import deliverit.manifest_file
 import deliverit.config
 import deliverit.changelog
+import deliverit.history
+import deliverit.monorepo
 import deliverit.version_declaration
+import deliverit.cassette
 import deliverit.dotenv
+import deliverit.fleet
 from deliverit.git import has_git_remote
 from deliverit.config import ConfigurationError
 from deliverit.ui import *
-from deliverit.step import make_step_function
+from deliverit.step import make_step_function, is_step_enabled
+import deliverit.metrics
+import deliverit.preflight
+import deliverit.profiling
+import deliverit.redaction
+import deliverit.remotes
+import deliverit.server
+from deliverit.rate_limit import RequestScheduler
+from deliverit.plan import Operation, Plan, ask_approval, execute
 
 
 def run():
@@ -76,20 +121,132 @@ def run():
     ctx = Context()
     ctx.debugging = args["--debug"]
 
+    # Run releases sent by other programs. Each job loads its repository's .env
+    if args["serve"]:
+        deliverit.server.serve(
+            socket_path=args["--socket"], max_jobs=int(args["--max-jobs"])
+        )
+        return
+
+    # Release many repositories. Each release loads its repository's .env
+    if args["fleet"]:
+        if not deliverit.fleet.release(
+            args["FLEET_FILE"],
+            args,
+            max_jobs=int(args["--max-jobs"]),
+            retry_failed=args["--retry-failed"],
+        ):
+            exit(1)
+        return
+
     # Check for dotenv file & load variables
     deliverit.dotenv.load(ctx)
 
+    if args["--profile"]:
+        deliverit.profiling.enable()
+
+    if args["--cassette"]:
+        deliverit.cassette.use(
+            deliverit.cassette.Cassette(
+                args["--cassette"],
+                latency=args["--cassette-latency"],
+                rate_limit=args["--cassette-rate-limit"],
+            )
+        )
+
+    # Execute an already-computed plan
+    if args["--execute-plan"]:
+        plan = Plan.load(args["--execute-plan"])
+        plan.context.debugging = ctx.debugging
+        deliverit.redaction.hide_variables(plan.secrets)
+        if not plan.approved and not args["--yes"] and not ask_approval(plan):
+            exit(1)
+        scheduler = RequestScheduler()
+        execute_and_export_metrics(plan, args, scheduler)
+        if not args["--dry-run"]:
+            print(dim(scheduler.report()))
+        return
+
     # read config file
     config_filepath = args["--config-file"] or (
         ".deliverit.yaml" if Path(".deliverit.yaml").is_file() else ".deliverit.yml"
     )
 
-    config = deliverit.config.load(
-        config_filepath, cli_args=args, has_git_remote=has_git_remote()
-    )
+    with deliverit.profiling.profile("load_configuration"):
+        config = deliverit.config.load(
+            config_filepath, cli_args=args, has_git_remote=has_git_remote()
+        )
+    deliverit.redaction.hide_variables(config.secrets)
+
+    if args["affected"]:
+        if not config.packages:
+            raise ConfigurationError("Set packages to list the affected packages")
+        packages = deliverit.monorepo.load_packages(config.packages)
+        for package in deliverit.monorepo.affected_packages(packages, config.tag_name):
+            print(package.manifest_file)
+        return
+
+    # Connects to the repository's host once it is known
+    scheduler = RequestScheduler()
+
+    # Plan every step of the release
+    with deliverit.profiling.profile("plan"):
+        if config.packages:
+            plan = Plan(context=ctx)
+            if not plan_packages_releases(args, config, ctx, scheduler, plan):
+                print("No package changed since its latest release.")
+                return
+        else:
+            resolve_package(ctx, config)
+            if not resolve_version_bump(args, ctx, config):
+                print("No changes that need a new version.")
+                return
+            print_release_summary(ctx, config)
+            check_release(args, ctx, config, scheduler)
+            plan = Plan(context=ctx)
+            plan_release(args, config, ctx, plan)
+
+    plan.secrets = config.secrets
+    if args["--plan"]:
+        if args["--yes"] or ask_approval(plan):
+            plan.approved = True
+        plan.save(args["--plan"])
+        print(
+            f"\nSaved the plan to {em(args['--plan'])}"
+            + (
+                f", run it with {em('deliverit --execute-plan=' + args['--plan'])}"
+                if plan.approved
+                else dim(" (not approved)")
+            )
+        )
+        return
+
+    execute_and_export_metrics(plan, args, scheduler)
+    if not args["--dry-run"]:
+        print(dim(scheduler.report()))
 
+
+def execute_and_export_metrics(
+    plan: Plan, args: dict[str, Any], scheduler: RequestScheduler
+):
+    """Executes the plan, then exports the metrics if asked to, even if the release failed"""
+    succeeded = False
+    try:
+        execute(plan, args, scheduler)
+        succeeded = True
+    finally:
+        if args["--metrics-file"] or args["--metrics-push"]:
+            try:
+                deliverit.metrics.export(
+                    args["--metrics-file"], args["--metrics-push"], succeeded
+                )
+            except OSError as error:
+                print(warn(f"Could not export the metrics: {error}"))
+
+
+def resolve_package(ctx: Context, config: deliverit.config.Configuration):
+    """Fills ctx with the package's info, from the manifest file or the configuration"""
     # Read manifest file to get some info
-    # TODO: support multiple manifest files
     (
         ctx.old_version,
         ctx.package_name,
@@ -98,23 +255,33 @@ def run():
 
     if ctx.old_version is None and config.tag_name is None:
         raise ConfigurationError("Please set either manifest_file or tag_name")
-    ctx.old_version = ctx.old_version or get_current_version_from_git_tag(
-        tag_template=config.tag_name, fallback_version=Version(0, 1, 0)
-    )
     ctx.package_name = ctx.package_name or config.package_name
     if ctx.package_name is None:
         raise ConfigurationError(
             "Could not detect the package name. Set it explicitly with package_name"
         )
+    ctx.old_version = ctx.old_version or get_current_version_from_git_tag(
+        tag_template=deliverit.monorepo.tag_template_for(
+            config.tag_name, ctx.package_name
+        ),
+        fallback_version=Version(0, 1, 0),
+    )
     ctx.repository_url = ctx.repository_url or config.repository_url
     if ctx.repository_url is None:
         raise ConfigurationError(
-            "Could not detect the github repository's URL. Set it explicitly with repository_url"
+            "Could not detect the repository's URL. Set it explicitly with repository_url"
         )
 
-    # Check if repository is hosted on github
-    if not is_hosted_on_github(ctx.repository_url):
-        raise NotImplementedError("Your repository is not hosted on github")
+    # Find out where the repository is hosted
+    ctx.remote = config.remote or deliverit.remotes.detect(ctx.repository_url)
+    if ctx.remote not in deliverit.remotes.REMOTES:
+        raise ConfigurationError(
+            f"Could not tell where {ctx.repository_url} is hosted. "
+            f"Set remote to one of {', '.join(deliverit.remotes.REMOTES)}"
+        )
+    ctx.remote_api_url = config.remote_api_url or deliverit.remotes.default_api_url(
+        ctx.remote, ctx.repository_url
+    )
 
     # Get the repository name
     ctx.repository_owner, ctx.repository_name = split_repository_name(
@@ -122,26 +289,46 @@ def run():
     )
     ctx.repository_full_name = f"{ctx.repository_owner}/{ctx.repository_name}"
 
-    # Compute new version
+
+def resolve_version_bump(
+    args: dict[str, Any],
+    ctx: Context,
+    config: deliverit.config.Configuration,
+    at_least: Optional[str] = None,
+    inferred_bumps: Optional[dict[str, Optional[str]]] = None,
+) -> bool:
+    """
+    Computes the new version. Returns False if there is nothing to release
+    (with the auto bump, when no commit calls for a new version).
+    inferred_bumps maps package names to their bump inferred beforehand, for all packages at once
+    """
     ctx.version_bump = (
         "major"
         if args["major"]
-        else "minor"
-        if args["minor"]
-        else "patch"
-        if args["patch"]
-        else None
+        else "minor" if args["minor"] else "patch" if args["patch"] else None
     )
+    if args["auto"]:
+        inferred = (
+            inferred_bumps.get(ctx.package_name)
+            if inferred_bumps is not None
+            else infer_version_bump(ctx, config)
+        )
+        ctx.version_bump = deliverit.history.BUMPS_ORDER[
+            max(
+                deliverit.history.BUMPS_ORDER.index(inferred),
+                deliverit.history.BUMPS_ORDER.index(at_least),
+            )
+        ]
+        if ctx.version_bump is None:
+            return False
     if ctx.version_bump is None:
         raise ValueError("No version bump specified.")
     ctx.new_version = ctx.old_version.bump(ctx.version_bump)
+    return True
 
-    # Compute some configurable values
-    version_tag = config.tag_name.format(new=ctx.new_version)
 
-    # Log info
-    print(
-        f"""\
+def print_release_summary(ctx: Context, config: deliverit.config.Configuration):
+    print(f"""\
 Releasing a new {em(ctx.version_bump)} version!
 
      Upgrading package {em(ctx.package_name)} by {em(ctx.repository_owner)}
@@ -149,36 +336,192 @@ Releasing a new {em(ctx.version_bump)} version!
           published on {em(config.registry)}
           from version {em(ctx.old_version)}
             to version {em(ctx.new_version)}
-"""
+""")
+
+
+def check_release(
+    args: dict[str, Any],
+    ctx: Context,
+    config: deliverit.config.Configuration,
+    scheduler: RequestScheduler,
+):
+    """Makes sure the release can go through before changing anything"""
+    if not args["--skip-preflight"] and not deliverit.preflight.run(
+        ctx, config, scheduler, lambda id: is_step_enabled(args, config, id)
+    ):
+        print(red("Some checks failed, nothing was changed."))
+        exit(1)
+
+
+def plan_packages_releases(
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    ctx: Context,
+    scheduler: RequestScheduler,
+    plan: Plan,
+) -> bool:
+    """
+    Plans the release of each package of config.packages that changed since its latest tag,
+    or that depends on one that did. Returns False if there is nothing to release.
+    """
+    packages = deliverit.monorepo.load_packages(config.packages)
+    changed = deliverit.monorepo.changed_packages(packages, config.tag_name)
+    affected = deliverit.monorepo.with_dependents(packages, set(changed))
+    levels = deliverit.monorepo.dependency_levels(
+        [package for package in packages if package.name in affected]
+    )
+    # Inferred for every package at once, sharing the tags and history they have in common
+    inferred_bumps = (
+        deliverit.monorepo.inferred_bumps(
+            [package for level in levels for package in level], config.tag_name
+        )
+        if args["auto"]
+        else None
     )
 
-    # Make the step function
-    step = make_step_function(args, config)
+    # Commit, tag and push each package's release one after the other, dependencies first
+    stage = 0
+    releases = []
+    # package name -> "name version" of the dependencies released with it
+    updated_dependencies: dict[str, list[str]] = {}
+    for package in (package for level in levels for package in level):
+        package_config = config.copy(update={"manifest_file": package.manifest_file})
+        package_ctx = ctx.copy()
+        resolve_package(package_ctx, package_config)
+        # Packages depending on released packages need at least a patch
+        updated_dependencies[package.name] = [
+            f"{dependency.name} {dependency_ctx.new_version}"
+            for dependency, _, dependency_ctx in releases
+            if dependency.name in package.dependencies
+        ]
+        at_least = "patch" if updated_dependencies[package.name] else None
+        if not resolve_version_bump(
+            args, package_ctx, package_config, at_least, inferred_bumps
+        ):
+            continue
+        print_release_summary(package_ctx, package_config)
+        check_release(args, package_ctx, package_config, scheduler)
+        stage = plan_release_commit(
+            args,
+            package_config,
+            package_ctx,
+            plan,
+            stage,
+            updated_dependencies[package.name],
+        )
+        releases.append((package, package_config, package_ctx))
+
+    # Then publish them level by level: packages of a level only depend on packages of previous levels,
+    # and are published concurrently
+    for level in levels:
+        names = {package.name for package in level}
+        for package, package_config, package_ctx in releases:
+            if package.name in names:
+                plan_release_publication(
+                    args,
+                    package_config,
+                    package_ctx,
+                    plan,
+                    stage,
+                    updated_dependencies[package.name],
+                )
+        stage += 2
+
+    plan.dependencies = {
+        package.name: package.dependencies for package, _, _ in releases
+    }
+    plan.concurrency = config.publish_concurrency
+    return bool(releases)
+
+
+def plan_release(
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    ctx: Context,
+    plan: Plan,
+):
+    """Adds the release's steps to the plan"""
+    stage = plan_release_commit(args, config, ctx, plan)
+    plan_release_publication(args, config, ctx, plan, stage)
+
+
+def plan_release_commit(
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    ctx: Context,
+    plan: Plan,
+    stage: int = 0,
+    updated_dependencies: Optional[list[str]] = None,
+) -> int:
+    """
+    Adds the steps up to pushing the release's tag to the plan, starting at `stage`.
+    Returns the stage the next steps should start at.
+    """
+    version_tag = ctx.apply(config.tag_name, env_aware=False)
+    previous_tag = ctx.apply(config.tag_name.replace("{new}", "{old}"), env_aware=False)
+    step = _step_function(args, config, ctx, plan)
 
     # Modify the changelog
     step(
         "update_changelog",
         "Update the changelog",
-        lambda: deliverit.changelog.update(
-            ctx, ctx.apply(config.changelog), config.tag_name.replace("{new}", "{t}"),
+        Operation(
+            name="update_changelog",
+            arguments={
+                "changelog": ctx.apply(config.changelog),
+                "tag_template": ctx.apply(
+                    config.tag_name.replace("{new}", "{{t}}"), env_aware=False
+                ),
+                "release_notes_from": config.release_notes_from,
+                "previous_tag": previous_tag,
+                "package_directory": package_directory(config),
+                "updated_dependencies": updated_dependencies or [],
+            },
         ),
+        stage=stage,
     )
 
     # Codemods
-    for declaration in config.version_declarations:
+    for i, declaration in enumerate(config.version_declarations):
         new_content = ctx.apply(declaration.replace)
         step(
             "update_code_version",
             f"Replace {declaration.search} with {new_content} in {ctx.apply(declaration.in_)}",
-            lambda: deliverit.version_declaration.update(ctx, declaration),
+            Operation(
+                name="update_code_version",
+                arguments={"declaration": declaration.dict()},
+            ),
+            stage=stage + 1 + i,
         )
+    stage += 1 + len(config.version_declarations)
 
     # Bump version
-    step(
-        "bump_manifest_version",
-        "Bump the poetry version",
-        command=ctx.apply(config.steps.bump_manifest_version),
-    )
+    manifest_files = [config.manifest_file] if config.manifest_file else []
+    if isinstance(config.steps.bump_manifest_version, str):
+        step(
+            "bump_manifest_version",
+            f"Bump the version in {config.manifest_file}",
+            # The shell expands environment variables, don't write them in plans
+            command=ctx.apply(config.steps.bump_manifest_version, env_aware=False),
+            stage=stage,
+        )
+    else:
+        step(
+            "bump_manifest_version",
+            f"Bump the version in {config.manifest_file}",
+            Operation(
+                name="bump_manifest_version",
+                arguments={"manifest_file": config.manifest_file},
+            ),
+            stage=stage,
+        )
+        # The version can be declared in another file (setup.cfg's attr: and file:)
+        if config.manifest_file:
+            version_filepath = deliverit.manifest_file.get_extractor(
+                config.manifest_file
+            ).version_filepath
+            if Path(version_filepath).resolve() != Path(config.manifest_file).resolve():
+                manifest_files.append(os.path.relpath(version_filepath))
 
     # Add all changes
     step(
@@ -188,9 +531,10 @@ Releasing a new {em(ctx.version_bump)} version!
             "git",
             "add",
             *[ctx.apply(f.in_) for f in config.version_declarations],
-            config.changelog,
-            config.manifest_file,
+            ctx.apply(config.changelog),
+            *manifest_files,
         ),
+        stage=stage + 1,
     )
 
     # Commit
@@ -198,80 +542,143 @@ Releasing a new {em(ctx.version_bump)} version!
         "git_commit",
         "Commit the version bump",
         command=("git", "commit", "-m", ctx.apply(config.commit_message)),
+        stage=stage + 2,
     )
 
-    # Add tag to commit
-    try:
-        latest_commit_hash = get_latest_commit_hash()
-    except CalledProcessError:
-        print(red("Could not get the latest commit's hash"))
-        exit(1)
+    # Add tag to the commit made just before
     step(
         "git_tag",
-        f"Add tag {version_tag} to commit {latest_commit_hash[:7]}",
+        f"Add tag {version_tag} to the release commit",
         command=(
             "git",
             "tag",
             "-a",
             version_tag,
-            latest_commit_hash,
+            "HEAD",
             "-m",
             ctx.apply(config.commit_message),
         ),
+        stage=stage + 3,
     )
 
     # Push
-    step("git_push", "Push changes", command=("git", "push"))
+    step("git_push", "Push changes", command=("git", "push"), stage=stage + 4)
 
-    # Push tags
+    # Push tags, once the commit they point to is pushed
     step(
         "git_push_tag",
         f"Push the tag {version_tag}",
         command=("git", "push", "origin", version_tag),
+        stage=stage + 5,
     )
 
+    return stage + 6
+
+
+def plan_release_publication(
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    ctx: Context,
+    plan: Plan,
+    stage: int,
+    updated_dependencies: Optional[list[str]] = None,
+):
+    """
+    Adds the steps that publish the release (on the registry and on GitHub) to the plan,
+    in `stage` and the next one
+    """
+    previous_tag = ctx.apply(config.tag_name.replace("{new}", "{old}"), env_aware=False)
+    step = _step_function(args, config, ctx, plan)
+
     # Build
     step(
         "build_for_registry",
         "Build for registry",
-        command=config.steps.build_for_registry,
+        command=ctx.apply(config.steps.build_for_registry, env_aware=False),
+        stage=stage,
     )
 
     # Publish
     step(
         "publish_to_registry",
         f"Publish to {config.registry}",
-        command=config.steps.publish_to_registry,
+        command=ctx.apply(config.steps.publish_to_registry, env_aware=False),
+        stage=stage + 1,
     )
 
-    # Start a Github API session
-    gh = Github(getenv("GITHUB_TOKEN"))
-
-    # Get the release notes
-    release_notes = get_release_notes_for_version(
-        ctx.new_version, Path(config.changelog).read_text("utf-8")
-    )
-
-    release = step(
+    host = deliverit.remotes.REMOTES[ctx.remote or "github"].name
+    step(
         "create_github_release",
-        "Create a GitHub release",
-        lambda: create_github_release(
-            ctx,
-            gh,
-            ctx.apply(config.tag_name),
-            ctx.apply(config.release_title),
-            message=release_notes,
+        f"Create a {host} release",
+        Operation(
+            name="create_github_release",
+            arguments={
+                "tag_name": ctx.apply(config.tag_name),
+                "title": ctx.apply(config.release_title),
+                "changelog": ctx.apply(config.changelog),
+                "release_notes_from": config.release_notes_from,
+                "previous_tag": previous_tag,
+                "sync": config.sync_release,
+                "package_directory": package_directory(config),
+                "updated_dependencies": updated_dependencies or [],
+            },
         ),
+        stage=stage,
     )
 
     step(
         "add_assets_to_github_release",
-        "Upload assets to the Github release",
-        lambda: upload_assets_to_release(ctx, release, assets=config.release_assets,),
+        f"Upload assets to the {host} release",
+        Operation(
+            name="add_assets_to_github_release",
+            arguments={
+                "tag_name": ctx.apply(config.tag_name),
+                "assets": [asset.dict() for asset in config.release_assets],
+                "checksums": config.release_checksums,
+                "sign_checksums_with": config.sign_checksums_with,
+                "sync": config.sync_release,
+            },
+        ),
+        stage=stage + 1,
     )
 
     step(
         "close_milestone",
         "Close the milestone",
-        lambda: close_milestone(ctx, gh, ctx.apply(config.milestone_title)),
+        Operation(
+            name="close_milestone",
+            arguments={"title": ctx.apply(config.milestone_title)},
+        ),
+        stage=stage,
+    )
+
+
+def _step_function(
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    ctx: Context,
+    plan: Plan,
+) -> Callable:
+    # Steps of a package of a multi-package repository carry their own context
+    return make_step_function(args, config, plan, ctx=ctx if config.packages else None)
+
+
+def infer_version_bump(
+    ctx: Context, config: deliverit.config.Configuration
+) -> Optional[str]:
+    """
+    Infers the bump from the commits since the package's latest tag
+    that changed files in the manifest file's directory
+    """
+    latest = get_latest_tag(
+        deliverit.monorepo.tag_template_for(config.tag_name, ctx.package_name)
+    )
+    commits = deliverit.history.commits_between(latest[0] if latest else None)
+    return deliverit.history.infer_bumps(commits, {"": package_directory(config)})[""]
+
+
+def package_directory(config: deliverit.config.Configuration) -> str:
+    """The directory of the package's manifest file, relative to the repository's root"""
+    return deliverit.history.path_in_repository(
+        str(Path(config.manifest_file or ".").parent)
     )
@@ -3,9 +3,11 @@ from typing import Union, Optional, Any
 from pathlib import Path
 from os import getenv
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
 
+import deliverit.redaction
 from deliverit.context import Context
+from deliverit.remotes import TOKEN_VARIABLES
 from deliverit.ui import MESSAGE_NO_VALID_DOTENV_FILE
 
 
@@ -16,8 +18,15 @@ def load(ctx: Context):
         raise FileNotFoundError(MESSAGE_NO_VALID_DOTENV_FILE)
 
     load_dotenv(".env")
+    # .env files hold credentials: don't print any of them
+    deliverit.redaction.hide(*dotenv_values(".env").values())
+    deliverit.redaction.hide_variables(deliverit.redaction.SECRET_VARIABLES)
 
     if not all(
-        (getenv("GITHUB_TOKEN"), getenv("PYPI_USERNAME"), getenv("PYPI_PASSWORD"))
+        (
+            any(getenv(variable) for variable in TOKEN_VARIABLES.values()),
+            getenv("PYPI_USERNAME"),
+            getenv("PYPI_PASSWORD"),
+        )
     ):
         raise ValueError(MESSAGE_NO_VALID_DOTENV_FILE)
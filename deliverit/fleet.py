@@ -0,0 +1,225 @@
+"""
+deliverit fleet: releases many repositories at once, e.g. to ship a dependency bump everywhere.
+
+The fleet file lists one repository per line, with the bump to release (auto by default):
+
+    ../http-client patch
+    ../json-schema minor
+    # comments and blank lines are ignored
+    ../cli-helpers
+
+Each release runs in its own process, up to --max-jobs at the same time. Like deliverit serve's
+jobs, they are forked from a single-threaded fork server, not from the fleet's threads
+(see deliverit.server). They share the rate limit budgets of their tokens
+(see deliverit.rate_limit.SharedBudget).
+The outcome of every release is saved to a report next to the fleet file, so that the ones
+that failed can be released again with --retry-failed.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from datetime import datetime
+from pathlib import Path
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+
+from pydantic import BaseModel
+
+from deliverit.rate_limit import SharedBudget
+from deliverit.server import default_logs_directory, run_job
+from deliverit.ui import *
+
+BUMPS = ("major", "minor", "patch", "auto")
+# Options given to deliverit fleet that are passed on to each release
+PASSED_ON_FLAGS = (
+    "--verbose",
+    "--debug",
+    "--dry-run",
+    "--skip-preflight",
+    "--sync-release",
+    "--profile",
+)
+
+
+class FleetRelease(BaseModel):
+    repository: str
+    bump: str = "auto"
+    # pending, running, succeeded or failed
+    state: str = "pending"
+    exit_code: Optional[int] = None
+    duration: Optional[float] = None
+    log: Optional[str] = None
+
+
+class FleetReport(BaseModel):
+    releases: list[FleetRelease]
+
+    def save(self, filepath: str):
+        Path(filepath).write_text(self.json(indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, filepath: str) -> "FleetReport":
+        return cls.parse_file(filepath)
+
+
+def report_path(fleet_file: str) -> str:
+    return f"{fleet_file}.report.json"
+
+
+def read(fleet_file: str) -> list[FleetRelease]:
+    """The releases listed in fleet_file. Paths are relative to the file's directory"""
+    releases = []
+    directory = Path(fleet_file).resolve().parent
+    for number, line in enumerate(
+        Path(fleet_file).read_text(encoding="utf-8").splitlines(), start=1
+    ):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        repository, _, bump = line.rpartition(" ")
+        if bump not in BUMPS:
+            repository, bump = line, "auto"
+        repository = repository.strip()
+        if not (directory / repository).is_dir():
+            raise ValueError(f"{fleet_file}:{number}: {repository} is not a directory")
+        releases.append(
+            FleetRelease(repository=str((directory / repository).resolve()), bump=bump)
+        )
+    return releases
+
+
+def release(
+    fleet_file: str,
+    args: dict[str, Any],
+    max_jobs: int = 4,
+    retry_failed: bool = False,
+) -> bool:
+    """
+    Releases the repositories of fleet_file (only the ones that did not succeed
+    in the previous run with retry_failed), prints a summary and returns whether they all succeeded
+    """
+    report_file = report_path(fleet_file)
+    if retry_failed:
+        if not Path(report_file).is_file():
+            print(red(f"No report of a previous run at {report_file}"))
+            exit(1)
+        report = FleetReport.load(report_file)
+    else:
+        report = FleetReport(releases=read(fleet_file))
+    to_release = [r for r in report.releases if r.state != "succeeded"]
+    if not to_release:
+        print("Every repository has been released already.")
+        return True
+
+    release_args = [flag for flag in PASSED_ON_FLAGS if args.get(flag)]
+    release_args += [f"--disable-step={id}" for id in args.get("--disable-step", [])]
+    logs_directory = default_logs_directory()
+    logs_directory.mkdir(parents=True, exist_ok=True)
+    processes = multiprocessing.get_context("forkserver")
+    processes.set_forkserver_preload(["deliverit.deliverit"])
+    lock = threading.Lock()
+    finished = 0
+    started_at = time.perf_counter()
+
+    def run(fleet_release: FleetRelease):
+        nonlocal finished
+        fleet_release.state = "running"
+        fleet_release.log = str(logs_directory / f"{uuid.uuid4().hex[:12]}.log")
+        release_started_at = time.perf_counter()
+        process = processes.Process(
+            target=run_job,
+            args=(
+                fleet_release.repository,
+                # Nobody can answer prompts
+                [fleet_release.bump, "--yes", *release_args],
+                fleet_release.log,
+                None,
+                budget,
+            ),
+        )
+        process.start()
+        process.join()
+        fleet_release.exit_code = process.exitcode
+        fleet_release.state = "succeeded" if process.exitcode == 0 else "failed"
+        fleet_release.duration = time.perf_counter() - release_started_at
+        with lock:
+            finished += 1
+            print(
+                dim(f"[{finished}/{len(to_release)}] ")
+                + f"{fleet_release.repository}: "
+                + (
+                    green(fleet_release.state)
+                    if fleet_release.state == "succeeded"
+                    else red(fleet_release.state)
+                )
+                + dim(f" ({fleet_release.duration:.0f}s)")
+            )
+            # Saved after each release, so that an interrupted run can be retried too
+            report.save(report_file)
+
+    print(
+        f"Releasing {em(str(len(to_release)))} {'repositories' if len(to_release) > 1 else 'repository'}, "
+        f"{em(str(min(max_jobs, len(to_release))))} at a time"
+        + dim(f" (logs in {logs_directory})")
+    )
+    with processes.Manager() as manager:
+        budget = SharedBudget(manager, manager.Lock())
+        try:
+            pending: queue.SimpleQueue[FleetRelease] = queue.SimpleQueue()
+            for fleet_release in to_release:
+                pending.put(fleet_release)
+
+            def work():
+                while True:
+                    try:
+                        run(pending.get_nowait())
+                    except queue.Empty:
+                        return
+
+            workers = [threading.Thread(target=work) for _ in range(max_jobs)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            print_budgets(budget)
+        finally:
+            for fleet_release in to_release:
+                if fleet_release.state == "running":
+                    fleet_release.state = "failed"
+            report.save(report_file)
+
+    return print_summary(fleet_file, report, time.perf_counter() - started_at)
+
+
+def print_budgets(budget: SharedBudget):
+    """Prints the rate limit budgets left, by host"""
+    for (api_url, _), (remaining, limit, reset) in sorted(budget.items()):
+        print(
+            dim(
+                f"{api_url}: {remaining}/{limit} calls left until {datetime.fromtimestamp(reset):%H:%M}"
+            )
+        )
+
+
+def print_summary(fleet_file: str, report: FleetReport, duration: float) -> bool:
+    failed = [r for r in report.releases if r.state != "succeeded"]
+    succeeded = len(report.releases) - len(failed)
+    print(
+        f"\nReleased {em(str(succeeded))} of {em(str(len(report.releases)))} repositories"
+        + dim(f" in {duration:.0f}s")
+    )
+    if not failed:
+        return True
+    print(red(f"{len(failed)} failed:"))
+    for fleet_release in failed:
+        print(
+            f"    {fleet_release.repository} ({fleet_release.bump})"
+            + dim(f", see {fleet_release.log}" if fleet_release.log else "")
+        )
+    print(
+        f"Release them again with {em(f'deliverit fleet {fleet_file} --retry-failed')}"
+    )
+    return False
@@ -1,63 +1,274 @@
 """
-Functions related to Github (and planned support for Gitlab, Bitbucket,...)
+Functions related to the repository's host: GitHub, GitLab or Gitea (see deliverit.remotes)
 """
 
 from __future__ import annotations
 from typing import Union, Optional, Any
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from urllib.parse import urlparse
-
-import github
+import hashlib
+import io
+import mimetypes
+import shlex
+import subprocess
+import tempfile
 
 import deliverit.config
+import deliverit.metrics
+from deliverit.checksums import (
+    CHECKSUMS_FILENAMES,
+    HashingReader,
+    format_checksums,
+    hash_file,
+)
 from deliverit.context import Context
+from deliverit.rate_limit import RequestScheduler
+from deliverit.remotes import Asset, Release
 from deliverit.ui import *
 
 
-def is_hosted_on_github(repository_url: str) -> bool:
-    """
-    Checks if the repository at repository_url is hosted on github.com
-    """
-    return urlparse(repository_url).netloc == "github.com"
-
-
 def split_repository_name(repository_url: str) -> tuple[str, str]:
     """
-    Splits "owner/repo" into owner and repo
+    Splits "owner/repo" into owner and repo.
+    On GitLab, the owner can be nested groups: "group/subgroup/repo" is split into "group/subgroup" and "repo"
     """
-    repository_full_name = urlparse(repository_url).path[1:]  # remove initial slash
-    parts = repository_full_name.split("/")
-    if len(parts) != 2:
+    repository_full_name = urlparse(repository_url).path.strip("/").removesuffix(".git")
+    owner, _, repository = repository_full_name.rpartition("/")
+    if not owner or not repository:
         raise ValueError(
             f"The repository full name {repository_full_name!r} could not be split into OWNER/REPO"
         )
-    return tuple(parts)
+    return owner, repository
 
 
-def close_milestone(ctx: Context, gh: github.Github, title: str):
-    repo = gh.get_repo(ctx.repository_full_name)
-    for milestone in repo.get_milestones():
-        if milestone.title == title:
-            milestone.edit(state="closed", title=title)
-            break
-    else:
+def close_milestone(ctx: Context, scheduler: RequestScheduler, title: str):
+    remote = scheduler.connect(ctx)
+    if not scheduler.call(remote.close_milestone, ctx.repository_full_name, title):
         print(warn(f"No milestone with title {title!r} found"))
 
 
-def create_github_release(
-    ctx: Context, gh: github.Github, tag_name: str, title: str, message: str,
-) -> github.GitRelease.GitRelease:
-    repo = gh.get_repo(ctx.repository_full_name)
-    release = repo.create_git_release(tag=tag_name, name=title, message=message)
-    return release
+def create_release(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    tag_name: str,
+    title: str,
+    message: str,
+    sync: bool = False,
+) -> Release:
+    """Creates the release. With sync, a release that already exists for tag_name is kept as is"""
+    remote = scheduler.connect(ctx)
+    if sync:
+        release = scheduler.call(remote.get_release, ctx.repository_full_name, tag_name)
+        if release is not None:
+            print(dim(f"The {remote.name} release for {tag_name!r} already exists"))
+            return release
+    return scheduler.call(
+        remote.create_release, ctx.repository_full_name, tag_name, title, message
+    )
 
 
 def upload_assets_to_release(
     ctx: Context,
-    release: github.GitRelease.GitRelease,
+    scheduler: RequestScheduler,
+    release: Release,
     assets: list[deliverit.config.ReleaseAsset],
-):
+    checksums: Optional[list[str]] = None,
+    sign_checksums_with: Optional[str] = None,
+    max_workers: int = 4,
+    sync: bool = False,
+) -> dict[str, dict[str, str]]:
+    """
+    Uploads assets concurrently, computing their `checksums` (e.g. ["sha256", "sha512"])
+    while they are read for the upload.
+    A checksums file (e.g. SHA256SUMS) is then uploaded for each algorithm,
+    along with its signature if `sign_checksums_with` is set.
+    Returns the digests of each asset, by file name then by algorithm.
+
+    With sync, the files already attached to the release are listed first: the ones that
+    are identical to the assets are kept, the ones that differ are replaced.
+    """
     # TODO: handle delete_after: and create_with:
-    for asset in assets:
-        file = ctx.apply(asset.file)
-        label = ctx.apply(asset.label)
-        release.upload_asset(file, label=label)
+    algorithms = checksums or []
+    remote = scheduler.connect(ctx)
+    existing: dict[str, Asset] = {}
+    if sync:
+        existing = {
+            asset.name: asset
+            for asset in scheduler.call(
+                remote.assets, ctx.repository_full_name, release
+            )
+        }
+
+    def upload(
+        asset: deliverit.config.ReleaseAsset,
+    ) -> tuple[str, dict[str, str], str]:
+        """(file name, digests, what was done: uploaded, replaced or kept)"""
+        filepath = ctx.apply(asset.file)
+        name = Path(filepath).name
+        outcome = "uploaded"
+        if name in existing:
+            digests = _identical_file_digests(filepath, existing[name], algorithms)
+            if digests is not None:
+                deliverit.metrics.SKIPPED_BYTES.inc(Path(filepath).stat().st_size)
+                return name, digests, "kept"
+            scheduler.call(
+                remote.delete_asset, ctx.repository_full_name, release, existing[name]
+            )
+            outcome = "replaced"
+
+        def attempt() -> dict[str, str]:
+            # Start over from the beginning of the file when retrying
+            with open(filepath, "rb") as file:
+                reader = HashingReader(file, algorithms)
+                remote.upload_asset(
+                    ctx.repository_full_name,
+                    release,
+                    Path(filepath).name,
+                    reader,
+                    len(reader),
+                    content_type=mimetypes.guess_type(filepath)[0]
+                    or "application/octet-stream",
+                    label=ctx.apply(asset.label),
+                )
+            deliverit.metrics.UPLOADED_BYTES.inc(len(reader))
+            return reader.hexdigests()
+
+        return name, scheduler.call(attempt), outcome
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        uploads = list(executor.map(upload, assets))
+    digests = {name: digest for name, digest, _ in uploads}
+    if sync:
+        outcomes = Counter(outcome for _, _, outcome in uploads)
+        print(
+            dim(
+                ", ".join(
+                    f"{outcome} {count} asset{'s' if count > 1 else ''}"
+                    for outcome, count in sorted(outcomes.items())
+                ).capitalize()
+            )
+        )
+
+    for algorithm in algorithms:
+        filename = CHECKSUMS_FILENAMES.get(algorithm, f"{algorithm.upper()}SUMS")
+        contents = format_checksums(
+            {name: digest[algorithm] for name, digest in digests.items()}
+        ).encode("utf-8")
+        signed = not sign_checksums_with or any(
+            filename + extension in existing for extension in (".asc", ".sig")
+        )
+        if (
+            filename in existing
+            and signed
+            and _is_identical(existing[filename], contents)
+        ):
+            # Signing it again would only make a different signature of the same file
+            continue
+        _upload_bytes(
+            ctx, scheduler, release, filename, contents, "text/plain", existing
+        )
+        if sign_checksums_with:
+            signature = _sign(ctx, sign_checksums_with, contents)
+            if signature.startswith(b"-----BEGIN"):  # ASCII-armored
+                _upload_bytes(
+                    ctx,
+                    scheduler,
+                    release,
+                    filename + ".asc",
+                    signature,
+                    "application/pgp-signature",
+                    existing,
+                )
+            else:
+                _upload_bytes(
+                    ctx,
+                    scheduler,
+                    release,
+                    filename + ".sig",
+                    signature,
+                    "application/octet-stream",
+                    existing,
+                )
+
+    return digests
+
+
+def _upload_bytes(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    release: Release,
+    name: str,
+    contents: bytes,
+    content_type: str,
+    existing: Optional[dict[str, Asset]] = None,
+):
+    """Uploads contents as `name`, replacing the file of that name in `existing` if there is one"""
+    remote = scheduler.connect(ctx)
+    if existing and name in existing:
+        scheduler.call(
+            remote.delete_asset, ctx.repository_full_name, release, existing[name]
+        )
+    scheduler.call(
+        lambda: remote.upload_asset(
+            ctx.repository_full_name,
+            release,
+            name,
+            io.BytesIO(contents),
+            len(contents),
+            content_type=content_type,
+        )
+    )
+    deliverit.metrics.UPLOADED_BYTES.inc(len(contents))
+
+
+def _identical_file_digests(
+    filepath: str, asset: Asset, algorithms: list[str]
+) -> Optional[dict[str, str]]:
+    """
+    The file's digests by algorithm if asset is the same file, None if it differs.
+    Files of the same size are assumed to be identical when the host does not give digests.
+    """
+    if not asset.complete or asset.size != Path(filepath).stat().st_size:
+        return None
+    algorithm, _, expected = (asset.digest or "").partition(":")
+    if algorithm not in hashlib.algorithms_available:
+        expected = ""
+    # Hash the file once, for both the comparison and the checksums files
+    digests = hash_file(
+        filepath, sorted({*algorithms, *([algorithm] if expected else [])})
+    )
+    if expected and digests[algorithm] != expected.lower():
+        return None
+    return {algorithm: digests[algorithm] for algorithm in algorithms}
+
+
+def _is_identical(asset: Asset, contents: bytes) -> bool:
+    """
+    Whether asset has these contents. Without a digest it can't be told:
+    checksums files of different assets have the same size
+    """
+    algorithm, _, expected = (asset.digest or "").partition(":")
+    if algorithm not in hashlib.algorithms_available:
+        return False
+    if not expected or not asset.complete or asset.size != len(contents):
+        return False
+    return hashlib.new(algorithm, contents).hexdigest() == expected.lower()
+
+
+def _sign(ctx: Context, command: str, contents: bytes) -> bytes:
+    """
+    Runs `command` to sign contents, and returns what it wrote on stdout.
+    {checksums} is replaced with the path to a file containing `contents`.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = Path(directory) / "checksums"
+        filepath.write_bytes(contents)
+        result = subprocess.run(
+            ctx.apply(command.replace("{checksums}", shlex.quote(str(filepath)))),
+            shell=True,
+            capture_output=True,
+            check=True,
+        )
+    return result.stdout
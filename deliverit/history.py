@@ -0,0 +1,289 @@
+"""
+Functions related to the git history: reading (conventional) commits, with a persistent cache
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Iterator, NamedTuple, IO
+from pathlib import Path
+import json
+import posixpath
+import re
+import subprocess
+
+# type(scope)!: description
+CONVENTIONAL_COMMIT = re.compile(
+    r"^(?P<type>[a-zA-Z]+)(?:\((?P<scope>[^)]*)\))?(?P<breaking>!)?:\s*(?P<description>.+)$"
+)
+BREAKING_CHANGE_FOOTER = re.compile(r"^BREAKING[ -]CHANGE:", re.MULTILINE)
+
+# Commit types to Keep A Changelog sections. Other types don't appear in release notes
+TYPES_TO_SECTIONS = {
+    "feat": "added",
+    "fix": "fixed",
+    "perf": "changed",
+    "refactor": "changed",
+    "revert": "removed",
+    "security": "security",
+    "deprecate": "deprecated",
+}
+SECTIONS_ORDER = ["added", "changed", "deprecated", "removed", "fixed", "security"]
+
+BUMPS_ORDER = [None, "patch", "minor", "major"]
+
+CACHE_VERSION = 2
+# How many ranges (by base commit) to keep in the cache
+CACHE_MAX_RANGES = 16
+
+
+class Commit(NamedTuple):
+    hash: str
+    # None when the commit message does not follow the conventional commits format
+    type: Optional[str]
+    scope: Optional[str]
+    breaking: bool
+    description: str
+    # Paths changed by the commit, relative to the repository's root
+    paths: tuple[str, ...] = ()
+
+
+def parse_commit(
+    hash: str, subject: str, body: str, paths: tuple[str, ...] = ()
+) -> Commit:
+    match = CONVENTIONAL_COMMIT.match(subject)
+    if match is None:
+        return Commit(hash, None, None, False, subject, paths)
+    return Commit(
+        hash,
+        match.group("type").lower(),
+        match.group("scope") or None,
+        bool(match.group("breaking") or BREAKING_CHANGE_FOOTER.search(body)),
+        match.group("description"),
+        paths,
+    )
+
+
+def _records(
+    stream: IO[bytes], separator: bytes, chunk_size: int = 1 << 16
+) -> Iterator[bytes]:
+    """Splits the stream on separator as it is read"""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        *records, pending = (pending + chunk).split(separator)
+        yield from records
+    if pending.strip():
+        yield pending
+
+
+def walk(revision_range: str) -> Iterator[Commit]:
+    """
+    Parses the commits of `git log revision_range` (newest first), with the paths they changed,
+    while git outputs them, without holding the whole log in memory.
+    """
+    process = subprocess.Popen(
+        [
+            "git",
+            "-c",
+            "core.quotePath=false",
+            "log",
+            "--name-only",
+            "--no-renames",
+            "--format=%x1e%H%x1f%s%x1f%b%x1d",
+            revision_range,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for record in _records(process.stdout, b"\x1e"):
+            if not record:
+                continue
+            header, _, paths = record.decode("utf-8", "replace").partition("\x1d")
+            hash, subject, body = header.split("\x1f", 2)
+            yield parse_commit(
+                hash, subject, body, tuple(p for p in paths.splitlines() if p)
+            )
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def _git(*args: str) -> Optional[str]:
+    # pylint: disable=subprocess-run-check
+    result = subprocess.run(["git", *args], capture_output=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode("utf-8").strip()
+
+
+def resolve(revision: str) -> Optional[str]:
+    """The commit hash `revision` points to, None if it does not exist"""
+    return _git("rev-parse", "-q", "--verify", f"{revision}^{{commit}}")
+
+
+def path_in_repository(path: str) -> str:
+    """path (relative to the current directory), relative to the repository's root"""
+    prefix = _git("rev-parse", "--show-prefix") or ""
+    path = posixpath.normpath((Path(prefix) / path).as_posix())
+    # The root itself
+    return "" if path == "." else path
+
+
+def cache_path() -> Optional[Path]:
+    """The cache lives inside .git, so that it is never committed"""
+    git_dir = _git("rev-parse", "--git-dir")
+    if git_dir is None:
+        return None
+    return Path(git_dir) / "deliverit" / "history.json"
+
+
+def _load_cache(path: Optional[Path]) -> dict[str, Any]:
+    if path is None or not path.is_file():
+        return {}
+    try:
+        cache = json.loads(path.read_text("utf-8"))
+    except ValueError:
+        return {}
+    return cache if cache.get("version") == CACHE_VERSION else {}
+
+
+def _save_cache(path: Optional[Path], ranges: dict[str, Any]):
+    if path is None:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(
+        json.dumps({"version": CACHE_VERSION, "ranges": ranges}), "utf-8"
+    )
+    temporary.replace(path)
+
+
+def _from_cache(commit: list[Any]) -> Commit:
+    *fields, paths = commit
+    return Commit(*fields, tuple(paths))
+
+
+def commits_between(base: Optional[str], head: str = "HEAD") -> list[Commit]:
+    """
+    The commits in base..head (newest first), or all commits up to head if base is None.
+    Parsed ranges are cached: when head moved forward since the last call
+    with the same base, only the new commits are read.
+    """
+    head_hash = resolve(head)
+    if head_hash is None:
+        return []
+    base_hash = resolve(base) if base else None
+    if base and base_hash is None:
+        raise ValueError(f"{base!r} does not point to a commit")
+
+    path = cache_path()
+    ranges = _load_cache(path).get("ranges", {})
+    cached = ranges.get(base_hash or "")
+    if cached and cached["head"] == head_hash:
+        return [_from_cache(c) for c in cached["commits"]]
+
+    if (
+        cached
+        and _git("merge-base", "--is-ancestor", cached["head"], head_hash) is not None
+    ):
+        commits = list(walk(f"{cached['head']}..{head_hash}")) + [
+            _from_cache(c) for c in cached["commits"]
+        ]
+    else:
+        commits = list(walk(f"{base_hash}..{head_hash}" if base_hash else head_hash))
+
+    # Re-insert to mark it as the most recently used
+    ranges.pop(base_hash or "", None)
+    ranges[base_hash or ""] = {"head": head_hash, "commits": commits}
+    while len(ranges) > CACHE_MAX_RANGES:
+        del ranges[next(iter(ranges))]
+    _save_cache(path, ranges)
+    return commits
+
+
+def touching(commits: list[Commit], directory: str) -> list[Commit]:
+    """The commits that changed files in directory, relative to the repository's root ("" for all of it)"""
+    directory = directory.strip("/")
+    if not directory:
+        return commits
+    return [
+        commit
+        for commit in commits
+        if any(path.startswith(directory + "/") for path in commit.paths)
+    ]
+
+
+def group_by_section(commits: list[Commit]) -> dict[str, list[str]]:
+    """
+    Groups conventional commits into Keep A Changelog sections ("added", "fixed", etc.)
+    """
+    sections: dict[str, list[str]] = {}
+    for commit in reversed(commits):  # oldest first
+        section = TYPES_TO_SECTIONS.get(commit.type)
+        if section is None and not commit.breaking:
+            continue
+        entry = (
+            f"{commit.scope}: {commit.description}"
+            if commit.scope
+            else commit.description
+        )
+        if commit.breaking:
+            entry = f"BREAKING: {entry}"
+        sections.setdefault(section or "changed", []).append(entry)
+    return {
+        section: sections[section] for section in SECTIONS_ORDER if section in sections
+    }
+
+
+def render_release_notes(sections: dict[str, list[str]]) -> str:
+    return "\n\n".join(
+        f"### {section.title()}\n\n" + "\n".join(f"- {entry}" for entry in entries)
+        for section, entries in sections.items()
+    )
+
+
+def bump_for(commit: Commit) -> Optional[str]:
+    """The version bump a commit calls for, None if it does not call for a release"""
+    if commit.breaking:
+        return "major"
+    if commit.type == "feat":
+        return "minor"
+    if commit.type in ("fix", "perf"):
+        return "patch"
+    return None
+
+
+def infer_bumps(
+    commits: list[Commit], packages: dict[str, str]
+) -> dict[str, Optional[str]]:
+    """
+    Decides the version bump of each package from the commits that changed files in it.
+    `packages` maps package names to their directory, relative to the repository's root ("" for the root).
+    Each commit is classified once, and each changed path is attributed to packages once,
+    however many packages there are.
+    """
+    directories = {
+        name: d.strip("/") + "/" if d.strip("/") else "" for name, d in packages.items()
+    }
+    packages_of_path: dict[str, list[str]] = {}
+    bumps: dict[str, Optional[str]] = {name: None for name in packages}
+
+    for commit in commits:
+        bump = bump_for(commit)
+        if bump is None:
+            continue
+        touched: set[str] = set()
+        for path in commit.paths:
+            if path not in packages_of_path:
+                packages_of_path[path] = [
+                    name
+                    for name, directory in directories.items()
+                    if path.startswith(directory)
+                ]
+            touched.update(packages_of_path[path])
+        for name in touched:
+            if BUMPS_ORDER.index(bump) > BUMPS_ORDER.index(bumps[name]):
+                bumps[name] = bump
+    return bumps
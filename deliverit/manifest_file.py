@@ -1,37 +1,80 @@
 """
 Extracts required info from various manifest file formats
 """
+
 from __future__ import annotations
 
+import ast
 import configparser
-import json
 import re
+from functools import cached_property
 from pathlib import Path
-from typing import Any, Optional, Union
+from typing import IO, Any, Callable, Optional, Union
 
-import toml
 import xmltodict
 import yaml
 from pydantic import BaseModel
 
+from deliverit.transaction import FileTransaction
 from deliverit.version import Version
 
+# Use the fastest parsers available, falling back to the ones we depend on
+try:
+    import tomllib as _toml
+
+    _TOML_READ_MODE = "rb"
+except ImportError:
+    try:
+        import tomli as _toml
+
+        _TOML_READ_MODE = "rb"
+    except ImportError:
+        import toml as _toml
+
+        _TOML_READ_MODE = "r"
+
+try:
+    import orjson as _json
+
+    _JSON_READ_MODE = "rb"
+except ImportError:
+    import json as _json
+
+    _JSON_READ_MODE = "r"
+
+_YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+ENTRY_POINTS_GROUP = "deliverit.manifest_extractors"
+
 
 class ManifestInfoExtractor:
-    def __init__(self, fileobj: "IO[Any]", filepath: str) -> None:
-        self._parse(fileobj, filepath)
+    """
+    Reads info from a manifest file.
+    The file is only read and parsed the first time a property needs it.
+    """
+
+    read_mode = "r"
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
 
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        """Parse the file into a dict and sets self.parsed"""
+    @cached_property
+    def parsed(self) -> Any:
+        encoding = None if "b" in self.read_mode else "utf-8"
+        with open(self.filepath, self.read_mode, encoding=encoding) as fileobj:
+            return self._parse(fileobj)
+
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        """Parse the file's contents"""
         raise NotImplementedError("Please implement this method")
 
     @property
-    def old_version(self) -> Version:
+    def old_version(self) -> Optional[Version]:
         """The old (current) version in a tuple of ints (major, minor, patch)"""
         raise NotImplementedError("Please implement this method")
 
     @property
-    def package_name(self) -> str:
+    def package_name(self) -> Optional[str]:
         """The package's (project) name"""
         raise NotImplementedError("Please implement this method")
 
@@ -40,27 +83,188 @@ class ManifestInfoExtractor:
         """To which URL is the project's repository hosted?"""
         raise NotImplementedError("Please implement this method")
 
+    @property
+    def dependencies(self) -> list[str]:
+        """Names of the packages this one depends on, including development dependencies"""
+        return []
+
+    @property
+    def version_filepath(self) -> str:
+        """The file in which the version is declared"""
+        return self.filepath
+
+    @property
+    def source_files(self) -> list[str]:
+        """The files the info is read from: the extractor is outdated when one of them changes"""
+        return [self.filepath]
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        """Where the version is in version_filepath's contents, as (start, end) offsets"""
+        raise NotImplementedError("Please implement this method")
+
+    def with_version(self, contents: str, new_version: Version) -> str:
+        """
+        Returns contents with new_version in place of the current version,
+        leaving everything else (formatting, comments, key order) untouched
+        """
+        start, end = self.version_span(contents)
+        return contents[:start] + str(new_version) + contents[end:]
+
+
 class TOMLManifestInfoExtractor(ManifestInfoExtractor):
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        self.parsed = toml.load(fileobj)
+    read_mode = _TOML_READ_MODE
+
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        return _toml.load(fileobj)
+
 
 class JSONManifestInfoExtractor(ManifestInfoExtractor):
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        self.parsed = json.load(fileobj)
+    read_mode = _JSON_READ_MODE
+
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        return _json.loads(fileobj.read())
+
 
 class YAMLManifestInfoExtractor(ManifestInfoExtractor):
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        self.parsed = yaml.load(fileobj.read().decode("utf-8"), Loader=yaml.SafeLoader)
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        return yaml.load(fileobj, Loader=_YAMLLoader)
+
 
 class XMLManifestInfoExtractor(ManifestInfoExtractor):
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        self.parsed = xmltodict.parse(fileobj.read().decode("utf-8"))
+    read_mode = "rb"
+
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        return xmltodict.parse(fileobj)
+
 
 class INIManifestInfoExtractor(ManifestInfoExtractor):
-    def _parse(self, fileobj: "IO[Any]", filepath: str):
-        self.parsed = configparser.ConfigParser()
-        self.parsed.read_file(fileobj)
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        parsed = configparser.ConfigParser()
+        parsed.read_file(fileobj)
+        return parsed
+
+
+def _toml_string_span(contents: str, table: str, key: str) -> tuple[int, int]:
+    header = re.search(
+        rf"^\s*\[\s*{re.escape(table)}\s*\]\s*(#.*)?$", contents, re.MULTILINE
+    )
+    if header is None:
+        raise ValueError(f"No [{table}] table found")
+    next_header = re.compile(r"^\s*\[", re.MULTILINE).search(contents, header.end())
+    value = re.compile(
+        rf"^\s*{re.escape(key)}\s*=\s*([\"'])(.*?)\1", re.MULTILINE
+    ).search(
+        contents, header.end(), next_header.start() if next_header else len(contents)
+    )
+    if value is None:
+        raise ValueError(f"No {key} in the [{table}] table")
+    return value.span(2)
+
+
+_JSON_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+
+
+def _json_string_span(contents: str, key: str) -> tuple[int, int]:
+    """Finds the string value of `key` in the top-level JSON object"""
+    depth = 0
+    for token in _JSON_TOKENS.finditer(contents):
+        if token.group() in ("{", "["):
+            depth += 1
+        elif token.group() in ("}", "]"):
+            depth -= 1
+        elif depth == 1 and token.group() == f'"{key}"':
+            value = re.compile(r'\s*:\s*"((?:[^"\\]|\\.)*)"').match(
+                contents, token.end()
+            )
+            if value is not None:
+                return value.span(1)
+    raise ValueError(f"No top-level {key!r} string found")
+
+
+_XML_TOKENS = re.compile(
+    r"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[?!][^>]*>|<(/?)([\w:.-]+)[^>]*?(/?)>", re.DOTALL
+)
+
+
+def _xml_text_span(contents: str, path: list[str]) -> tuple[int, int]:
+    """Finds the text of the element at `path` (e.g. ["project", "version"])"""
+    stack: list[str] = []
+    for token in _XML_TOKENS.finditer(contents):
+        closing, name, self_closing = token.groups()
+        if name is None or self_closing:
+            continue
+        if closing:
+            stack.pop()
+            continue
+        stack.append(name)
+        if stack == path:
+            end = contents.index(f"</{name}", token.end())
+            text = contents[token.end() : end]
+            start = token.end() + len(text) - len(text.lstrip())
+            return start, start + len(text.strip())
+    raise ValueError(f"No <{'><'.join(path)}> element found")
+
+
+def _ini_value_span(contents: str, section: str, key: str) -> tuple[int, int]:
+    header = re.search(rf"^\[{re.escape(section)}\]\s*$", contents, re.MULTILINE)
+    if header is None:
+        raise ValueError(f"No [{section}] section found")
+    next_header = re.compile(r"^\[", re.MULTILINE).search(contents, header.end())
+    value = re.compile(
+        rf"^{re.escape(key)}\s*[=:][ \t]*(.*?)\s*$", re.MULTILINE
+    ).search(
+        contents, header.end(), next_header.start() if next_header else len(contents)
+    )
+    if value is None:
+        raise ValueError(f"No {key} in the [{section}] section")
+    return value.span(1)
+
+
+def _python_string_span(contents: str, node: ast.expr) -> tuple[int, int]:
+    """Finds the inside of the string literal `node` was parsed from"""
+    lines = contents.splitlines(keepends=True)
+
+    def offset(lineno: int, col_offset: int) -> int:
+        # ast's column offsets count UTF-8 bytes
+        line = lines[lineno - 1]
+        return sum(map(len, lines[: lineno - 1])) + len(
+            line.encode("utf-8")[:col_offset].decode("utf-8")
+        )
+
+    start = offset(node.lineno, node.col_offset)
+    end = offset(node.end_lineno, node.end_col_offset)
+    literal = contents[start:end]
+    quote = re.search(r"[\"']+", literal)
+    return start + quote.end(), end - (quote.end() - quote.start())
+
+
+FILENAMES_TO_EXTRACTORS: dict[str, type[ManifestInfoExtractor]] = {}
+
+
+def extractor(filename: str) -> Callable:
+    """
+    Registers the decorated class as the extractor for manifest files named `filename`.
+    Other packages can register theirs with an entry point in the
+    "deliverit.manifest_extractors" group, named after the file name.
+    """
+
+    def register(cls: type[ManifestInfoExtractor]) -> type[ManifestInfoExtractor]:
+        FILENAMES_TO_EXTRACTORS[filename] = cls
+        return cls
 
+    return register
+
+
+def _repository_url_from_module_path(module_path: str) -> Optional[str]:
+    match = re.match(
+        r"(github\.com|gitlab\.com|bitbucket\.org)/([^/]+)/([^/]+)", module_path
+    )
+    if match is None:
+        return None
+    return "https://" + "/".join(match.groups())
+
+
+@extractor("pyproject.toml")
 class PyProjectTOML(TOMLManifestInfoExtractor):
     @property
     def old_version(self) -> Version:
@@ -74,7 +278,61 @@ class PyProjectTOML(TOMLManifestInfoExtractor):
     def repository_url(self) -> Optional[str]:
         return self.parsed["tool"]["poetry"].get("repository")
 
+    @property
+    def dependencies(self) -> list[str]:
+        poetry = self.parsed["tool"]["poetry"]
+        names = [*poetry.get("dependencies", {}), *poetry.get("dev-dependencies", {})]
+        for group in poetry.get("group", {}).values():
+            names += group.get("dependencies", {})
+        return [name.replace("-", "_") for name in names if name != "python"]
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        return _toml_string_span(contents, "tool.poetry", "version")
+
+
+@extractor("Cargo.toml")
+class CargoTOML(TOMLManifestInfoExtractor):
+    @property
+    def old_version(self) -> Optional[Version]:
+        version = self.parsed["package"].get("version")
+        # version.workspace = true: inherited from the workspace
+        if not isinstance(version, str):
+            return None
+        return Version.parse(version)
+
+    @property
+    def package_name(self) -> str:
+        return self.parsed["package"]["name"]
+
+    @property
+    def repository_url(self) -> Optional[str]:
+        repository = self.parsed["package"].get("repository")
+        return repository if isinstance(repository, str) else None
+
+    @property
+    def dependencies(self) -> list[str]:
+        names = []
+        for table in ("dependencies", "dev-dependencies", "build-dependencies"):
+            for name, spec in self.parsed.get(table, {}).items():
+                # foo = { package = "bar", ... } renames the bar crate
+                names.append(
+                    spec.get("package", name) if isinstance(spec, dict) else name
+                )
+        return names
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        return _toml_string_span(contents, "package", "version")
+
+
+# Hosts of package.json's "repository" shorthands
+PACKAGE_JSON_HOSTS = {
+    "github": "github.com",
+    "gitlab": "gitlab.com",
+    "bitbucket": "bitbucket.org",
+}
+
 
+@extractor("package.json")
 class PackageJSON(JSONManifestInfoExtractor):
     @property
     def old_version(self) -> Version:
@@ -97,31 +355,174 @@ class PackageJSON(JSONManifestInfoExtractor):
         if url is None:
             return None
 
-        # owner/repo
-        if re.match(r"([^/ ])+/([^/ ])+", url):
-            return f"https://github.com/{url}"
-        if re.match(r"github:([^/ ])+/([^/ ])+", url):
-            return f"https://github.com/{url.replace('github:','')}"
-        if re.match(r"gitlab:([^/ ])+/([^/ ])+", url):
-            return f"https://github.com/{url.replace('gitlab:','')}"
-        if re.match(r"bitbucket:([^/ ])+/([^/ ])+", url):
-            return f"https://github.com/{url.replace('bitbucket:','')}"
+        # owner/repo, or host:owner/repo (see npm's docs on package.json's "repository")
+        shorthand = re.match(r"^(?:(github|gitlab|bitbucket):)?([^/:@ ]+/[^ ]+)$", url)
+        if shorthand:
+            host = PACKAGE_JSON_HOSTS[shorthand.group(1) or "github"]
+            return f"https://{host}/{shorthand.group(2).removesuffix('.git')}"
+        # git+https://host/owner/repo.git, git://host/owner/repo.git or git@host:owner/repo.git
+        full = re.match(
+            r"^(?:git\+)?(?:https?|git|ssh)://(?:[^@/]+@)?([^/]+)/(.+?)(?:\.git)?/?$",
+            url,
+        ) or re.match(r"^[^@/ ]+@([^:/ ]+):(.+?)(?:\.git)?$", url)
+        if full:
+            return f"https://{full.group(1)}/{full.group(2)}"
 
         return None
 
+    @property
+    def dependencies(self) -> list[str]:
+        return [
+            name
+            for field in (
+                "dependencies",
+                "devDependencies",
+                "peerDependencies",
+                "optionalDependencies",
+            )
+            for name in self.parsed.get(field) or {}
+        ]
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        return _json_string_span(contents, "version")
+
+
+@extractor("pom.xml")
+class PomXML(XMLManifestInfoExtractor):
+    @property
+    def _project(self) -> dict[str, Any]:
+        return self.parsed["project"]
+
+    @property
+    def old_version(self) -> Optional[Version]:
+        version = self._project.get("version")
+        return Version.parse(version) if version else None
+
+    @property
+    def package_name(self) -> str:
+        return self._project["artifactId"]
+
+    @property
+    def repository_url(self) -> Optional[str]:
+        scm = self._project.get("scm") or {}
+        return scm.get("url") or self._project.get("url")
+
+    @property
+    def dependencies(self) -> list[str]:
+        dependencies = (self._project.get("dependencies") or {}).get("dependency") or []
+        # xmltodict gives a dict instead of a list when there is only one
+        if isinstance(dependencies, dict):
+            dependencies = [dependencies]
+        return [dependency["artifactId"] for dependency in dependencies]
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        return _xml_text_span(contents, ["project", "version"])
+
+
+@extractor("go.mod")
+class GoMod(ManifestInfoExtractor):
+    def _parse(self, fileobj: IO[Any]) -> Any:
+        # Only the module directive is needed, no need to read further
+        for line in fileobj:
+            match = re.match(r"\s*module\s+\"?([^\s\"]+)", line)
+            if match:
+                return {"module": match.group(1)}
+        return {"module": None}
+
+    @property
+    def _module_path(self) -> Optional[str]:
+        module = self.parsed["module"]
+        # github.com/owner/repo/v2 is v2+ of github.com/owner/repo
+        return re.sub(r"/v\d+$", "", module) if module else None
+
+    @property
+    def old_version(self) -> Optional[Version]:
+        # Go modules are versioned with git tags only
+        return None
+
+    @property
+    def package_name(self) -> Optional[str]:
+        return self._module_path.split("/")[-1] if self._module_path else None
+
+    @property
+    def repository_url(self) -> Optional[str]:
+        return _repository_url_from_module_path(self._module_path or "")
+
 
+@extractor("setup.cfg")
 class SetupCFG(INIManifestInfoExtractor):
-    def _read_value(self, value: str) -> str:
+    def _read_value(self, value: Optional[str]) -> Optional[str]:
         """Seems like values in setup.cfg can be pointers to files, handle that."""
+        if value is None:
+            return None
         if value.startswith("file:"):
             filepath = value.replace("file:", "").strip()
-            return Path(filepath).read_text("utf-8")
+            return (Path(self.filepath).parent / filepath).read_text("utf-8")
         elif value.startswith("attr:"):
-            # TODO
-            raise NotImplementedError(f"While parsing setup.cfg: could not resolve {value!r}: attr:-values are not supported yet")
+            return self._resolve_attr(value.replace("attr:", "").strip())
         else:
             return value
 
+    def _find_attr(self, dotted_path: str) -> tuple[Path, ast.expr]:
+        """
+        Finds the module file and the assigned value node for `attr: package.module.ATTRIBUTE`
+        by reading the module's source, without importing it
+        (which could have side effects or missing dependencies).
+        """
+        candidate = self._attr_module(dotted_path)
+        return candidate, self._attr_value(
+            candidate.read_text("utf-8"), candidate, dotted_path
+        )
+
+    def _attr_module(self, dotted_path: str) -> Path:
+        """The file of the module `attr: package.module.ATTRIBUTE` is read from"""
+        module_parts = dotted_path.split(".")[:-1]
+        root = Path(self.filepath).parent
+        package_dirs = {}
+        if self.parsed.has_option("options", "package_dir"):
+            for line in self.parsed.get("options", "package_dir").strip().splitlines():
+                name, _, directory = line.partition("=")
+                package_dirs[name.strip()] = directory.strip()
+        if module_parts and module_parts[0] in package_dirs:
+            root /= package_dirs[module_parts.pop(0)]
+        elif "" in package_dirs:
+            root /= package_dirs[""]
+
+        module_path = root.joinpath(*module_parts)
+        for candidate in (module_path.with_suffix(".py"), module_path / "__init__.py"):
+            if candidate.is_file():
+                break
+        else:
+            raise ValueError(
+                f"While parsing setup.cfg: could not find the module for attr: {dotted_path!r}"
+            )
+        return candidate
+
+    def _attr_value(self, source: str, candidate: Path, dotted_path: str) -> ast.expr:
+        """The value node assigned to the attribute in the module's source"""
+        attribute = dotted_path.split(".")[-1]
+        for node in ast.parse(source).body:
+            if isinstance(node, ast.Assign):
+                targets, value = node.targets, node.value
+            elif isinstance(node, ast.AnnAssign) and node.value is not None:
+                targets, value = [node.target], node.value
+            else:
+                continue
+            if any(isinstance(t, ast.Name) and t.id == attribute for t in targets):
+                return value
+        raise ValueError(
+            f"While parsing setup.cfg: could not find an assignment of {attribute} in {candidate}"
+        )
+
+    def _resolve_attr(self, dotted_path: str) -> str:
+        candidate, value = self._find_attr(dotted_path)
+        try:
+            return str(ast.literal_eval(value))
+        except ValueError:
+            raise ValueError(
+                f"While parsing setup.cfg: could not resolve attr: {dotted_path!r} to a literal value in {candidate}"
+            )
+
     @property
     def old_version(self) -> Version:
         return Version.parse(self._read_value(self.parsed["metadata"].get("version")))
@@ -134,13 +535,115 @@ class SetupCFG(INIManifestInfoExtractor):
     def repository_url(self) -> Optional[str]:
         return self._read_value(self.parsed["metadata"].get("home-page"))
 
+    @property
+    def dependencies(self) -> list[str]:
+        names = []
+        for option in ("install_requires", "setup_requires", "tests_require"):
+            if not self.parsed.has_option("options", option):
+                continue
+            for requirement in self.parsed.get("options", option).splitlines():
+                match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+                if match:
+                    names.append(match.group(1).replace("-", "_"))
+        return names
 
-FILENAMES_TO_EXTRACTORS = {
-    "pyproject.toml": PyProjectTOML,
-    "package.json": PackageJSON,
-    # "setup.py": SetupPY, AttributeError: module 'distutils' has no attribute 'core'
-    "setup.cfg": SetupCFG,
-}
+    @property
+    def version_filepath(self) -> str:
+        value = self.parsed["metadata"].get("version")
+        if value.startswith("file:"):
+            return str(Path(self.filepath).parent / value.replace("file:", "").strip())
+        if value.startswith("attr:"):
+            return str(self._attr_module(value.replace("attr:", "").strip()))
+        return self.filepath
+
+    @property
+    def source_files(self) -> list[str]:
+        return [self.filepath, self.version_filepath]
+
+    def version_span(self, contents: str) -> tuple[int, int]:
+        value = self.parsed["metadata"].get("version")
+        if value.startswith("file:"):
+            start = len(contents) - len(contents.lstrip())
+            return start, start + len(contents.strip())
+        if value.startswith("attr:"):
+            # contents may differ from the module on disk, e.g. when it is staged
+            dotted_path = value.replace("attr:", "").strip()
+            node = self._attr_value(
+                contents, self._attr_module(dotted_path), dotted_path
+            )
+            return _python_string_span(contents, node)
+        return _ini_value_span(contents, "metadata", "version")
+
+
+_entry_points_loaded = False
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    discovered = entry_points()
+    if hasattr(discovered, "select"):
+        discovered = discovered.select(group=ENTRY_POINTS_GROUP)
+    else:
+        discovered = discovered.get(ENTRY_POINTS_GROUP, [])
+    for entry_point in discovered:
+        FILENAMES_TO_EXTRACTORS[entry_point.name] = entry_point.load()
+
+
+# resolved path -> (mtimes in ns of its source files, extractor)
+_cache: dict[str, tuple[tuple[int, ...], ManifestInfoExtractor]] = {}
+
+
+def _mtimes(filepaths: list[str]) -> tuple[int, ...]:
+    return tuple(Path(f).stat().st_mtime_ns for f in filepaths)
+
+
+def get_extractor(filepath: str) -> ManifestInfoExtractor:
+    """
+    Returns the extractor for the manifest at filepath.
+    Extractors are cached until the file, or another file they read
+    (e.g. the module of setup.cfg's `version = attr: ...`), gets modified.
+    """
+    _load_entry_points()
+    try:
+        extractor_class = FILENAMES_TO_EXTRACTORS[Path(filepath).name]
+    except KeyError:
+        raise ValueError(f"Unsupported manifest {Path(filepath).name!r}")
+
+    resolved = str(Path(filepath).resolve())
+    if resolved in _cache:
+        mtimes, cached = _cache[resolved]
+        try:
+            if _mtimes(cached.source_files) == mtimes:
+                return cached
+        except (OSError, ValueError):
+            # A source file is gone, or the manifest no longer points to it
+            pass
+    extractor = extractor_class(resolved)
+    _cache[resolved] = (_mtimes(extractor.source_files), extractor)
+    return extractor
+
+
+def cached(
+    filepaths: list[str],
+) -> dict[str, tuple[tuple[int, ...], ManifestInfoExtractor]]:
+    """The cache entries of the manifests among filepaths, to preload() in another process"""
+    resolved = {str(Path(filepath).resolve()) for filepath in filepaths}
+    return {path: entry for path, entry in _cache.items() if path in resolved}
+
+
+def preload(entries: dict[str, tuple[tuple[int, ...], ManifestInfoExtractor]]):
+    """
+    Adds extractors created by another process to the cache (see deliverit.server).
+    They are used as long as their source files are not modified, like the ones created here
+    """
+    _cache.update(entries)
 
 
 class ManifestInfo(BaseModel):
@@ -154,10 +657,28 @@ def load(filepath: str) -> tuple[Optional[Version], Optional[str], Optional[str]
     Loads the manifest file using the correct extractor and returns a tuple of:
     (old_version, package_name, repository_url)
     """
-    try:
-        extractor = FILENAMES_TO_EXTRACTORS[Path(filepath).name]
-    except KeyError:
-        raise ValueError(f"Unsupported manifest {Path(filepath).name!r}")
-
-    manifest = extractor(open(filepath), filepath)
+    manifest = get_extractor(filepath)
     return manifest.old_version, manifest.package_name, manifest.repository_url
+
+
+def bump(
+    filepath: str, new_version: Version, files: Optional[FileTransaction] = None
+) -> Optional[str]:
+    """
+    Writes new_version in place of the manifest's current version.
+    Returns the path of the file that was modified, or None when
+    the manifest declares no version (e.g. go.mod, where versions are git tags).
+    The file is modified through `files`, or atomically on its own if not given.
+    """
+    if files is None:
+        with FileTransaction() as files:
+            return bump(filepath, new_version, files)
+
+    manifest = get_extractor(filepath)
+    if manifest.old_version is None:
+        return None
+    contents = manifest.with_version(
+        files.read_text(manifest.version_filepath), new_version
+    )
+    files.write_text(manifest.version_filepath, contents)
+    return manifest.version_filepath
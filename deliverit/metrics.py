@@ -0,0 +1,216 @@
+"""
+Release metrics, in the Prometheus/OpenMetrics text format.
+They can be written to a file for node_exporter's textfile collector,
+or pushed to a Pushgateway (or anything accepting the same requests).
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from pathlib import Path
+import os
+import re
+import threading
+import time
+import urllib.request
+
+# Seconds. Releases steps take from milliseconds (changelog updates) to many minutes (builds)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        name
+        + '="'
+        + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for name, value in sorted(labels.items())
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        raise NotImplementedError("Please implement this method")
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, dict(k), v) for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description)
+        self.buckets = buckets
+        # labels -> (count per bucket, sum, count)
+        self._values: dict[
+            tuple[tuple[str, str], ...], tuple[list[int], float, int]
+        ] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = counts, total + value, count + 1
+
+    def time(self, **labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append(
+                        (
+                            f"{self.name}_bucket",
+                            {**labels, "le": f"{bound:g}"},
+                            bucket_count,
+                        )
+                    )
+                samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+STEP_DURATION = Histogram(
+    "deliverit_step_duration_seconds", "Time taken by each release step"
+)
+STEP_FAILURES = Counter(
+    "deliverit_step_failures_total", "Release steps that failed, by step id"
+)
+COMMAND_DURATION = Histogram(
+    "deliverit_command_duration_seconds",
+    "Time spent waiting for the commands run by release steps",
+)
+GITHUB_API_CALLS = Counter("deliverit_github_api_calls_total", "GitHub API calls")
+GITHUB_API_RETRIES = Counter(
+    "deliverit_github_api_retries_total", "GitHub API calls retried after an error"
+)
+GITHUB_API_FAILURES = Counter(
+    "deliverit_github_api_failures_total", "GitHub API calls that failed for good"
+)
+UPLOADED_BYTES = Counter(
+    "deliverit_uploaded_bytes_total", "Bytes of release assets uploaded"
+)
+SKIPPED_BYTES = Counter(
+    "deliverit_skipped_upload_bytes_total",
+    "Bytes of release assets not uploaded because the release already had them",
+)
+LAST_RELEASE = Gauge(
+    "deliverit_last_release_timestamp_seconds",
+    "When the last release finished, by outcome",
+)
+
+METRICS: list[Metric] = [
+    STEP_DURATION,
+    STEP_FAILURES,
+    COMMAND_DURATION,
+    GITHUB_API_CALLS,
+    GITHUB_API_RETRIES,
+    GITHUB_API_FAILURES,
+    UPLOADED_BYTES,
+    SKIPPED_BYTES,
+    LAST_RELEASE,
+]
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in METRICS)
+
+
+def write_textfile(filepath: str):
+    """
+    Writes the metrics for node_exporter's textfile collector.
+    The file is replaced atomically, so that the collector never reads half of it.
+    """
+    temporary = Path(f"{filepath}.{os.getpid()}.tmp")
+    temporary.write_text(render(), encoding="utf-8")
+    temporary.replace(filepath)
+
+
+def push(url: str, job: str = "deliverit", timeout: float = 10):
+    """
+    Pushes the metrics to a Pushgateway at url, replacing the ones previously pushed for `job`
+    """
+    if not re.match(r"^[\w.-]+$", job):
+        raise ValueError(f"Invalid job name {job!r}")
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/metrics/job/{job}",
+        data=render().encode("utf-8"),
+        method="PUT",
+        headers={"Content-Type": "text/plain; version=0.0.4"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+
+
+def export(textfile: Optional[str], pushgateway: Optional[str], succeeded: bool):
+    """Records the end of the release and exports the metrics where asked to"""
+    LAST_RELEASE.set(time.time(), outcome="success" if succeeded else "failure")
+    if textfile:
+        write_textfile(textfile)
+    if pushgateway:
+        push(pushgateway)
@@ -0,0 +1,216 @@
+"""
+Repositories with multiple packages: finding which packages changed since their last release
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from pathlib import Path
+import subprocess
+
+from pydantic import BaseModel
+
+import deliverit.history
+import deliverit.manifest_file
+from deliverit.version import Version, get_latest_tag, list_tags
+
+
+class Package(BaseModel):
+    name: str
+    manifest_file: str
+    # Relative to the repository's root, "" for the root itself
+    directory: str
+    version: Optional[Version] = None
+    # Names of the packages of the repository this one depends on
+    dependencies: list[str] = []
+
+
+class PathIndex:
+    """
+    A prefix trie of the packages' directories.
+    Finding the package a path belongs to walks down the path's components once,
+    however many packages there are. Paths belong to the innermost package containing them.
+    """
+
+    def __init__(self, packages: list[Package]) -> None:
+        self._root: dict[str, Any] = {}
+        for package in packages:
+            node = self._root
+            for part in Path(package.directory).parts:
+                node = node.setdefault(part, {})
+            node[None] = package.name
+
+    def package_of(self, path: str) -> Optional[str]:
+        node = self._root
+        owner = node.get(None)
+        for part in path.split("/"):
+            node = node.get(part)
+            if node is None:
+                break
+            owner = node.get(None, owner)
+        return owner
+
+
+def load_packages(manifest_files: list[str]) -> list[Package]:
+    """
+    Reads the packages' manifests. Dependencies on packages that are not in
+    manifest_files are left out.
+    """
+    packages = []
+    for manifest_file in manifest_files:
+        extractor = deliverit.manifest_file.get_extractor(manifest_file)
+        packages.append(
+            Package(
+                name=extractor.package_name,
+                manifest_file=manifest_file,
+                directory=deliverit.history.path_in_repository(
+                    str(Path(manifest_file).parent)
+                ),
+                version=extractor.old_version,
+                dependencies=extractor.dependencies,
+            )
+        )
+    names = {package.name for package in packages}
+    for package in packages:
+        package.dependencies = [d for d in package.dependencies if d in names]
+    return packages
+
+
+def tag_template_for(tag_template: str, package_name: str) -> str:
+    """The package's tag template, with only {new} left to replace"""
+    return tag_template.replace(
+        "{package}", package_name.replace("{", "{{").replace("}", "}}")
+    )
+
+
+def changed_paths(base: Optional[str]) -> list[str]:
+    """Paths changed between base and HEAD, relative to the repository's root. All of them if base is None"""
+    command = (
+        ["diff", "--name-only", "--no-renames", base, "HEAD"]
+        if base
+        else ["ls-files", "--full-name"]
+    )
+    # pylint: disable=subprocess-run-check
+    result = subprocess.run(
+        ["git", "-c", "core.quotePath=false", *command], capture_output=True
+    )
+    if result.returncode != 0:
+        raise ValueError(
+            f"Could not list the changes since {base}: {result.stderr.decode('utf-8')}"
+        )
+    return [path for path in result.stdout.decode("utf-8").splitlines() if path]
+
+
+def dependents(packages: list[Package]) -> dict[str, list[str]]:
+    """Maps package names to the names of the packages that depend on them"""
+    reverse: dict[str, list[str]] = {package.name: [] for package in packages}
+    for package in packages:
+        for dependency in package.dependencies:
+            reverse[dependency].append(package.name)
+    return reverse
+
+
+def changed_packages(
+    packages: list[Package], tag_template: str
+) -> dict[str, Optional[str]]:
+    """
+    Finds the packages that changed since their latest tag.
+    Returns {package name: latest tag, or None if it was never released}.
+    Tags are listed once, and `git diff` runs once per distinct latest tag, not once per package.
+    """
+    latest_tags: dict[str, Optional[str]] = {}
+    # Tags of packages released together point to the same commit, and share a diff
+    bases: dict[str, Optional[str]] = {}
+    tags = list_tags()
+    for package in packages:
+        latest = get_latest_tag(tag_template_for(tag_template, package.name), tags)
+        latest_tags[package.name] = latest[0] if latest else None
+        bases[package.name] = deliverit.history.resolve(latest[0]) if latest else None
+
+    index = PathIndex(packages)
+    changed: set[str] = set()
+    for base in set(bases.values()):
+        since_base = {name for name, commit in bases.items() if commit == base}
+        for path in changed_paths(base):
+            owner = index.package_of(path)
+            if owner in since_base:
+                changed.add(owner)
+
+    return {name: tag for name, tag in latest_tags.items() if name in changed}
+
+
+def with_dependents(packages: list[Package], names: set[str]) -> set[str]:
+    """names, and the names of the packages that depend on them, directly or not"""
+    reverse = dependents(packages)
+    affected = set(names)
+    pending = list(names)
+    while pending:
+        for dependent in reverse[pending.pop()]:
+            if dependent not in affected:
+                affected.add(dependent)
+                pending.append(dependent)
+    return affected
+
+
+def dependency_levels(packages: list[Package]) -> list[list[Package]]:
+    """
+    Groups packages so that each package only depends on packages of previous groups.
+    Dependencies on packages not in `packages` are ignored.
+    """
+    names = {package.name for package in packages}
+    remaining = {
+        package.name: {d for d in package.dependencies if d in names}
+        for package in packages
+    }
+    levels = []
+    while remaining:
+        level = [
+            package
+            for package in packages
+            if package.name in remaining and not remaining[package.name]
+        ]
+        if not level:
+            raise ValueError(
+                f"These packages depend on each other: {', '.join(sorted(remaining))}"
+            )
+        for package in level:
+            del remaining[package.name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(package.name for package in level)
+        levels.append(level)
+    return levels
+
+
+def inferred_bumps(
+    packages: list[Package], tag_template: str
+) -> dict[str, Optional[str]]:
+    """
+    The version bump each package calls for, from the conventional commits that changed it
+    since its latest tag (see deliverit.history.infer_bumps). Tags are listed once,
+    and the history is read once per distinct latest tag, for every package sharing it.
+    """
+    tags = list_tags()
+    # Tags of packages released together point to the same commit, and share a history
+    by_base: dict[Optional[str], list[Package]] = {}
+    for package in packages:
+        latest = get_latest_tag(tag_template_for(tag_template, package.name), tags)
+        base = deliverit.history.resolve(latest[0]) if latest else None
+        by_base.setdefault(base, []).append(package)
+
+    bumps: dict[str, Optional[str]] = {}
+    for base, sharing in by_base.items():
+        bumps.update(
+            deliverit.history.infer_bumps(
+                deliverit.history.commits_between(base),
+                {package.name: package.directory for package in sharing},
+            )
+        )
+    return bumps
+
+
+def affected_packages(packages: list[Package], tag_template: str) -> list[Package]:
+    """
+    The packages that changed since their latest tag, and the ones that depend on them:
+    package A depends on B, so A is released when B is.
+    """
+    affected = with_dependents(packages, set(changed_packages(packages, tag_template)))
+    return [package for package in packages if package.name in affected]
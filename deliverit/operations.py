@@ -0,0 +1,161 @@
+"""
+Actions deliverit performs itself, registered by name so that plans can refer to them
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Callable
+from pathlib import Path
+
+import deliverit.changelog
+import deliverit.config
+import deliverit.manifest_file
+import deliverit.version_declaration
+from deliverit.context import Context
+from deliverit.rate_limit import RequestScheduler
+from deliverit.transaction import FileTransaction
+from deliverit.git_remote import (
+    close_milestone,
+    create_release,
+    upload_assets_to_release,
+)
+
+OPERATIONS: dict[str, Callable] = {}
+# Operations that modify files of the repository, through a FileTransaction
+EDITS_FILES: set[str] = set()
+
+
+def operation(name: str, edits_files: bool = False) -> Callable:
+    """
+    Registers the decorated function as the operation `name`.
+    It will be called with the context, the API scheduler and the operation's arguments,
+    and with the `files` transaction to modify files through if edits_files is set.
+    """
+
+    def register(function: Callable) -> Callable:
+        OPERATIONS[name] = function
+        if edits_files:
+            EDITS_FILES.add(name)
+        return function
+
+    return register
+
+
+def perform(
+    name: str,
+    arguments: dict[str, Any],
+    ctx: Context,
+    scheduler: RequestScheduler,
+    files: Optional[FileTransaction] = None,
+) -> Any:
+    """
+    Runs the operation `name`. Operations that edit files stage their modifications in `files`
+    when given, and leave committing them to the caller.
+    """
+    try:
+        function = OPERATIONS[name]
+    except KeyError:
+        raise ValueError(f"Unknown operation {name!r}")
+    if name in EDITS_FILES:
+        return function(ctx, scheduler, files=files, **arguments)
+    return function(ctx, scheduler, **arguments)
+
+
+@operation("update_changelog", edits_files=True)
+def _update_changelog(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    files: Optional[FileTransaction],
+    changelog: str,
+    tag_template: str,
+    release_notes_from: str,
+    previous_tag: str,
+    package_directory: str = "",
+    updated_dependencies: Optional[list[str]] = None,
+):
+    deliverit.changelog.update(
+        ctx,
+        changelog,
+        tag_template,
+        release_notes_from,
+        previous_tag,
+        files,
+        package_directory,
+        updated_dependencies,
+    )
+
+
+@operation("update_code_version", edits_files=True)
+def _update_code_version(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    files: Optional[FileTransaction],
+    declaration: dict[str, Any],
+):
+    deliverit.version_declaration.update(
+        ctx, deliverit.config.VersionDeclaration(**declaration), files
+    )
+
+
+@operation("bump_manifest_version", edits_files=True)
+def _bump_manifest_version(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    files: Optional[FileTransaction],
+    manifest_file: str,
+):
+    deliverit.manifest_file.bump(manifest_file, ctx.new_version, files)
+
+
+@operation("create_github_release")
+def _create_github_release(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    tag_name: str,
+    title: str,
+    changelog: str,
+    release_notes_from: str,
+    previous_tag: str,
+    sync: bool = False,
+    package_directory: str = "",
+    updated_dependencies: Optional[list[str]] = None,
+):
+    if release_notes_from == "commits":
+        release_notes = deliverit.changelog.get_release_notes_from_commits(
+            previous_tag, package_directory, updated_dependencies
+        )
+    else:
+        # The changelog has been updated by the time this runs, read it now
+        release_notes = deliverit.changelog.get_release_notes_for_version(
+            ctx.new_version, Path(changelog).read_text("utf-8")
+        )
+    create_release(ctx, scheduler, tag_name, title, message=release_notes, sync=sync)
+
+
+@operation("add_assets_to_github_release")
+def _add_assets_to_github_release(
+    ctx: Context,
+    scheduler: RequestScheduler,
+    tag_name: str,
+    assets: list[dict[str, Any]],
+    checksums: list[str],
+    sign_checksums_with: Optional[str],
+    sync: bool = False,
+):
+    remote = scheduler.connect(ctx)
+    release = scheduler.call(remote.get_release, ctx.repository_full_name, tag_name)
+    if release is None:
+        raise ValueError(f"There is no release for {tag_name!r} to add assets to")
+    upload_assets_to_release(
+        ctx,
+        scheduler,
+        release,
+        assets=[deliverit.config.ReleaseAsset(**a) for a in assets],
+        checksums=checksums,
+        sign_checksums_with=sign_checksums_with,
+        sync=sync,
+    )
+
+
+@operation("close_milestone")
+def _close_milestone(ctx: Context, scheduler: RequestScheduler, title: str):
+    close_milestone(ctx, scheduler, title)
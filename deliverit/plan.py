@@ -0,0 +1,283 @@
+"""
+Release plans: every step of a release, computed before anything runs.
+Plans can be saved, reviewed and approved once, then executed unattended.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+import threading
+from pathlib import Path
+
+from pydantic import BaseModel
+
+import deliverit.operations
+import deliverit.profiling
+import deliverit.redaction
+from deliverit.context import Context
+from deliverit.rate_limit import RequestScheduler
+from deliverit.step import StepFailed, run_step
+from deliverit.transaction import FileOverlay, FileTransaction
+from deliverit.ui import *
+from deliverit.version import Version
+
+
+class Operation(BaseModel):
+    """An action deliverit performs itself, see deliverit.operations"""
+
+    name: str
+    arguments: dict[str, Any] = {}
+
+
+class PlannedStep(BaseModel):
+    id: str
+    message: str
+    operation: Optional[Operation] = None
+    commands: list[Union[str, list[str]]] = []
+    cancellable: bool = True
+    nonzero_ok: bool = False
+    # Steps of the same stage don't depend on each other
+    # and are run concurrently when executing unattended
+    stage: int = 0
+    # When the plan releases several packages, the context of the package this step releases
+    context: Optional[Context] = None
+
+
+class Plan(BaseModel):
+    context: Context
+    steps: list[PlannedStep] = []
+    approved: bool = False
+    # When releasing several packages: package name -> names of the packages it depends on
+    dependencies: dict[str, list[str]] = {}
+    # How many steps can run at the same time
+    concurrency: int = 4
+    # Environment variables whose values are hidden from the output
+    secrets: list[str] = []
+
+    class Config:
+        json_encoders = {Version: str}
+
+    def add(self, **step: Any):
+        self.steps.append(PlannedStep(**step))
+
+    def save(self, filepath: str):
+        Path(filepath).write_text(self.json(indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, filepath: str) -> "Plan":
+        return cls.parse_file(filepath)
+
+    def describe(self):
+        for step in self.steps:
+            describe_step(step)
+
+
+def describe_step(step: PlannedStep):
+    package = f"{step.context.package_name}: " if step.context else ""
+    print(dim(f"[{step.stage}] ") + b(package + step.message) + dim(f" ({step.id})"))
+    # Arguments and commands can contain secrets, e.g. expanded from the environment
+    if step.operation:
+        arguments = ", ".join(f"{k}={v!r}" for k, v in step.operation.arguments.items())
+        print(
+            dim("  ↳ ")
+            + em(deliverit.redaction.redact(f"{step.operation.name}({arguments})"))
+        )
+    for command in step.commands:
+        print(
+            dim("  $ ")
+            + em(
+                deliverit.redaction.redact(
+                    " ".join(command) if type(command) is list else command
+                )
+            )
+        )
+
+
+def ask_approval(plan: Plan) -> bool:
+    """Asks once for the whole plan. Returns whether it got approved"""
+    plan.describe()
+    try:
+        input(
+            "\n"
+            + dim("Press ")
+            + b("⏎")
+            + dim(" to approve this plan or ")
+            + b("Ctrl-C")
+            + dim(" to cancel")
+        )
+    except KeyboardInterrupt:
+        print_on_same_line("Cancelled.")
+        return False
+    plan.approved = True
+    return True
+
+
+def execute(plan: Plan, args: dict[str, Any], scheduler: RequestScheduler):
+    """
+    Runs the plan's steps. Unless each step needs to be confirmed,
+    steps of the same stage run concurrently.
+    When a package's step fails, the package's next steps and the steps of the packages
+    that depend on it are cancelled, the other packages' releases go on.
+
+    Files modified by operations are only replaced once the next step that is not
+    a file modification runs (e.g. git add), all at once: a failure or a Ctrl-C
+    in the middle of modifying them leaves them untouched.
+    """
+    if args["--dry-run"]:
+        preview(plan, scheduler)
+        return
+
+    ctx = plan.context
+    unattended = args["--yes"] or plan.approved
+    step_args = {**args, "--yes": unattended}
+    failed: set[str] = set()
+    lock = threading.Lock()
+    # package name (None when releasing a single package) -> its pending file modifications
+    transactions: dict[Optional[str], FileTransaction] = {}
+
+    def run(step: PlannedStep) -> Any:
+        package = step.context.package_name if step.context else None
+        with lock:
+            if package in failed:
+                return None
+            blocked_by = failed.intersection(plan.dependencies.get(package, []))
+            if blocked_by:
+                failed.add(package)
+        if blocked_by:
+            print(
+                warn(
+                    f"Cancelled the release of {package}: "
+                    f"the release of {', '.join(sorted(blocked_by))} failed"
+                )
+            )
+            return None
+
+        with lock:
+            files = transactions.setdefault(package, FileTransaction())
+        action = None
+        if step.operation and step.operation.name in deliverit.operations.EDITS_FILES:
+            action = lambda: deliverit.operations.perform(
+                step.operation.name,
+                step.operation.arguments,
+                step.context or ctx,
+                scheduler,
+                files,
+            )
+        elif step.operation:
+            action = lambda: deliverit.operations.perform(
+                step.operation.name,
+                step.operation.arguments,
+                step.context or ctx,
+                scheduler,
+            )
+        if (
+            action is None
+            or step.operation.name not in deliverit.operations.EDITS_FILES
+        ):
+            # The next steps (git add, custom commands...) need the modified files
+            files.commit()
+        try:
+            with deliverit.profiling.profile(
+                step.id if package is None else f"{package}/{step.id}"
+            ):
+                return run_step(
+                    step_args,
+                    step.id,
+                    step.message,
+                    action=action,
+                    commands=step.commands,
+                    cancellable=step.cancellable,
+                    nonzero_ok=step.nonzero_ok,
+                    # Later steps (tagging, pushing, publishing) need this one
+                    raise_on_failure=True,
+                )
+        except Exception as error:  # pylint: disable=broad-except
+            if package is None:
+                if not isinstance(error, StepFailed):
+                    raise
+                # Stops the whole plan, and rolls the file modifications back
+                print(red(f"The release failed at {step.id}: {error}"))
+                exit(1)
+            with lock:
+                failed.add(package)
+            files.rollback()
+            print(
+                red(
+                    f"The release of {package} failed at {step.id}: "
+                    + deliverit.redaction.redact(str(error))
+                )
+            )
+            return None
+
+    try:
+        # Profiled steps run one after the other, so that their timings and allocations don't mix
+        if not unattended or args["--profile"]:
+            for step in plan.steps:
+                run(step)
+        else:
+            for stage, steps in groupby(
+                sorted(plan.steps, key=lambda s: s.stage), key=lambda s: s.stage
+            ):
+                steps = list(steps)
+                ctx.debug(f"plan: stage {stage}: {', '.join(s.id for s in steps)}")
+                if len(steps) == 1:
+                    run(steps[0])
+                    continue
+                with ThreadPoolExecutor(
+                    max_workers=min(len(steps), plan.concurrency)
+                ) as executor:
+                    # list(): re-raise the first exception, if any
+                    list(executor.map(run, steps))
+    except BaseException:
+        # Including Ctrl-C and exit()s
+        for files in transactions.values():
+            files.rollback()
+        raise
+    for files in transactions.values():
+        files.commit()
+
+    if failed:
+        print(red(f"Could not release {', '.join(sorted(failed))}"))
+        exit(1)
+
+
+def preview(plan: Plan, scheduler: RequestScheduler):
+    """
+    Dry run: makes the plan's file modifications in memory, then shows the commands
+    and API calls the other steps would make, and the diff of the modified files.
+    Nothing is written, run or sent.
+    """
+    overlay = FileOverlay()
+    try:
+        for step in sorted(plan.steps, key=lambda s: s.stage):
+            if (
+                step.operation
+                and step.operation.name in deliverit.operations.EDITS_FILES
+            ):
+                deliverit.operations.perform(
+                    step.operation.name,
+                    step.operation.arguments,
+                    step.context or plan.context,
+                    scheduler,
+                    overlay,
+                )
+            describe_step(step)
+
+        print()
+        diff = overlay.diff()
+        if not diff:
+            print(dim("No files would be modified."))
+        for line in diff.splitlines():
+            if line.startswith(("--- ", "+++ ")):
+                print(b(line))
+            elif line.startswith("@@"):
+                print(em(line))
+            elif line.startswith("+"):
+                print(green(line))
+            elif line.startswith("-"):
+                print(red(line))
+            else:
+                print(line)
+    finally:
+        overlay.rollback()
@@ -0,0 +1,275 @@
+"""
+Read-only checks, run concurrently before any step modifies anything
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import re
+import subprocess
+import urllib.error
+import urllib.request
+
+import deliverit.config
+from deliverit.context import Context
+from deliverit.rate_limit import RequestScheduler
+from deliverit.ui import *
+
+NETWORK_TIMEOUT = 10  # seconds
+
+
+class PreflightError(Exception):
+    """The release would fail halfway through if started"""
+
+
+class PreflightWarning(Exception):
+    """The check could not confirm that the release will go through"""
+
+
+def _git(*args: str) -> subprocess.CompletedProcess:
+    # pylint: disable=subprocess-run-check
+    return subprocess.run(["git", *args], capture_output=True, timeout=NETWORK_TIMEOUT)
+
+
+def check_working_tree(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    result = _git("status", "--porcelain", "--untracked-files=no")
+    if result.returncode != 0:
+        raise PreflightError("Not inside a git repository")
+    if result.stdout.strip():
+        changed = [line[3:] for line in result.stdout.decode("utf-8").splitlines()]
+        raise PreflightError(
+            "The working tree has uncommitted changes: " + ", ".join(changed)
+        )
+
+
+def check_tag_is_free(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    tag_name = ctx.apply(config.tag_name)
+    if _git("rev-parse", "-q", "--verify", f"refs/tags/{tag_name}").returncode == 0:
+        raise PreflightError(f"The tag {tag_name!r} already exists")
+
+
+def check_upstream_branch(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    if _git("rev-parse", "--abbrev-ref", "@{upstream}").returncode != 0:
+        raise PreflightError("The current branch has no upstream branch to push to")
+
+
+def check_remote_reachable(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    try:
+        result = _git("ls-remote", "--exit-code", "--heads", "origin")
+    except subprocess.TimeoutExpired:
+        raise PreflightError("The git remote 'origin' did not respond in time")
+    if result.returncode not in (0, 2):  # 2: reachable, but has no branches yet
+        raise PreflightError(
+            "The git remote 'origin' is unreachable: "
+            + result.stderr.decode("utf-8").strip()
+        )
+
+
+def check_remote_token(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    remote = scheduler.connect(ctx)
+    problem = scheduler.call(remote.check_access, ctx.repository_full_name)
+    if problem:
+        raise PreflightError(problem)
+
+
+def check_release_is_free(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    if config.sync_release:
+        return
+    tag_name = ctx.apply(config.tag_name)
+    remote = scheduler.connect(ctx)
+    if scheduler.call(remote.get_release, ctx.repository_full_name, tag_name):
+        raise PreflightError(f"A {remote.name} release for {tag_name!r} already exists")
+
+
+def check_milestone_exists(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    title = ctx.apply(config.milestone_title)
+    remote = scheduler.connect(ctx)
+    if not scheduler.call(remote.milestones, ctx.repository_full_name, title):
+        raise PreflightError(f"No open milestone with title {title!r} found")
+
+
+def check_release_assets(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    for algorithm in config.release_checksums:
+        if algorithm not in hashlib.algorithms_available:
+            raise PreflightError(f"Unknown checksum algorithm {algorithm!r}")
+    missing = [
+        ctx.apply(asset.file)
+        for asset in config.release_assets
+        if not asset.create_with and not Path(ctx.apply(asset.file)).is_file()
+    ]
+    if not missing:
+        return
+    message = "Release assets not found: " + ", ".join(missing)
+    # Those could very well be created by the build step
+    if config.steps.build_for_registry:
+        raise PreflightWarning(message)
+    raise PreflightError(message)
+
+
+def check_changelog(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    if config.release_notes_from not in ("changelog", "commits"):
+        raise PreflightError(
+            f"release_notes_from must be 'changelog' or 'commits', not {config.release_notes_from!r}"
+        )
+    changelog_path = Path(ctx.apply(config.changelog))
+    if not changelog_path.is_file() or config.release_notes_from == "commits":
+        return  # the changelog gets created, or filled from commits
+    unreleased = re.search(
+        r"^## \[?Unreleased\]?\s*$(.*?)(?=^## |\Z)",
+        changelog_path.read_text("utf-8"),
+        re.MULTILINE | re.DOTALL | re.IGNORECASE,
+    )
+    if unreleased is None or not re.search(
+        r"^\s*[-*] ", unreleased.group(1), re.MULTILINE
+    ):
+        raise PreflightError(
+            f"There are no changes in the Unreleased section of {changelog_path}"
+        )
+
+
+def check_version_declarations(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    for declaration in config.version_declarations:
+        filepath = Path(ctx.apply(declaration.in_))
+        if not filepath.is_file():
+            raise PreflightError(f"{filepath} does not exist")
+        try:
+            pattern = re.compile(declaration.search)
+        except re.error as error:
+            raise PreflightError(
+                f"Invalid search pattern {declaration.search!r}: {error}"
+            )
+        if not any(
+            pattern.match(line) for line in filepath.read_text("utf-8").splitlines()
+        ):
+            raise PreflightWarning(
+                f"{declaration.search!r} matches nothing in {filepath}"
+            )
+
+
+def check_templates(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    templates = {
+        "commit_message": config.commit_message,
+        "tag_name": config.tag_name,
+        "milestone_title": config.milestone_title,
+        "release_title": config.release_title,
+        "changelog": config.changelog,
+        "steps.bump_manifest_version": config.steps.bump_manifest_version,
+    }
+    for i, asset in enumerate(config.release_assets):
+        templates[f"release_assets[{i}].file"] = asset.file
+        templates[f"release_assets[{i}].label"] = asset.label
+    for i, declaration in enumerate(config.version_declarations):
+        templates[f"version_declarations[{i}].in"] = declaration.in_
+        templates[f"version_declarations[{i}].replace"] = declaration.replace
+
+    for name, template in templates.items():
+        if not isinstance(template, str):
+            continue
+        try:
+            ctx.apply(template, env_aware=False)
+        except (KeyError, IndexError, ValueError, AttributeError) as error:
+            raise PreflightError(f"Could not render {name} ({template!r}): {error!r}")
+
+
+def check_registry_reachable(
+    ctx: Context, config: deliverit.config.Configuration, scheduler: RequestScheduler
+):
+    url = f"https://{config.registry}"
+    try:
+        urllib.request.urlopen(
+            urllib.request.Request(url, method="HEAD"), timeout=NETWORK_TIMEOUT
+        )
+    except urllib.error.HTTPError:
+        return  # the registry answered, even if it does not like HEAD requests
+    except (urllib.error.URLError, OSError) as error:
+        raise PreflightError(f"The registry {config.registry} is unreachable: {error}")
+
+
+# (description, step IDs that need it (empty: always needed), check)
+CHECKS: list[tuple[str, tuple[str, ...], Callable]] = [
+    ("Working tree is clean", ("git_commit",), check_working_tree),
+    ("Tag is not taken", ("git_tag",), check_tag_is_free),
+    ("Branch has an upstream", ("git_push",), check_upstream_branch),
+    ("Git remote is reachable", ("git_push", "git_push_tag"), check_remote_reachable),
+    (
+        "Token is valid",
+        ("create_github_release", "add_assets_to_github_release", "close_milestone"),
+        check_remote_token,
+    ),
+    ("Release is not taken", ("create_github_release",), check_release_is_free),
+    ("Milestone exists", ("close_milestone",), check_milestone_exists),
+    ("Release assets exist", ("add_assets_to_github_release",), check_release_assets),
+    ("Changelog has unreleased changes", ("update_changelog",), check_changelog),
+    (
+        "Version declarations match",
+        ("update_code_version",),
+        check_version_declarations,
+    ),
+    ("Templates render", (), check_templates),
+    ("Registry is reachable", ("publish_to_registry",), check_registry_reachable),
+]
+
+
+def run(
+    ctx: Context,
+    config: deliverit.config.Configuration,
+    scheduler: RequestScheduler,
+    is_step_enabled: Callable[[str], bool],
+) -> bool:
+    """
+    Runs every check needed by the enabled steps concurrently.
+    Prints the results and returns whether the release can go on.
+    """
+    checks = [
+        (description, check)
+        for description, step_ids, check in CHECKS
+        if not step_ids or any(is_step_enabled(i) for i in step_ids)
+    ]
+    ctx.debug(f"preflight: running {len(checks)} checks")
+
+    def attempt(check: Callable) -> Optional[Exception]:
+        try:
+            check(ctx, config, scheduler)
+        except (PreflightError, PreflightWarning) as problem:
+            return problem
+        except Exception as error:  # pylint: disable=broad-except
+            return PreflightError(f"Could not run the check: {error!r}")
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(checks) or 1) as executor:
+        problems = list(executor.map(attempt, [check for _, check in checks]))
+
+    ok = True
+    for (description, _), problem in zip(checks, problems):
+        if problem is None:
+            ctx.debug(f"preflight: {description}: ok")
+        elif isinstance(problem, PreflightWarning):
+            print(warn(f"⚠ {description}: {problem}"))
+        else:
+            print(red(f"✗ {description}: ") + str(problem))
+            ok = False
+    return ok
@@ -0,0 +1,245 @@
+"""
+--profile: where the time of a release goes, step by step.
+
+Each step runs under a CPU profiler (cProfile), between two tracemalloc snapshots.
+Its time is split between deliverit itself (CPU time), waiting for the commands it runs,
+and waiting for anything else (API calls, disk). Each step's profile is written to a file
+that pstats, snakeviz and the like can read, and a summary ranks the functions that took
+the most time and the lines that allocated the most memory, over the whole release.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import atexit
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+from pydantic import BaseModel
+
+from deliverit.ui import *
+
+# How many functions and allocation sites the summary lists
+TOP = 25
+
+
+def default_profiles_directory() -> Path:
+    state_home = os.getenv("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return (
+        Path(state_home)
+        / "deliverit"
+        / "profiles"
+        # Releases of a fleet start at the same time
+        / f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    )
+
+
+class StepProfile(BaseModel):
+    name: str
+    # Seconds
+    wall: float = 0.0
+    cpu: float = 0.0
+    commands: float = 0.0
+    # Bytes still allocated at the end of the step, and the most allocated during it
+    allocated: int = 0
+    peak: int = 0
+    profile_file: Optional[str] = None
+    # (file:line, bytes) of the lines whose allocations are still held at the end of the step
+    allocation_sites: list[tuple[str, int]] = []
+
+    @property
+    def other_waits(self) -> float:
+        """Time spent neither running deliverit's code nor waiting for commands: network, disk..."""
+        return max(0.0, self.wall - self.cpu - self.commands)
+
+
+class Profiler:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.steps: list[StepProfile] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        if getattr(self._local, "step", None) is not None:
+            # Only one profiler can run in a thread: nested steps are part of their parent
+            yield
+            return
+        step = StepProfile(name=name)
+        self._local.step = step
+        before = _snapshot()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        started_at, cpu_started_at = time.perf_counter(), time.thread_time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            step.wall = time.perf_counter() - started_at
+            step.cpu = time.thread_time() - cpu_started_at
+            self._local.step = None
+            _, step.peak = tracemalloc.get_traced_memory()
+            differences = _snapshot().compare_to(before, "lineno")
+            step.allocated = sum(d.size_diff for d in differences)
+            step.allocation_sites = [
+                (f"{d.traceback[0].filename}:{d.traceback[0].lineno}", d.size_diff)
+                for d in differences[:TOP]
+                if d.size_diff > 0
+            ]
+            self._save(step, profiler)
+
+    @contextmanager
+    def waiting_for_command(self) -> Iterator[None]:
+        step = getattr(self._local, "step", None)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            if step is not None:
+                step.commands += time.perf_counter() - started_at
+
+    def _save(self, step: StepProfile, profiler: cProfile.Profile):
+        with self._lock:
+            self.steps.append(step)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = re.sub(r"[^\w.-]", "_", step.name)
+            filename = f"{len(self.steps):02d}-{name}.prof"
+            step.profile_file = str(self.directory / filename)
+        profiler.dump_stats(step.profile_file)
+
+    def summary(self) -> str:
+        lines = [
+            "Steps, slowest first (seconds; CPU: deliverit itself, commands: waiting for the commands it ran,",
+            "other: waiting for the rest, e.g. API calls and disk; memory still allocated at the end, peak)",
+            "",
+            f"{'wall':>8} {'CPU':>8} {'commands':>9} {'other':>8} {'memory':>9} {'peak':>9}  step",
+        ]
+        for step in sorted(self.steps, key=lambda s: s.wall, reverse=True):
+            lines.append(
+                f"{step.wall:8.3f} {step.cpu:8.3f} {step.commands:9.3f} {step.other_waits:8.3f}"
+                f" {_size(step.allocated):>9} {_size(step.peak):>9}  {step.name}"
+            )
+
+        lines += [
+            "",
+            f"Top {TOP} functions by time spent in their own code, over all steps",
+            "",
+            f"{'own':>8} {'total':>8} {'calls':>8}  function",
+        ]
+        profile_files = [s.profile_file for s in self.steps if s.profile_file]
+        if profile_files:
+            stats = pstats.Stats(*profile_files)
+            ranked = sorted(
+                stats.stats.items(),  # type: ignore
+                key=lambda item: item[1][2],
+                reverse=True,
+            )
+            for (filename, line, function), (_, calls, own, total, _) in ranked[:TOP]:
+                lines.append(
+                    f"{own:8.3f} {total:8.3f} {calls:8d}  {_location(filename, line, function)}"
+                )
+
+        lines += [
+            "",
+            f"Top {TOP} lines by memory allocated and still held at the end of their step, over all steps",
+            "",
+            f"{'memory':>9}  line",
+        ]
+        sites: dict[str, int] = {}
+        for step in self.steps:
+            for site, size in step.allocation_sites:
+                sites[site] = sites.get(site, 0) + size
+        for site, size in sorted(sites.items(), key=lambda i: i[1], reverse=True)[:TOP]:
+            lines.append(f"{_size(size):>9}  {site}")
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self):
+        if not self.steps:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        summary = self.summary()
+        (self.directory / "summary.txt").write_text(summary, encoding="utf-8")
+        print()
+        # The steps' table, the rest is in the file
+        print(dim(summary.split("\n\n")[1]))
+        print(dim(f"Profiles of each step and their summary are in {self.directory}"))
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable(directory: Optional[Path] = None) -> Profiler:
+    """
+    Profiles the steps run from now on. The summary is written when deliverit exits,
+    even if the release fails
+    """
+    global _profiler
+    _profiler = Profiler(directory or default_profiles_directory())
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    atexit.register(_profiler.write_summary)
+    return _profiler
+
+
+def finish():
+    """Writes the summary now, for processes that don't exit normally (forked jobs)"""
+    global _profiler
+    if _profiler is None:
+        return
+    atexit.unregister(_profiler.write_summary)
+    _profiler.write_summary()
+    _profiler = None
+
+
+@contextmanager
+def profile(name: str) -> Iterator[None]:
+    """Profiles the block as the step `name`, if profiling is enabled"""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.profile(name):
+        yield
+
+
+@contextmanager
+def waiting_for_command() -> Iterator[None]:
+    """Counts the block's time as time spent waiting for a command in the current step's profile"""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.waiting_for_command():
+        yield
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+
+
+def _location(filename: str, line: int, function: str) -> str:
+    if filename == "~":  # built-in functions
+        return function
+    return f"{filename}:{line}({function})"
+
+
+def _size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
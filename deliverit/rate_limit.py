@@ -0,0 +1,300 @@
+"""
+Schedules API calls around the rate limits of the repository's host (GitHub, GitLab, Gitea)
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Callable
+from datetime import datetime
+import hashlib
+import random
+import threading
+import time
+
+from os import getenv
+
+import github
+
+import deliverit.cassette
+import deliverit.metrics
+import deliverit.remotes
+from deliverit.context import Context
+from deliverit.remotes import Remote
+from deliverit.ui import *
+
+# Start spreading calls out over the time left before the reset
+# when less than this fraction of the budget is left
+PACING_THRESHOLD = 0.1
+# GitHub asks to wait at least a minute after hitting a secondary rate limit
+# when it does not say how long to wait
+SECONDARY_LIMIT_BASE_DELAY = 60  # seconds
+SERVER_ERROR_BASE_DELAY = 2  # seconds
+MAX_DELAY = 15 * 60  # seconds
+
+
+class SharedBudget:
+    """
+    Rate limit budgets shared by the processes of a fleet release (see deliverit.fleet)
+    or by the jobs of deliverit serve, which get it as an argument.
+    Releases using the same token draw from the same budget: each process
+    sees the calls the others made, and when calls must be spread out, the processes wait
+    one after the other instead of all at once.
+    """
+
+    def __init__(self, manager: Any, lock: Any) -> None:
+        # (API URL, token fingerprint) -> (remaining, limit, reset timestamp)
+        self._budgets = manager.dict()
+        # (API URL, token fingerprint) -> when the latest paced call may be made
+        self._paced_until = manager.dict()
+        self.lock = lock
+
+    def update(self, key: tuple[str, str], rate_limiting: tuple[int, int, float]):
+        remaining, _, reset = rate_limiting
+        if remaining < 0:
+            return
+        current = self._budgets.get(key)
+        # Responses can arrive out of order: keep the lowest budget of the latest window
+        if (
+            current is None
+            or reset > current[2]
+            or (reset == current[2] and remaining < current[0])
+        ):
+            self._budgets[key] = rate_limiting
+
+    def pace(self, key: tuple[str, str], delay: float) -> float:
+        """Reserves the time at which a call can be made, `delay` after the latest paced call"""
+        with self.lock:
+            call_at = max(time.time(), self._paced_until.get(key, 0.0)) + delay
+            self._paced_until[key] = call_at
+        return call_at
+
+    def get(self, key: tuple[str, str]) -> tuple[int, int, float]:
+        return self._budgets.get(key, (-1, -1, 0.0))
+
+    def items(self) -> list[tuple[tuple[str, str], tuple[int, int, float]]]:
+        return list(self._budgets.items())
+
+
+# Set in the processes of fleet releases and of deliverit serve's jobs
+_shared_budget: Optional[SharedBudget] = None
+
+
+def share_budget(budget: Optional[SharedBudget]):
+    """Makes the schedulers created from now on (in this process and its forks) use budget"""
+    global _shared_budget
+    _shared_budget = budget
+
+
+class RequestScheduler:
+    """
+    Runs API calls, keeping track of the rate limit budget.
+    Throttles calls when the budget runs low, and retries calls
+    that hit a rate limit, waiting as long as the host asks to.
+
+    The scheduler connects to the host of the first context it is given to connect(),
+    then all calls that make requests should go through call():
+
+        remote = scheduler.connect(ctx)
+        scheduler.call(remote.milestones, ctx.repository_full_name)
+    """
+
+    def __init__(
+        self,
+        remote: Optional[Remote] = None,
+        reserve: int = 20,
+        max_retries: int = 5,
+        shared: Optional[SharedBudget] = None,
+    ):
+        self.remote = remote
+        self.shared = shared or _shared_budget
+        # Calls left untouched for other tools using the same token
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.calls = 0
+        self.retries = 0
+        self.budget_at_start: Optional[int] = None
+        # When the latest paced call may be made
+        self._paced_until = 0.0
+        self._lock = threading.Lock()
+
+    def connect(self, ctx: Context) -> Remote:
+        """The remote hosting ctx's repository, with the token from the environment"""
+        remote = ctx.remote or "github"
+        api_url = ctx.remote_api_url or deliverit.remotes.default_api_url(
+            remote, ctx.repository_url or "https://github.com"
+        )
+        with self._lock:
+            if self.remote is None:
+                self.remote = deliverit.remotes.connect(
+                    remote,
+                    api_url,
+                    getenv(deliverit.remotes.TOKEN_VARIABLES.get(remote, "")),
+                )
+                if deliverit.cassette.active is not None:
+                    deliverit.cassette.active.attach(self.remote)
+            elif (self.remote.kind, self.remote.api_url) != (
+                remote,
+                api_url.rstrip("/"),
+            ):
+                raise ValueError(
+                    f"Cannot release on {api_url} and {self.remote.api_url} at the same time"
+                )
+            return self.remote
+
+    def call(self, function: Callable, *args: Any, **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            self._throttle()
+            try:
+                result = function(*args, **kwargs)
+            except self.errors as error:
+                delay = self._retry_delay(error, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    deliverit.metrics.GITHUB_API_FAILURES.inc()
+                    raise
+                attempt += 1
+                deliverit.metrics.GITHUB_API_RETRIES.inc()
+                with self._lock:
+                    self.retries += 1
+                print(
+                    warn(
+                        f"{self.name} API: {error.status} error, retrying in {delay:.0f}s "
+                        f"({attempt}/{self.max_retries})"
+                    )
+                )
+                time.sleep(delay)
+                continue
+            finally:
+                self._record()
+            return result
+
+    @property
+    def name(self) -> str:
+        return self.remote.name if self.remote else "Git host"
+
+    @property
+    def errors(self) -> tuple[type[Exception], ...]:
+        return self.remote.errors if self.remote else (deliverit.remotes.RemoteError,)
+
+    def _budget_key(self) -> tuple[str, str]:
+        """Identifies the budget in the shared budgets: it is the token's, on that host"""
+        token = (self.remote.token or "") if self.remote else ""
+        return (
+            self.remote.api_url if self.remote else "",
+            hashlib.sha256(token.encode("utf-8")).hexdigest()[:16],
+        )
+
+    def _rate_limiting(self) -> tuple[int, int, float]:
+        """
+        (remaining, limit, reset timestamp), as of the last response
+        (made by any process of the fleet when the budget is shared).
+        PyGithub asks the API for them when no response had them yet,
+        which we don't want to do before the first call.
+        """
+        if self.remote is None:
+            return -1, -1, 0.0
+        own = self.remote.rate_limiting() if self.calls else (-1, -1, 0.0)
+        if self.shared is None:
+            return own
+        shared = self.shared.get(self._budget_key())
+        if (
+            own[0] < 0
+            or shared[2] > own[2]
+            or (shared[2] == own[2] and shared[0] < own[0])
+        ):
+            return shared
+        return own
+
+    def _record(self):
+        deliverit.metrics.GITHUB_API_CALLS.inc()
+        with self._lock:
+            self.calls += 1
+        if self.shared is not None and self.remote is not None:
+            self.shared.update(self._budget_key(), self.remote.rate_limiting())
+        remaining, _, _ = self._rate_limiting()
+        with self._lock:
+            if self.budget_at_start is None and remaining >= 0:
+                # The first response tells us what was left before it, plus itself
+                self.budget_at_start = remaining + 1
+
+    def _throttle(self):
+        """
+        Spreads calls out when the budget runs low: each call waits `delay` after
+        the previous paced one, in the other processes too. The wait happens without
+        holding any lock, so that calls that don't need pacing are not held up.
+        """
+        with self._lock:
+            remaining, limit, reset = self._rate_limiting()
+            if remaining < 0:
+                return
+            until_reset = max(0.0, reset - time.time())
+            if remaining <= self.reserve:
+                delay = until_reset
+            elif remaining < limit * PACING_THRESHOLD:
+                delay = until_reset / (remaining - self.reserve)
+            else:
+                return
+            delay = min(delay, MAX_DELAY)
+            if self.shared is None:
+                call_at = max(time.time(), self._paced_until) + delay
+                self._paced_until = call_at
+        if self.shared is not None:
+            call_at = self.shared.pace(self._budget_key(), delay)
+        wait = call_at - time.time()
+        if wait > 1:
+            print(
+                warn(
+                    f"{self.name} API: {remaining}/{limit} calls left, waiting {wait:.0f}s"
+                )
+            )
+        if wait > 0:
+            time.sleep(wait)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        How long to wait before retrying after `error`, None if it should not be retried
+        """
+        headers = {
+            k.lower(): v for k, v in (getattr(error, "headers", None) or {}).items()
+        }
+        message = str(error.data).lower()
+
+        # GitHub and Gitea prefix them with x-, GitLab doesn't
+        remaining = headers.get(
+            "x-ratelimit-remaining", headers.get("ratelimit-remaining")
+        )
+        reset = headers.get("x-ratelimit-reset", headers.get("ratelimit-reset"))
+
+        if "retry-after" in headers:
+            return min(float(headers["retry-after"]), MAX_DELAY)
+        if isinstance(error, github.RateLimitExceededException) or (
+            error.status in (403, 429) and remaining == "0"
+        ):
+            reset = float(reset or self._rate_limiting()[2])
+            return min(max(1.0, reset - time.time()), MAX_DELAY)
+        if error.status in (403, 429) and (
+            "secondary rate limit" in message or "abuse" in message
+        ):
+            # Exponential backoff, with jitter to keep concurrent releases from retrying together
+            return min(
+                SECONDARY_LIMIT_BASE_DELAY * 2**attempt * random.uniform(1, 1.5),
+                MAX_DELAY,
+            )
+        if error.status in (502, 503, 504):
+            return SERVER_ERROR_BASE_DELAY * 2**attempt * random.uniform(1, 1.5)
+        return None
+
+    def report(self) -> str:
+        """Describes the API budget consumed so far"""
+        remaining, limit, reset = self._rate_limiting()
+        if remaining < 0:
+            return f"{self.name} API: {self.calls} calls ({self.retries} retried)"
+        cost = (
+            f", {self.budget_at_start - remaining} of the rate limit budget"
+            if self.budget_at_start is not None and self.budget_at_start >= remaining
+            else ""
+        )
+        resets_at = datetime.fromtimestamp(reset)
+        return (
+            f"{self.name} API: {self.calls} calls ({self.retries} retried){cost}. "
+            f"{remaining}/{limit} left until {resets_at:%H:%M}"
+        )
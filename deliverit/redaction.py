@@ -0,0 +1,114 @@
+"""
+Hiding secrets (tokens, passwords) from everything deliverit prints: echoed commands,
+and the output of the commands it runs, even when it is printed while it is produced.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, Iterable
+from os import getenv
+import re
+import threading
+
+from deliverit.remotes import TOKEN_VARIABLES
+
+REPLACEMENT = "[HIDDEN]"
+# Shorter values would hide every word that contains them, and can't be much of a secret anyway
+MIN_SECRET_LENGTH = 4
+# Environment variables that always hold secrets
+SECRET_VARIABLES = [*TOKEN_VARIABLES.values(), "PYPI_PASSWORD"]
+
+
+class Redactor:
+    """
+    Replaces every occurrence of the secrets in one pass, whatever their number:
+    they are compiled into a single pattern, longest first so that a secret
+    that contains another one is hidden whole.
+    """
+
+    def __init__(self, secrets: Iterable[str], replacement: str = REPLACEMENT) -> None:
+        self.secrets = sorted(set(secrets), key=len, reverse=True)
+        self.replacement = replacement
+        self.longest = len(self.secrets[0]) if self.secrets else 0
+        self.pattern = (
+            re.compile("|".join(re.escape(secret) for secret in self.secrets))
+            if self.secrets
+            else None
+        )
+
+    def redact(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self.replacement, text)
+
+    def stream(self) -> "StreamRedactor":
+        return StreamRedactor(self)
+
+
+class StreamRedactor:
+    """
+    Redacts text that comes in chunks. A secret can be split across chunks, so the end
+    of each chunk that could be the start of a secret is held back until the next one.
+    """
+
+    def __init__(self, redactor: Redactor) -> None:
+        self.redactor = redactor
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        """The part of the text fed so far that can be printed already, redacted"""
+        pattern = self.redactor.pattern
+        if pattern is None:
+            return chunk
+        text = self._pending + chunk
+        # Secrets starting before cut are entirely in text
+        cut = len(text) - (self.redactor.longest - 1)
+        output = []
+        position = 0
+        for match in pattern.finditer(text):
+            if match.start() >= cut:
+                break
+            output.append(text[position : match.start()])
+            output.append(self.redactor.replacement)
+            position = match.end()
+        if position < cut:
+            output.append(text[position:cut])
+            position = cut
+        self._pending = text[position:]
+        return "".join(output)
+
+    def flush(self) -> str:
+        """The rest of the text, redacted"""
+        rest, self._pending = self._pending, ""
+        return self.redactor.redact(rest)
+
+
+_lock = threading.Lock()
+_secrets: set[str] = set()
+_redactor: Optional[Redactor] = None
+
+
+def hide(*values: Optional[str]):
+    """Hides values from now on. Unset (None) and too short values are ignored"""
+    global _redactor
+    with _lock:
+        new = {v for v in values if v and len(v) >= MIN_SECRET_LENGTH} - _secrets
+        if new:
+            _secrets.update(new)
+            _redactor = None
+
+
+def hide_variables(names: Iterable[str]):
+    """Hides the values of the environment variables `names`"""
+    hide(*(getenv(name) for name in names))
+
+
+def redactor() -> Redactor:
+    global _redactor
+    with _lock:
+        if _redactor is None:
+            _redactor = Redactor(_secrets)
+        return _redactor
+
+
+def redact(text: str) -> str:
+    return redactor().redact(text)
@@ -0,0 +1,683 @@
+"""
+The APIs of the hosts repositories live on (GitHub, GitLab, Gitea), behind one interface.
+
+Each remote keeps a pool of connections open for the whole release, so that concurrent calls
+(e.g. uploading assets) don't each open their own. Calls should go through a RequestScheduler,
+which retries them and keeps them within the host's rate limits.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any, BinaryIO, Iterator
+from urllib.parse import quote, unquote, urlparse
+import io
+import re
+import threading
+import uuid
+
+import github
+import requests
+from pydantic import BaseModel
+
+# Connections kept open per host: assets of several packages can be uploaded at the same time
+POOL_SIZE = 16
+# Seconds to wait for the host to accept the connection, and then for each response
+TIMEOUT = (10, 300)
+
+# Environment variables holding the tokens, by remote
+TOKEN_VARIABLES = {
+    "github": "GITHUB_TOKEN",
+    "gitlab": "GITLAB_TOKEN",
+    "gitea": "GITEA_TOKEN",
+}
+
+
+class RemoteError(Exception):
+    """
+    An error response from the host's API.
+    Has the same attributes as PyGithub's exceptions, so that both are retried the same way.
+    """
+
+    def __init__(self, status: int, data: Any, headers: dict[str, str]) -> None:
+        super().__init__(f"{status} {data}")
+        self.status = status
+        self.data = data
+        self.headers = headers
+
+
+class Release(BaseModel):
+    id: Union[int, str]
+    tag_name: str
+    # The host's own object for the release, when its client library has one
+    raw: Any = None
+
+
+class Asset(BaseModel):
+    id: Union[int, str]
+    # The file's name, which can differ from the name shown on the release (its label)
+    name: str
+    # None when the host does not tell
+    size: Optional[int] = None
+    # "<algorithm>:<hex digest>", e.g. "sha256:e3b0c4...", None when the host does not tell
+    digest: Optional[str] = None
+    # False for uploads that were interrupted
+    complete: bool = True
+    raw: Any = None
+
+
+class Remote:
+    """A git host's API. Subclasses implement it for each host"""
+
+    # The value of the `remote` configuration option
+    kind = ""
+    # Used in messages
+    name = "remote"
+    # Exceptions raised by failed calls, that the scheduler may retry
+    errors: tuple[type[Exception], ...] = (RemoteError,)
+
+    def __init__(
+        self, api_url: str, token: Optional[str], pool_size: int = POOL_SIZE
+    ) -> None:
+        self.api_url = api_url.rstrip("/")
+        self.token = token
+        self.pool_size = pool_size
+
+    @property
+    def token_variable(self) -> str:
+        return TOKEN_VARIABLES[self.kind]
+
+    def rate_limiting(self) -> tuple[int, int, float]:
+        """(remaining, limit, reset timestamp) as of the last response, (-1, -1, 0) if unknown"""
+        raise NotImplementedError("Please implement this method")
+
+    def check_access(self, repository: str) -> Optional[str]:
+        """Describes why the token cannot publish releases of repository, None if it can"""
+        raise NotImplementedError("Please implement this method")
+
+    def get_release(self, repository: str, tag_name: str) -> Optional[Release]:
+        """The release for tag_name, None if there is none"""
+        raise NotImplementedError("Please implement this method")
+
+    def create_release(
+        self, repository: str, tag_name: str, title: str, notes: str
+    ) -> Release:
+        raise NotImplementedError("Please implement this method")
+
+    def upload_asset(
+        self,
+        repository: str,
+        release: Release,
+        name: str,
+        stream: BinaryIO,
+        size: int,
+        content_type: str,
+        label: Optional[str] = None,
+    ):
+        """Uploads `size` bytes read from stream, without holding them in memory"""
+        raise NotImplementedError("Please implement this method")
+
+    def assets(self, repository: str, release: Release) -> list[Asset]:
+        """The files attached to the release"""
+        raise NotImplementedError("Please implement this method")
+
+    def delete_asset(self, repository: str, release: Release, asset: Asset):
+        raise NotImplementedError("Please implement this method")
+
+    def milestones(self, repository: str, title: Optional[str] = None) -> list[str]:
+        """Titles of the open milestones, only the ones named `title` if given"""
+        raise NotImplementedError("Please implement this method")
+
+    def close_milestone(self, repository: str, title: str) -> bool:
+        """Closes the open milestone named title. Returns False if there is none"""
+        raise NotImplementedError("Please implement this method")
+
+
+class GitHubRemote(Remote):
+    kind = "github"
+    name = "GitHub"
+    errors = (github.GithubException,)
+
+    def __init__(
+        self, api_url: str, token: Optional[str], pool_size: int = POOL_SIZE
+    ) -> None:
+        super().__init__(api_url, token, pool_size)
+        self.gh = github.Github(token, base_url=self.api_url, pool_size=pool_size)
+        self._repositories: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _repository(self, repository: str) -> Any:
+        """
+        The repository's object, without requesting it:
+        one request less for each call, the calls on the object fail if it does not exist
+        """
+        with self._lock:
+            if repository not in self._repositories:
+                self._repositories[repository] = self.gh.get_repo(repository, lazy=True)
+            return self._repositories[repository]
+
+    def rate_limiting(self) -> tuple[int, int, float]:
+        try:
+            remaining, limit = self.gh.rate_limiting
+            return remaining, limit, float(self.gh.rate_limiting_resettime)
+        except github.GithubException:
+            return -1, -1, 0.0
+
+    def check_access(self, repository: str) -> Optional[str]:
+        try:
+            repo = self.gh.get_repo(repository)
+        except github.BadCredentialsException:
+            return f"{self.token_variable} is invalid or expired"
+        except github.UnknownObjectException:
+            return f"The repository {repository} does not exist or {self.token_variable} cannot see it"
+        # Fine-grained tokens don't report scopes, only classic tokens do
+        scopes = self.gh.oauth_scopes
+        if scopes is not None and not {"repo", "public_repo"} & set(scopes):
+            return (
+                f"{self.token_variable} is missing the 'repo' (or 'public_repo') scope"
+            )
+        if repo.permissions is not None and not repo.permissions.push:
+            return f"{self.token_variable} does not have write access to {repository}"
+        return None
+
+    def get_release(self, repository: str, tag_name: str) -> Optional[Release]:
+        try:
+            release = self._repository(repository).get_release(tag_name)
+        except github.UnknownObjectException:
+            return None
+        return Release(id=release.id, tag_name=release.tag_name, raw=release)
+
+    def create_release(
+        self, repository: str, tag_name: str, title: str, notes: str
+    ) -> Release:
+        release = self._repository(repository).create_git_release(
+            tag=tag_name, name=title, message=notes
+        )
+        return Release(id=release.id, tag_name=release.tag_name, raw=release)
+
+    def upload_asset(
+        self,
+        repository: str,
+        release: Release,
+        name: str,
+        stream: BinaryIO,
+        size: int,
+        content_type: str,
+        label: Optional[str] = None,
+    ):
+        self._raw_release(repository, release).upload_asset_from_memory(
+            stream, size, name, content_type=content_type, label=label or ""
+        )
+
+    def _raw_release(self, repository: str, release: Release) -> Any:
+        if release.raw is None:
+            release.raw = self._repository(repository).get_release(release.id)
+        return release.raw
+
+    def assets(self, repository: str, release: Release) -> list[Asset]:
+        return [
+            Asset(
+                id=asset.id,
+                name=asset.name,
+                size=asset.size,
+                # PyGithub reads GitHub's digests since 2.8, older versions compare sizes
+                digest=getattr(asset, "digest", None),
+                # Interrupted uploads stay in the "starter" state
+                complete=asset.state == "uploaded",
+                raw=asset,
+            )
+            for asset in self._raw_release(repository, release).get_assets()
+        ]
+
+    def delete_asset(self, repository: str, release: Release, asset: Asset):
+        asset.raw.delete_asset()
+
+    def milestones(self, repository: str, title: Optional[str] = None) -> list[str]:
+        titles = [m.title for m in self._repository(repository).get_milestones()]
+        return [t for t in titles if title is None or t == title]
+
+    def close_milestone(self, repository: str, title: str) -> bool:
+        for milestone in self._repository(repository).get_milestones():
+            if milestone.title == title:
+                milestone.edit(state="closed", title=title)
+                return True
+        return False
+
+
+class HTTPRemote(Remote):
+    """Remotes whose API is called directly, through a pooled session"""
+
+    # Query parameter setting the page size, and its maximum
+    page_size = ("per_page", 100)
+
+    def __init__(
+        self, api_url: str, token: Optional[str], pool_size: int = POOL_SIZE
+    ) -> None:
+        super().__init__(api_url, token, pool_size)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self._authentication_headers())
+        self._rate_limiting = (-1, -1, 0.0)
+        self._lock = threading.Lock()
+
+    def _authentication_headers(self) -> dict[str, str]:
+        raise NotImplementedError("Please implement this method")
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Calls the API at path (relative to api_url, or absolute). Raises RemoteError on error responses"""
+        url = path if "://" in path else f"{self.api_url}/{path.lstrip('/')}"
+        response = self.session.request(method, url, timeout=TIMEOUT, **kwargs)
+        self._record_rate_limiting(response)
+        if response.status_code >= 400:
+            try:
+                data = response.json()
+            except ValueError:
+                data = response.text
+            raise RemoteError(response.status_code, data, dict(response.headers))
+        return response
+
+    def paginate(self, path: str, params: dict[str, Any]) -> Iterator[Any]:
+        """Items of every page of the list at path"""
+        parameter, size = self.page_size
+        response = self.request("GET", path, params={**params, parameter: size})
+        yield from response.json()
+        while "next" in response.links:
+            response = self.request("GET", response.links["next"]["url"])
+            yield from response.json()
+
+    def _record_rate_limiting(self, response: requests.Response):
+        headers = {k.lower(): v for k, v in response.headers.items()}
+        for prefix in ("ratelimit-", "x-ratelimit-"):
+            try:
+                rate_limiting = (
+                    int(headers[prefix + "remaining"]),
+                    int(headers[prefix + "limit"]),
+                    float(headers[prefix + "reset"]),
+                )
+            except (KeyError, ValueError):
+                continue
+            with self._lock:
+                self._rate_limiting = rate_limiting
+            return
+
+    def rate_limiting(self) -> tuple[int, int, float]:
+        with self._lock:
+            return self._rate_limiting
+
+    def _get_or_none(self, path: str) -> Optional[Any]:
+        try:
+            return self.request("GET", path).json()
+        except RemoteError as error:
+            if error.status == 404:
+                return None
+            raise
+
+    def _check_response(self, repository: str, path: str) -> tuple[Optional[str], Any]:
+        """(problem, repository's JSON) for check_access"""
+        try:
+            return None, self.request("GET", path).json()
+        except RemoteError as error:
+            if error.status == 401:
+                return f"{self.token_variable} is invalid or expired", None
+            if error.status in (403, 404):
+                return (
+                    f"The repository {repository} does not exist or {self.token_variable} cannot see it",
+                    None,
+                )
+            raise
+
+
+class GitLabRemote(HTTPRemote):
+    kind = "gitlab"
+    name = "GitLab"
+
+    # Developers can publish releases
+    DEVELOPER_ACCESS_LEVEL = 30
+
+    def _authentication_headers(self) -> dict[str, str]:
+        return {"PRIVATE-TOKEN": self.token} if self.token else {}
+
+    def _project(self, repository: str) -> str:
+        # Projects can be in nested groups: group/subgroup/project
+        return f"projects/{quote(repository, safe='')}"
+
+    def check_access(self, repository: str) -> Optional[str]:
+        problem, project = self._check_response(repository, self._project(repository))
+        if problem:
+            return problem
+        permissions = project.get("permissions") or {}
+        access_level = max(
+            (permissions.get(scope) or {}).get("access_level", 0)
+            for scope in ("project_access", "group_access")
+        )
+        if permissions and access_level < self.DEVELOPER_ACCESS_LEVEL:
+            return f"{self.token_variable} does not have write access to {repository}"
+        return None
+
+    def get_release(self, repository: str, tag_name: str) -> Optional[Release]:
+        release = self._get_or_none(
+            f"{self._project(repository)}/releases/{quote(tag_name, safe='')}"
+        )
+        if release is None:
+            return None
+        return Release(id=release["tag_name"], tag_name=release["tag_name"])
+
+    def create_release(
+        self, repository: str, tag_name: str, title: str, notes: str
+    ) -> Release:
+        release = self.request(
+            "POST",
+            f"{self._project(repository)}/releases",
+            json={"tag_name": tag_name, "name": title, "description": notes},
+        ).json()
+        return Release(id=release["tag_name"], tag_name=release["tag_name"])
+
+    def upload_asset(
+        self,
+        repository: str,
+        release: Release,
+        name: str,
+        stream: BinaryIO,
+        size: int,
+        content_type: str,
+        label: Optional[str] = None,
+    ):
+        path = self._package_file_path(repository, release, name)
+        self.request(
+            "PUT",
+            path,
+            data=stream,
+            headers={"Content-Type": content_type, "Content-Length": str(size)},
+        )
+        self.request(
+            "POST",
+            f"{self._project(repository)}/releases/{quote(release.tag_name, safe='')}/assets/links",
+            json={
+                "name": label or name,
+                "url": f"{self.api_url}/{path}",
+                "link_type": "package",
+            },
+        )
+
+    def _generic_package(self, repository: str, release: Release) -> tuple[str, str]:
+        """
+        (name, version) of the package holding the release's files:
+        GitLab releases only link to files, they are stored in the project's generic package registry
+        """
+        return repository.rsplit("/", 1)[-1], re.sub(r"[^\w.+-]", "-", release.tag_name)
+
+    def _package_file_path(self, repository: str, release: Release, name: str) -> str:
+        return f"{self._project(repository)}/packages/generic/" + "/".join(
+            quote(part, safe="")
+            for part in (*self._generic_package(repository, release), name)
+        )
+
+    def assets(self, repository: str, release: Release) -> list[Asset]:
+        project = self._project(repository)
+        links = list(
+            self.paginate(
+                f"{project}/releases/{quote(release.tag_name, safe='')}/assets/links",
+                {},
+            )
+        )
+        # Sizes and digests are only known for the files in the generic package
+        package_name, package_version = self._generic_package(repository, release)
+        package_files: dict[str, tuple[Any, Any]] = {}
+        for package in self.paginate(
+            f"{project}/packages",
+            {"package_type": "generic", "package_name": package_name},
+        ):
+            if package["version"] != package_version:
+                continue
+            for package_file in self.paginate(
+                f"{project}/packages/{package['id']}/package_files", {}
+            ):
+                # A file uploaded again is added next to the previous one, the latest is served
+                previous = package_files.get(package_file["file_name"])
+                if previous is None or previous[1]["id"] < package_file["id"]:
+                    package_files[package_file["file_name"]] = package, package_file
+        assets = []
+        for link in links:
+            name = unquote(link["url"].rstrip("/").rsplit("/", 1)[-1])
+            package, package_file = package_files.get(name, (None, None))
+            if package_file is not None and link["url"] != (
+                f"{self.api_url}/{self._package_file_path(repository, release, name)}"
+            ):
+                package, package_file = None, None
+            assets.append(
+                Asset(
+                    id=link["id"],
+                    name=name,
+                    size=package_file["size"] if package_file else None,
+                    digest=(
+                        f"sha256:{package_file['file_sha256']}"
+                        if package_file and package_file.get("file_sha256")
+                        else None
+                    ),
+                    raw={
+                        "package": package["id"] if package else None,
+                        "package_file": package_file["id"] if package_file else None,
+                    },
+                )
+            )
+        return assets
+
+    def delete_asset(self, repository: str, release: Release, asset: Asset):
+        project = self._project(repository)
+        self.request(
+            "DELETE",
+            f"{project}/releases/{quote(release.tag_name, safe='')}/assets/links/{asset.id}",
+        )
+        if asset.raw and asset.raw["package_file"] is not None:
+            self.request(
+                "DELETE",
+                f"{project}/packages/{asset.raw['package']}/package_files/{asset.raw['package_file']}",
+            )
+
+    def _open_milestones(self, repository: str, title: Optional[str]) -> list[Any]:
+        params: dict[str, Any] = {"state": "active"}
+        if title is not None:
+            params["title"] = title
+        return [
+            milestone
+            for milestone in self.paginate(
+                f"{self._project(repository)}/milestones", params
+            )
+            if title is None or milestone["title"] == title
+        ]
+
+    def milestones(self, repository: str, title: Optional[str] = None) -> list[str]:
+        return [m["title"] for m in self._open_milestones(repository, title)]
+
+    def close_milestone(self, repository: str, title: str) -> bool:
+        milestones = self._open_milestones(repository, title)
+        for milestone in milestones:
+            self.request(
+                "PUT",
+                f"{self._project(repository)}/milestones/{milestone['id']}",
+                json={"state_event": "close"},
+            )
+        return bool(milestones)
+
+
+class GiteaRemote(HTTPRemote):
+    kind = "gitea"
+    name = "Gitea"
+    page_size = ("limit", 50)
+
+    def _authentication_headers(self) -> dict[str, str]:
+        return {"Authorization": f"token {self.token}"} if self.token else {}
+
+    def _repository(self, repository: str) -> str:
+        return f"repos/{quote(repository)}"
+
+    def check_access(self, repository: str) -> Optional[str]:
+        problem, repo = self._check_response(repository, self._repository(repository))
+        if problem:
+            return problem
+        if repo.get("permissions") and not repo["permissions"].get("push"):
+            return f"{self.token_variable} does not have write access to {repository}"
+        return None
+
+    def get_release(self, repository: str, tag_name: str) -> Optional[Release]:
+        release = self._get_or_none(
+            f"{self._repository(repository)}/releases/tags/{quote(tag_name, safe='')}"
+        )
+        if release is None:
+            return None
+        return Release(id=release["id"], tag_name=release["tag_name"])
+
+    def create_release(
+        self, repository: str, tag_name: str, title: str, notes: str
+    ) -> Release:
+        release = self.request(
+            "POST",
+            f"{self._repository(repository)}/releases",
+            json={"tag_name": tag_name, "name": title, "body": notes},
+        ).json()
+        return Release(id=release["id"], tag_name=release["tag_name"])
+
+    def upload_asset(
+        self,
+        repository: str,
+        release: Release,
+        name: str,
+        stream: BinaryIO,
+        size: int,
+        content_type: str,
+        label: Optional[str] = None,
+    ):
+        # Gitea has no labels for assets
+        body = MultipartReader("attachment", name, stream, size, content_type)
+        self.request(
+            "POST",
+            f"{self._repository(repository)}/releases/{release.id}/assets",
+            params={"name": name},
+            data=body,
+            headers={
+                "Content-Type": body.content_type,
+                "Content-Length": str(len(body)),
+            },
+        )
+
+    def assets(self, repository: str, release: Release) -> list[Asset]:
+        # Gitea does not give digests
+        return [
+            Asset(id=asset["id"], name=asset["name"], size=asset["size"])
+            for asset in self.request(
+                "GET", f"{self._repository(repository)}/releases/{release.id}/assets"
+            ).json()
+        ]
+
+    def delete_asset(self, repository: str, release: Release, asset: Asset):
+        self.request(
+            "DELETE",
+            f"{self._repository(repository)}/releases/{release.id}/assets/{asset.id}",
+        )
+
+    def _open_milestones(self, repository: str, title: Optional[str]) -> list[Any]:
+        params: dict[str, Any] = {"state": "open"}
+        if title is not None:
+            params["name"] = title
+        return [
+            milestone
+            for milestone in self.paginate(
+                f"{self._repository(repository)}/milestones", params
+            )
+            if title is None or milestone["title"] == title
+        ]
+
+    def milestones(self, repository: str, title: Optional[str] = None) -> list[str]:
+        return [m["title"] for m in self._open_milestones(repository, title)]
+
+    def close_milestone(self, repository: str, title: str) -> bool:
+        milestones = self._open_milestones(repository, title)
+        for milestone in milestones:
+            self.request(
+                "PATCH",
+                f"{self._repository(repository)}/milestones/{milestone['id']}",
+                json={"state": "closed"},
+            )
+        return bool(milestones)
+
+
+class MultipartReader:
+    """
+    A multipart/form-data body with a single file field, read from stream as it is sent,
+    instead of being built in memory first
+    """
+
+    def __init__(
+        self, field: str, filename: str, stream: BinaryIO, size: int, content_type: str
+    ) -> None:
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        filename = filename.replace('"', "%22")
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._parts: list[BinaryIO] = [io.BytesIO(head), stream, io.BytesIO(tail)]
+        self._size = len(head) + size + len(tail)
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and size != 0:
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+    def __len__(self) -> int:
+        return self._size
+
+
+# Remotes by the value of the `remote` configuration option
+REMOTES: dict[str, type[Remote]] = {
+    "github": GitHubRemote,
+    "gitlab": GitLabRemote,
+    "gitea": GiteaRemote,
+}
+
+
+def detect(repository_url: str) -> Optional[str]:
+    """Which remote hosts the repository at repository_url, None if it can't be told from its URL"""
+    host = urlparse(repository_url).hostname or ""
+    if host == "github.com":
+        return "github"
+    if host == "gitlab.com" or "gitlab" in host.split("."):
+        return "gitlab"
+    if host == "codeberg.org" or "gitea" in host.split("."):
+        return "gitea"
+    return None
+
+
+def default_api_url(remote: str, repository_url: str) -> str:
+    """The API of the host of repository_url, for self-hosted instances too"""
+    url = urlparse(repository_url)
+    if remote == "github":
+        if url.hostname == "github.com":
+            return "https://api.github.com"
+        # GitHub Enterprise Server
+        return f"{url.scheme}://{url.netloc}/api/v3"
+    if remote == "gitlab":
+        return f"{url.scheme}://{url.netloc}/api/v4"
+    if remote == "gitea":
+        return f"{url.scheme}://{url.netloc}/api/v1"
+    raise ValueError(f"Unknown remote {remote!r}")
+
+
+def connect(remote: str, api_url: str, token: Optional[str]) -> Remote:
+    try:
+        cls = REMOTES[remote]
+    except KeyError:
+        raise ValueError(f"Unknown remote {remote!r}, use one of {', '.join(REMOTES)}")
+    return cls(api_url, token)
@@ -0,0 +1,374 @@
+"""
+deliverit serve: a long-running process that runs release jobs sent to it over a unix socket.
+
+Jobs run in processes forked from a fork server (multiprocessing's "forkserver"), which imports
+deliverit once: jobs start with everything already imported, and get the configuration file and
+manifests the server parsed while they were queued. Jobs are not forked from the server itself:
+its threads could be holding locks (e.g. stdout's) at that moment, and the job would wait for
+them forever. The fork server has a single thread.
+Each job gets its own working directory and environment: jobs for different repositories
+run concurrently, jobs for the same repository one after the other.
+
+What jobs reuse from the server and from the jobs before them:
+- the imports, in the fork server
+- the parsed configuration file and manifests, see warm()
+- the rate limit budgets of the tokens, shared by all jobs like in fleets
+  (see deliverit.rate_limit.SharedBudget): a job paces its first API calls with what the
+  jobs before it learned, instead of finding out once it is close to the limit
+- the commits read from the history, cached on disk by deliverit.history
+
+What they don't:
+- API connections. A connection pool belongs to the process that opened it, and jobs are
+  separate processes (for their working directory and environment): each opens its own.
+- the list of tags. Each release adds tags, so an index kept by the server would be
+  outdated by the job before; jobs list them once, with a single git command.
+
+The protocol is one JSON object per line, answered by one JSON object per line:
+
+    {"command": "release", "repository": "/path/to/repo", "args": ["patch"]}
+    {"command": "status", "job": "<id returned by release>"}
+    {"command": "jobs"}
+    {"command": "metrics"}
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from collections import OrderedDict, deque
+from pathlib import Path
+import json
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from docopt import docopt
+from pydantic import BaseModel
+
+import deliverit.config
+import deliverit.manifest_file
+import deliverit.profiling
+import deliverit.rate_limit
+from deliverit.rate_limit import SharedBudget
+from deliverit.ui import *
+
+# How many finished jobs to remember
+FINISHED_JOBS_KEPT = 1000
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return str(Path(runtime_dir) / "deliverit.sock")
+    return f"/tmp/deliverit-{os.getuid()}.sock"
+
+
+def default_logs_directory() -> Path:
+    state_home = os.getenv("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return Path(state_home) / "deliverit" / "jobs"
+
+
+class Job(BaseModel):
+    id: str
+    repository: str
+    args: list[str]
+    # queued, running, succeeded or failed
+    state: str = "queued"
+    exit_code: Optional[int] = None
+    log: str
+    queued_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+def parse_job_args(args: list[str]) -> dict[str, Any]:
+    """A job's arguments, parsed like deliverit's command line. Raises ValueError if they are invalid"""
+    from deliverit.deliverit import __doc__ as usage
+
+    try:
+        return docopt(usage, argv=args, help=False)
+    except SystemExit as error:
+        raise ValueError(f"Invalid arguments {' '.join(args)!r}") from error
+
+
+def run_job(
+    repository: str,
+    args: list[str],
+    log: str,
+    warmed: Optional[dict[str, Any]] = None,
+    budget: Optional[SharedBudget] = None,
+):
+    """
+    Runs in the forked process. warmed is what warm() parsed for the job,
+    budget the rate limit budgets it shares with other jobs
+    """
+    if budget is not None:
+        deliverit.rate_limit.share_budget(budget)
+    if warmed:
+        deliverit.config.preload(warmed["configuration"])
+        deliverit.manifest_file.preload(warmed["manifests"])
+    os.chdir(repository)
+    # Send the output of deliverit and of the commands it runs to the job's log
+    with open(log, "ab", buffering=0) as output, open(os.devnull, "rb") as devnull:
+        os.dup2(output.fileno(), 1)
+        os.dup2(output.fileno(), 2)
+        os.dup2(devnull.fileno(), 0)
+    sys.stdout = open(1, "w", buffering=1, encoding="utf-8", closefd=False)
+    sys.stderr = open(2, "w", buffering=1, encoding="utf-8", closefd=False)
+    sys.argv = ["deliverit", *args]
+
+    from deliverit.deliverit import run
+
+    try:
+        run()
+    except SystemExit:
+        raise
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        # Forked processes exit without running atexit functions
+        deliverit.profiling.finish()
+    sys.exit(0)
+
+
+def warm(repository: str) -> Optional[dict[str, Any]]:
+    """
+    Parses the repository's configuration file and manifests in the server.
+    Returns them, for run_job to add to the job's caches (they are used until the files are modified)
+    """
+    for filename in (".deliverit.yaml", ".deliverit.yml"):
+        config_file = Path(repository) / filename
+        if config_file.is_file():
+            break
+    else:
+        return None
+    config = deliverit.config.sanitize_keys(deliverit.config.read(str(config_file)))
+    language_defaults = deliverit.config.LANGUAGE_BASED_DEFAULTS.get(
+        config.get("language"), {}
+    )
+    manifest_files = [
+        str(Path(repository) / manifest_file)
+        for manifest_file in [
+            config.get("manifest_file", language_defaults.get("manifest_file")),
+            *config.get("packages", []),
+        ]
+        if manifest_file and (Path(repository) / manifest_file).is_file()
+    ]
+    for manifest_file in manifest_files:
+        deliverit.manifest_file.get_extractor(manifest_file).parsed
+    return {
+        "configuration": deliverit.config.cached([str(config_file)]),
+        "manifests": deliverit.manifest_file.cached(manifest_files),
+    }
+
+
+class ReleaseServer:
+    def __init__(self, max_jobs: int = 4, logs_directory: Optional[Path] = None):
+        self.max_jobs = max_jobs
+        self.logs_directory = logs_directory or default_logs_directory()
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.started_at = time.time()
+        # Jobs waiting, by repository. A repository is in _ready (once) while it has jobs waiting
+        # and none running: workers never wait for another job of the same repository to finish
+        self._pending: dict[str, deque[Job]] = {}
+        self._ready: queue.Queue[str] = queue.Queue()
+        self._scheduled: set[str] = set()
+        self._lock = threading.Lock()
+        self._repository_locks: dict[str, threading.Lock] = {}
+        # What warm() parsed, by repository
+        self._warmed: dict[str, Optional[dict[str, Any]]] = {}
+        self._processes = multiprocessing.get_context("forkserver")
+        self.budget: Optional[SharedBudget] = None
+
+    def start_workers(self):
+        # Started now, so that the first job does not wait for it to import deliverit
+        self._processes.set_forkserver_preload(["deliverit.deliverit"])
+        multiprocessing.forkserver.ensure_running()
+        manager = self._processes.Manager()
+        self.budget = SharedBudget(manager, manager.Lock())
+        for _ in range(self.max_jobs):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, repository: str, args: list[str]) -> Job:
+        repository = str(Path(repository).resolve())
+        if not Path(repository).is_dir():
+            raise ValueError(f"{repository} is not a directory")
+        parsed = parse_job_args(args)
+        if parsed["serve"] or parsed["fleet"]:
+            raise ValueError("Jobs cannot start servers or fleets")
+        # Nobody can answer prompts
+        if not parsed["affected"] and not parsed["--yes"]:
+            args = [*args, "--yes"]
+        self.logs_directory.mkdir(parents=True, exist_ok=True)
+        id = uuid.uuid4().hex[:12]
+        job = Job(
+            id=id,
+            repository=repository,
+            args=args,
+            log=str(self.logs_directory / f"{id}.log"),
+            queued_at=time.time(),
+        )
+        with self._lock:
+            self.jobs[id] = job
+            self._forget_old_jobs()
+            self._pending.setdefault(repository, deque()).append(job)
+            if repository not in self._scheduled:
+                self._scheduled.add(repository)
+                self._ready.put(repository)
+        # Parse what the job will need while it waits
+        threading.Thread(target=self._warm, args=(repository,), daemon=True).start()
+        return job
+
+    def _warm(self, repository: str):
+        try:
+            with self._repository_lock(repository):
+                self._warmed[repository] = warm(repository)
+        except Exception as error:  # pylint: disable=broad-except
+            # The job will report it
+            print(dim(f"Could not warm up {repository}: {error}"))
+
+    def _repository_lock(self, repository: str) -> threading.Lock:
+        with self._lock:
+            return self._repository_locks.setdefault(repository, threading.Lock())
+
+    def _forget_old_jobs(self):
+        finished = [
+            id for id, job in self.jobs.items() if job.state in ("succeeded", "failed")
+        ]
+        for id in finished[: max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[id]
+
+    def _work(self):
+        while True:
+            repository = self._ready.get()
+            with self._lock:
+                job = self._pending[repository].popleft()
+            # Only one job of a repository is scheduled at a time, this only waits for warming up
+            with self._repository_lock(repository):
+                job.state = "running"
+                job.started_at = time.time()
+                print(
+                    dim(f"[{job.id}] ")
+                    + f"{job.repository}: deliverit {' '.join(job.args)}"
+                )
+                process = self._processes.Process(
+                    target=run_job,
+                    args=(
+                        job.repository,
+                        job.args,
+                        job.log,
+                        self._warmed.get(repository),
+                        self.budget,
+                    ),
+                )
+                process.start()
+                process.join()
+                job.exit_code = process.exitcode
+                job.state = "succeeded" if process.exitcode == 0 else "failed"
+                job.finished_at = time.time()
+                print(
+                    dim(f"[{job.id}] ")
+                    + (job.state if job.exit_code == 0 else red(job.state))
+                )
+            with self._lock:
+                if self._pending[repository]:
+                    # Behind the repositories that were waiting already
+                    self._ready.put(repository)
+                else:
+                    del self._pending[repository]
+                    self._scheduled.discard(repository)
+
+    def metrics(self) -> dict[str, Any]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        durations = [
+            job.finished_at - job.started_at
+            for job in jobs
+            if job.finished_at and job.started_at
+        ]
+        waits = [job.started_at - job.queued_at for job in jobs if job.started_at]
+        return {
+            "uptime": time.time() - self.started_at,
+            "max_jobs": self.max_jobs,
+            **{
+                state: sum(1 for job in jobs if job.state == state)
+                for state in ("queued", "running", "succeeded", "failed")
+            },
+            "mean_duration": sum(durations) / len(durations) if durations else None,
+            "mean_wait": sum(waits) / len(waits) if waits else None,
+        }
+
+    def handle(self, message: dict[str, Any]) -> dict[str, Any]:
+        command = message.get("command")
+        if command == "release":
+            return self.submit(message["repository"], message.get("args", [])).dict()
+        if command == "status":
+            job = self.jobs.get(message.get("job"))
+            if job is None:
+                return {"error": f"No job {message.get('job')!r}"}
+            return job.dict()
+        if command == "jobs":
+            return {"jobs": [job.dict() for job in self.jobs.values()]}
+        if command == "metrics":
+            return self.metrics()
+        return {"error": f"Unknown command {command!r}"}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_UnixServer"
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.release_server.handle(json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                response = {"error": str(error)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    release_server: ReleaseServer
+
+
+def serve(socket_path: Optional[str] = None, max_jobs: int = 4):
+    """Runs the server until interrupted. Listens on default_socket_path() unless socket_path is given"""
+    socket_path = socket_path or default_socket_path()
+    release_server = ReleaseServer(max_jobs=max_jobs)
+    release_server.start_workers()
+    if Path(socket_path).exists():
+        Path(socket_path).unlink()
+    # The jobs run with the repositories' tokens: only our user may submit some.
+    # The socket is created with these permissions, not changed once others could connect
+    umask = os.umask(0o177)
+    try:
+        server = _UnixServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(umask)
+    with server:
+        server.release_server = release_server
+        print(f"Listening on {em(socket_path)}, running up to {max_jobs} jobs at once")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print_on_same_line("Stopped.")
+        finally:
+            Path(socket_path).unlink(missing_ok=True)
+
+
+def request(socket_path: str, message: dict[str, Any]) -> dict[str, Any]:
+    """Sends a message to a running server and returns its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as response:
+            return json.loads(response.readline())
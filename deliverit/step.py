@@ -1,84 +1,216 @@
 from __future__ import annotations
-from typing import Union, Optional, Any
+from typing import Union, Optional, Any, Callable, IO
+import codecs
 import subprocess
-from os import getenv
+import sys
+import threading
 
 import deliverit.config
+import deliverit.metrics
+import deliverit.profiling
+import deliverit.redaction
 from deliverit.ui import *
 
+CHUNK_SIZE = 1 << 16
+
+
+class StepFailed(Exception):
+    pass
+
+
+def is_step_enabled(
+    args: dict[str, Any], config: deliverit.config.Configuration, id: str
+) -> bool:
+    """
+    Whether the step `id` is switched on in the configuration and not disabled with --disable-step
+    """
+    return id not in args["--disable-step"] and bool(getattr(config.steps, id))
+
 
 def make_step_function(
-    args: dict[str, Any], config: deliverit.config.Configuration
+    args: dict[str, Any],
+    config: deliverit.config.Configuration,
+    plan: "Plan",
+    ctx: Optional["Context"] = None,
 ) -> Callable:
+    """
+    Returns a function that adds the step to `plan` if it is enabled.
+    Steps get ctx as their context instead of the plan's, if given.
+    """
+
     def step(
         id: str,
         message: str,
-        action: Optional[Callable] = None,
+        action: Optional["Operation"] = None,
         command: Optional[Union[str, tuple[str]]] = None,
         commands: Optional[list[Union[str, tuple[str]]]] = None,
         cancellable: bool = True,
         nonzero_ok: bool = False,
-    ) -> Any:
-        if id in args["--disable-step"] or not getattr(config.steps, id):
+        stage: int = 0,
+    ):
+        if not is_step_enabled(args, config, id):
             return
         if command:
             commands = [command]
-        if action is None and command is None:
-            return TypeError("'action' and 'command' cannot be both None")
-        print("")
-        print(dim(b(message)))
+        if action is None and not commands:
+            raise TypeError("'action' and 'command' cannot be both None")
+        plan.add(
+            id=id,
+            message=message,
+            operation=action,
+            commands=[c if type(c) is str else list(c) for c in commands or []],
+            cancellable=cancellable,
+            nonzero_ok=nonzero_ok,
+            stage=stage,
+            context=ctx,
+        )
+
+    return step
+
+
+def run_step(
+    args: dict[str, Any],
+    id: str,
+    message: str,
+    action: Optional[Callable] = None,
+    commands: Optional[list[Union[str, list[str]]]] = None,
+    cancellable: bool = True,
+    nonzero_ok: bool = False,
+    raise_on_failure: bool = False,
+) -> Any:
+    """
+    Runs the step's action or commands, after asking for confirmation unless --yes is set.
+    Failed commands are reported, and raise a StepFailed if raise_on_failure is set.
+    """
+    with deliverit.metrics.STEP_DURATION.time(step=id):
+        try:
+            return _run_step(
+                args,
+                id,
+                message,
+                action,
+                commands,
+                cancellable,
+                nonzero_ok,
+                raise_on_failure,
+            )
+        except Exception:
+            deliverit.metrics.STEP_FAILURES.inc(step=id)
+            raise
+
+
+def _run_step(
+    args: dict[str, Any],
+    id: str,
+    message: str,
+    action: Optional[Callable],
+    commands: Optional[list[Union[str, list[str]]]],
+    cancellable: bool,
+    nonzero_ok: bool,
+    raise_on_failure: bool,
+) -> Any:
+    print("")
+    print(dim(b(message)))
+    if commands:
+        for command in commands:
+            print(
+                dim("$ ")
+                + em(
+                    deliverit.redaction.redact(
+                        " ".join(command) if type(command) in (list, tuple) else command
+                    )
+                )
+            )
+    if not args["--yes"] and cancellable:
+        try:
+            answer = input(
+                dim("Press ")
+                + b("⏎")
+                + dim(" to confirm or ")
+                + b("Ctrl-C")
+                + dim(" to cancel")
+            )
+            print()
+            erase_previous_line()
+            erase_previous_line()
+            if answer == "S":
+                return
+        except KeyboardInterrupt:
+            print_on_same_line("Cancelled.")
+            exit(1)
+    if not args["--dry-run"]:
         if commands:
             for command in commands:
-                print(
-                    dim("$ ")
-                    + em(
-                        (
-                            " ".join(command)
-                            if type(command) in (list, tuple)
-                            else command
-                        )
-                        .replace(str(getenv("PYPI_PASSWORD")), "[HIDDEN]")
-                        .replace(str(getenv("GITHUB_TOKEN")), "[HIDDEN]")
+                # Output is redacted, and printed as it comes with --verbose
+                with deliverit.metrics.COMMAND_DURATION.time(step=id):
+                    returncode, stdout, stderr = run_command(
+                        command, echo=args["--verbose"]
                     )
-                )
-        if not args["--yes"] and cancellable:
-            try:
-                answer = input(
-                    dim("Press ")
-                    + b("⏎")
-                    + dim(" to confirm or ")
-                    + b("Ctrl-C")
-                    + dim(" to cancel")
-                )
-                print()
-                erase_previous_line()
-                erase_previous_line()
-                if answer == "S":
-                    return
-            except KeyboardInterrupt:
-                print_on_same_line("Cancelled.")
-                exit(1)
-        if not args["--dry-run"]:
-            if commands:
-                for command in commands:
-                    proc = subprocess.run(  # pylint: disable=subprocess-run-check
-                        command,
-                        capture_output=not args["--verbose"],
-                        shell=type(command) is str,
+                if returncode != 0 and not nonzero_ok:
+                    print(
+                        red("An error occured while running the command ")
+                        + dim(red(f"(it returned {returncode})"))
+                        + red(". Here's its output...")
                     )
-                    if proc.returncode != 0 and not nonzero_ok:
-                        print(
-                            red("An error occured while running the command ")
-                            + dim(red(f"(it returned {proc.returncode})"))
-                            + red(". Here's its output...")
-                        )
-                        print(red("- on stderr"))
-                        print(proc.stderr.decode("utf-8"))
-                        print(red("- on stdout"))
-                        print(proc.stdout.decode("utf-8"))
-            else:
-                return action()
-        elif args["--verbose"]:
-            print(dim("(dry run)"))
+                    print(red("- on stderr"))
+                    print(stderr)
+                    print(red("- on stdout"))
+                    print(stdout)
+                    if raise_on_failure:
+                        # Counted as a failure by run_step
+                        raise StepFailed(f"the command returned {returncode}")
+                    deliverit.metrics.STEP_FAILURES.inc(step=id)
+        else:
+            return action()
+    elif args["--verbose"]:
+        print(dim("(dry run)"))
 
-    return step
+
+def run_command(
+    command: Union[str, list[str]], echo: bool = False
+) -> tuple[int, str, str]:
+    """
+    Runs command, and returns its exit code and its output on stdout and stderr, redacted.
+    With echo, the output is also printed (redacted) while the command runs.
+    """
+    process = subprocess.Popen(
+        command,
+        shell=type(command) is str,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    outputs: dict[str, list[str]] = {"stdout": [], "stderr": []}
+    readers = [
+        threading.Thread(
+            target=_read_output,
+            args=(process.stdout, outputs["stdout"], sys.stdout if echo else None),
+        ),
+        threading.Thread(
+            target=_read_output,
+            args=(process.stderr, outputs["stderr"], sys.stderr if echo else None),
+        ),
+    ]
+    with deliverit.profiling.waiting_for_command():
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        exit_code = process.wait()
+    return exit_code, "".join(outputs["stdout"]), "".join(outputs["stderr"])
+
+
+def _read_output(stream: IO[bytes], output: list[str], echo_to: Optional[IO[str]]):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    redacting = deliverit.redaction.redactor().stream()
+    with stream:
+        while True:
+            chunk = stream.read1(CHUNK_SIZE)
+            redacted = redacting.feed(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                redacted += redacting.flush()
+            output.append(redacted)
+            if echo_to is not None and redacted:
+                echo_to.write(redacted)
+                echo_to.flush()
+            if not chunk:
+                break
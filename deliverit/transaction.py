@@ -0,0 +1,230 @@
+"""
+Crash-safe file modifications: edits are staged in temporary files next to the files they replace,
+then all moved into place at once. Until then, the files are left untouched,
+so that a failure or a Ctrl-C in the middle of a release does not leave them half-modified.
+Dry runs make the same modifications in an overlay, that only exists in memory.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from pathlib import Path
+import difflib
+import os
+import shutil
+import tempfile
+import threading
+
+
+class FileTransaction:
+    """
+    Stages modifications of files until commit(), which replaces each file with its new version
+    with an atomic rename. The renames happen one after the other, right after each other,
+    then each directory is synced once, however many of its files were modified.
+    rollback() throws every staged modification away.
+
+    Used as a context manager, it commits if the block succeeds and rolls back otherwise.
+    """
+
+    def __init__(self) -> None:
+        # file -> temporary file holding its new contents
+        self._staged: dict[Path, Path] = {}
+        self._lock = threading.RLock()
+
+    def __enter__(self) -> "FileTransaction":
+        return self
+
+    def __exit__(self, exc_type: Any, *_: Any):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def __bool__(self) -> bool:
+        return bool(self._staged)
+
+    @property
+    def staged(self) -> list[Path]:
+        return list(self._staged)
+
+    def _temporary_for(self, filepath: Path) -> Path:
+        """The temporary file for filepath, created in the same directory so that it can be renamed over it"""
+        if filepath in self._staged:
+            return self._staged[filepath]
+        descriptor, temporary = tempfile.mkstemp(
+            dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".deliverit"
+        )
+        os.close(descriptor)
+        if filepath.exists():
+            shutil.copymode(filepath, temporary)
+        self._staged[filepath] = Path(temporary)
+        return self._staged[filepath]
+
+    def read_text(self, filepath: Union[str, Path]) -> str:
+        """The file's contents, including the modifications staged so far"""
+        filepath = Path(filepath).resolve()
+        with self._lock:
+            source = self._staged.get(filepath, filepath)
+        with open(source, encoding="utf-8", newline="") as file:
+            return file.read()
+
+    def write_text(self, filepath: Union[str, Path], contents: str):
+        filepath = Path(filepath).resolve()
+        with self._lock:
+            temporary = self._temporary_for(filepath)
+        with open(temporary, "w", encoding="utf-8", newline="") as file:
+            file.write(contents)
+
+    def path_for_update(self, filepath: Union[str, Path]) -> str:
+        """
+        A path to give to code that modifies files in place (e.g. chachacha):
+        a staged copy of filepath, including the modifications staged so far
+        """
+        filepath = Path(filepath).resolve()
+        with self._lock:
+            already_staged = filepath in self._staged
+            temporary = self._temporary_for(filepath)
+        if not already_staged and filepath.exists():
+            shutil.copyfile(filepath, temporary)
+        return str(temporary)
+
+    def commit(self):
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        # Make sure the new contents are on disk before the renames are
+        for temporary in staged.values():
+            with open(temporary, "rb+") as file:
+                os.fsync(file.fileno())
+        for filepath, temporary in staged.items():
+            os.replace(temporary, filepath)
+        for directory in {filepath.parent for filepath in staged}:
+            _fsync_directory(directory)
+
+    def rollback(self):
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        for temporary in staged.values():
+            temporary.unlink(missing_ok=True)
+
+
+class FileOverlay(FileTransaction):
+    """
+    Keeps modifications in memory and never writes them to the files, for dry runs.
+    Reading a file through the overlay gives the modifications made so far,
+    diff() shows all of them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._contents: dict[Path, str] = {}
+        # Copies given to code that modifies files in place, in a directory of our own
+        self._scratch: dict[Path, Path] = {}
+        self._scratch_directory: Optional[tempfile.TemporaryDirectory] = None
+
+    def __bool__(self) -> bool:
+        return bool(self._contents or self._scratch)
+
+    @property
+    def staged(self) -> list[Path]:
+        self._collect()
+        return list(self._contents)
+
+    def _collect(self):
+        """Brings the modifications made to the scratch copies into the overlay"""
+        with self._lock:
+            for filepath, copy in self._scratch.items():
+                if copy.exists():
+                    self._contents[filepath] = _read_or_empty(copy)
+
+    def read_text(self, filepath: Union[str, Path]) -> str:
+        filepath = Path(filepath).resolve()
+        self._collect()
+        with self._lock:
+            if filepath in self._contents:
+                return self._contents[filepath]
+        return _read_or_empty(filepath)
+
+    def write_text(self, filepath: Union[str, Path], contents: str):
+        filepath = Path(filepath).resolve()
+        with self._lock:
+            if filepath in self._scratch:
+                self._scratch[filepath].write_text(contents, "utf-8")
+            self._contents[filepath] = contents
+
+    def path_for_update(self, filepath: Union[str, Path]) -> str:
+        filepath = Path(filepath).resolve()
+        with self._lock:
+            if filepath in self._scratch:
+                return str(self._scratch[filepath])
+            if self._scratch_directory is None:
+                self._scratch_directory = tempfile.TemporaryDirectory(
+                    prefix="deliverit-"
+                )
+            # One directory per copy, for files with the same name
+            copy = Path(self._scratch_directory.name) / str(len(self._scratch))
+            copy.mkdir()
+            copy /= filepath.name
+            if filepath in self._contents:
+                copy.write_text(self._contents[filepath], "utf-8")
+            elif filepath.exists():
+                shutil.copyfile(filepath, copy)
+            self._scratch[filepath] = copy
+            return str(copy)
+
+    def diff(self, relative_to: Optional[Path] = None) -> str:
+        """The modifications as a unified diff, with paths relative to relative_to (the current directory by default)"""
+        self._collect()
+        relative_to = (relative_to or Path.cwd()).resolve()
+        chunks = []
+        with self._lock:
+            contents = dict(sorted(self._contents.items()))
+        for filepath, new in contents.items():
+            try:
+                name = filepath.relative_to(relative_to).as_posix()
+            except ValueError:
+                name = filepath.as_posix()
+            exists = filepath.exists()
+            chunks.extend(
+                difflib.unified_diff(
+                    _read_or_empty(filepath).splitlines(keepends=True),
+                    new.splitlines(keepends=True),
+                    fromfile=f"a/{name}" if exists else "/dev/null",
+                    tofile=f"b/{name}",
+                )
+            )
+        return "".join(
+            (
+                chunk
+                if chunk.endswith("\n")
+                else chunk + "\n\\ No newline at end of file\n"
+            )
+            for chunk in chunks
+        )
+
+    def commit(self):
+        """Does nothing: an overlay never writes to the files"""
+
+    def rollback(self):
+        with self._lock:
+            self._contents, self._scratch = {}, {}
+            if self._scratch_directory is not None:
+                self._scratch_directory.cleanup()
+                self._scratch_directory = None
+
+
+def _read_or_empty(filepath: Path) -> str:
+    if not filepath.exists():
+        return ""
+    with open(filepath, encoding="utf-8", newline="") as file:
+        return file.read()
+
+
+def _fsync_directory(directory: Path):
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Directories can't be opened on Windows, renames are durable there already
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
@@ -32,10 +32,11 @@ MESSAGE_NO_VALID_DOTENV_FILE = """\
 Add a .env file to this directory with the following contents:
 
     GITHUB_TOKEN="your github personnal access token"
+    # or GITLAB_TOKEN / GITEA_TOKEN, for repositories hosted there
     PYPI_USERNAME="your PyPI account username"
     PYPI_PASSWORD="your PyPI account's password"
 
 ⚠ MAKE SURE TO .GITIGNORE THIS FILE BEFORE RUNNING THE COMMAND AGAIN.
   IF THIS FILE IS NOT IGNORED, IT COULD BE UPLOADED, AND ACCESS TO YOUR
-  GITHUB *AND* PYPI ACCOUNTS WOULD BE MADE PUBLIC
+  GITHUB (OR GITLAB, GITEA) *AND* PYPI ACCOUNTS WOULD BE MADE PUBLIC
 """
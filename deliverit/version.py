@@ -1,11 +1,12 @@
 """
 Functions related to version operations
 """
+
 from __future__ import annotations
 from typing import Union, Optional, Any
 import subprocess
 from subprocess import CalledProcessError
-from parse import parse
+from parse import parse, compile as compile_parse_pattern
 
 from deliverit.ui import *
 
@@ -21,6 +22,20 @@ class Version:
         """
         return cls(*map(int, version_str.split(".")))
 
+    @classmethod
+    def __get_validators__(cls):
+        """Lets pydantic models have Version fields"""
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Union["Version", str]) -> "Version":
+        if isinstance(value, cls):
+            return value
+        return cls.parse(str(value))
+
+    def as_tuple(self) -> tuple[int, int, int]:
+        return self.major, self.minor, self.patch
+
     def __str__(self) -> str:
         return f"{self.major}.{self.minor}.{self.patch}"
 
@@ -65,3 +80,35 @@ def get_current_version_from_git_tag(
         return fallback_version
     else:
         return Version.parse(parse(tag_template, stdout).named["new"])
+
+
+def list_tags() -> list[str]:
+    # pylint: disable=subprocess-run-check
+    result = subprocess.run(["git", "tag", "--list"], capture_output=True)
+    if result.returncode != 0:
+        return []
+    return result.stdout.decode("utf-8").splitlines()
+
+
+def get_latest_tag(
+    tag_template: str, tags: Optional[list[str]] = None
+) -> Optional[tuple[str, Version]]:
+    """
+    Finds the tag with the highest version among those that match tag_template
+    (where {new} stands for the version), in a single git call.
+    Pass tags (from list_tags()) to look for several templates without calling git again.
+    Returns the tag's name and its version, or None if no tag matches.
+    """
+    template = compile_parse_pattern(tag_template)
+    latest: Optional[tuple[str, Version]] = None
+    for tag in list_tags() if tags is None else tags:
+        parsed = template.parse(tag)
+        if parsed is None:
+            continue
+        try:
+            version = Version.parse(parsed.named["new"])
+        except (ValueError, TypeError):
+            continue
+        if latest is None or version.as_tuple() > latest[1].as_tuple():
+            latest = tag, version
+    return latest
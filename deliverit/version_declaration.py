@@ -1,21 +1,28 @@
-import re
 from __future__ import annotations
+import re
 from typing import Union, Optional, Any
 from pathlib import Path
 
 from deliverit.context import Context
 import deliverit.config
+from deliverit.transaction import FileTransaction
 
 
 def update(
-    ctx: Context, declaration: deliverit.config.VersionDeclaration,
+    ctx: Context,
+    declaration: deliverit.config.VersionDeclaration,
+    files: Optional[FileTransaction] = None,
 ):
+    if files is None:
+        with FileTransaction() as files:
+            return update(ctx, declaration, files)
+
     updated_contents = ""
     filepath = ctx.apply(declaration.in_)
-    current_contents = Path(filepath).read_text("utf-8")
+    current_contents = files.read_text(filepath)
     for line in current_contents.splitlines():
         if re.match(declaration.search, line):
             updated_contents += ctx.apply(declaration.replace) + "\n"
         else:
             updated_contents += f"{line}\n"
-    Path(filepath).write_text(updated_contents)
+    files.write_text(filepath, updated_contents)
@@ -0,0 +1,226 @@
+"""
+Bumping manifests: only the version's characters change, the rest of the file is kept byte for byte.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from pathlib import Path
+
+import pytest
+
+from deliverit.manifest_file import bump, get_extractor
+from deliverit.transaction import FileTransaction
+from deliverit.version import Version
+
+NEW_VERSION = Version.parse("0.10.0")
+
+# manifest, {file: contents before}, {file: contents expected after}
+CASES: dict[str, tuple[str, dict[str, str], dict[str, str]]] = {
+    "pyproject.toml": (
+        "pyproject.toml",
+        {
+            "pyproject.toml": (
+                "[tool.black]\r\n"
+                'version = "0.9.0"\r\n'
+                "\r\n"
+                "[tool.poetry]  # the package\r\n"
+                "name = 'pkg'\r\n"
+                "version   =   '0.9.0' # bumped by deliverit\r\n"
+                "\r\n"
+                "[tool.poetry.dependencies]\r\n"
+                'foo = {version = "0.9.0"}\r\n'
+            )
+        },
+        {
+            "pyproject.toml": (
+                "[tool.black]\r\n"
+                'version = "0.9.0"\r\n'
+                "\r\n"
+                "[tool.poetry]  # the package\r\n"
+                "name = 'pkg'\r\n"
+                "version   =   '0.10.0' # bumped by deliverit\r\n"
+                "\r\n"
+                "[tool.poetry.dependencies]\r\n"
+                'foo = {version = "0.9.0"}\r\n'
+            )
+        },
+    ),
+    "Cargo.toml": (
+        "Cargo.toml",
+        {
+            "Cargo.toml": (
+                "[package]\n"
+                'name = "pkg"\n'
+                'version = "0.9.0"\n'
+                "\n"
+                "[dependencies]\n"
+                'serde = { version = "0.9.0" }\n'
+            )
+        },
+        {
+            "Cargo.toml": (
+                "[package]\n"
+                'name = "pkg"\n'
+                'version = "0.10.0"\n'
+                "\n"
+                "[dependencies]\n"
+                'serde = { version = "0.9.0" }\n'
+            )
+        },
+    ),
+    "package.json": (
+        "package.json",
+        {
+            "package.json": (
+                "{\n"
+                '    "name": "pkg",\n'
+                '    "engines": {"version": "0.9.0"},\n'
+                '    "description": "\\"version\\": \\"0.9.0\\"",\n'
+                '    "version" : "0.9.0"\n'
+                "}"
+            )
+        },
+        {
+            "package.json": (
+                "{\n"
+                '    "name": "pkg",\n'
+                '    "engines": {"version": "0.9.0"},\n'
+                '    "description": "\\"version\\": \\"0.9.0\\"",\n'
+                '    "version" : "0.10.0"\n'
+                "}"
+            )
+        },
+    ),
+    "pom.xml": (
+        "pom.xml",
+        {
+            "pom.xml": (
+                '<?xml version="1.0"?>\n'
+                "<project>\n"
+                "  <parent><version>0.9.0</version></parent>\n"
+                "  <!-- <version>0.9.0</version> -->\n"
+                "  <groupId>org.example</groupId>\n"
+                "  <artifactId>pkg</artifactId>\n"
+                "  <version>0.9.0</version>\n"
+                "</project>\n"
+            )
+        },
+        {
+            "pom.xml": (
+                '<?xml version="1.0"?>\n'
+                "<project>\n"
+                "  <parent><version>0.9.0</version></parent>\n"
+                "  <!-- <version>0.9.0</version> -->\n"
+                "  <groupId>org.example</groupId>\n"
+                "  <artifactId>pkg</artifactId>\n"
+                "  <version>0.10.0</version>\n"
+                "</project>\n"
+            )
+        },
+    ),
+    "setup.cfg": (
+        "setup.cfg",
+        {
+            "setup.cfg": (
+                "[metadata]\n"
+                "name = pkg\n"
+                "version = 0.9.0\n"
+                "\n"
+                "[options]\n"
+                "version = 0.9.0\n"
+            )
+        },
+        {
+            "setup.cfg": (
+                "[metadata]\n"
+                "name = pkg\n"
+                "version = 0.10.0\n"
+                "\n"
+                "[options]\n"
+                "version = 0.9.0\n"
+            )
+        },
+    ),
+    "setup.cfg with file:": (
+        "setup.cfg",
+        {
+            "setup.cfg": "[metadata]\nname = pkg\nversion = file: VERSION\n",
+            "VERSION": "0.9.0\n",
+        },
+        {
+            "setup.cfg": "[metadata]\nname = pkg\nversion = file: VERSION\n",
+            "VERSION": "0.10.0\n",
+        },
+    ),
+    "setup.cfg with attr:": (
+        "setup.cfg",
+        {
+            "setup.cfg": (
+                "[metadata]\n"
+                "name = pkg\n"
+                "version = attr: pkg.__version__\n"
+                "\n"
+                "[options]\n"
+                "package_dir =\n"
+                "    =src\n"
+            ),
+            "src/pkg/__init__.py": (
+                '"""The package, version "0.9.0"."""\n'
+                "__version__: str = '0.9.0'  # é\n"
+                'OTHER = "0.9.0"\n'
+            ),
+        },
+        {
+            "setup.cfg": (
+                "[metadata]\n"
+                "name = pkg\n"
+                "version = attr: pkg.__version__\n"
+                "\n"
+                "[options]\n"
+                "package_dir =\n"
+                "    =src\n"
+            ),
+            "src/pkg/__init__.py": (
+                '"""The package, version "0.9.0"."""\n'
+                "__version__: str = '0.10.0'  # é\n"
+                'OTHER = "0.9.0"\n'
+            ),
+        },
+    ),
+}
+
+
+def write_files(directory: Path, files: dict[str, str]):
+    for name, contents in files.items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_bytes(contents.encode("utf-8"))
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_bump_changes_only_the_version(tmp_path: Path, case: str):
+    manifest, before, after = CASES[case]
+    write_files(tmp_path, before)
+
+    bump(str(tmp_path / manifest), NEW_VERSION)
+
+    for name, contents in after.items():
+        assert (tmp_path / name).read_bytes() == contents.encode("utf-8")
+    assert str(get_extractor(str(tmp_path / manifest)).old_version) == "0.10.0"
+
+
+def test_bump_attr_module_modified_in_the_same_transaction(tmp_path: Path):
+    manifest, before, _ = CASES["setup.cfg with attr:"]
+    write_files(tmp_path, before)
+    module = tmp_path / "src" / "pkg" / "__init__.py"
+
+    with FileTransaction() as files:
+        # e.g. a version declaration, that moves the assignment down a line
+        files.write_text(module, "import os\n" + files.read_text(module))
+        bump(str(tmp_path / manifest), NEW_VERSION, files)
+
+    assert module.read_text("utf-8") == (
+        "import os\n"
+        '"""The package, version "0.9.0"."""\n'
+        "__version__: str = '0.10.0'  # é\n"
+        'OTHER = "0.9.0"\n'
+    )
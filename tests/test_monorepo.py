@@ -0,0 +1,137 @@
+"""
+Multi-package repositories: which package a path belongs to, which packages changed,
+and in which order they are released.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from deliverit.monorepo import (
+    Package,
+    PathIndex,
+    changed_packages,
+    dependency_levels,
+)
+
+TAG_TEMPLATE = "{package}-v{new}"
+
+
+def package(
+    name: str, directory: str, dependencies: Optional[list[str]] = None
+) -> Package:
+    return Package(
+        name=name,
+        manifest_file=str(Path(directory) / "pyproject.toml"),
+        directory=directory,
+        dependencies=dependencies or [],
+    )
+
+
+# The repository's root is a package too, with a package nested in another one
+PACKAGES = [
+    package("app", ""),
+    package("core", "libs/core"),
+    package("extra", "libs/core/plugins/extra"),
+]
+
+
+@pytest.mark.parametrize(
+    "path, owner",
+    [
+        ("README.md", "app"),
+        ("libs/core/core.py", "core"),
+        ("libs/core/plugins/registry.py", "core"),
+        ("libs/core/plugins/extra/extra.py", "extra"),
+        ("libs/core/plugins/extra/sub/deep.py", "extra"),
+        # Only whole directory names count
+        ("libs/core-old/core.py", "app"),
+        ("libs/core.py", "app"),
+    ],
+)
+def test_paths_belong_to_the_innermost_package(path: str, owner: str):
+    assert PathIndex(PACKAGES).package_of(path) == owner
+
+
+def test_paths_outside_of_packages_belong_to_none():
+    assert PathIndex(PACKAGES[1:]).package_of("README.md") is None
+    assert PathIndex(PACKAGES[1:]).package_of("libs/other/a.py") is None
+
+
+def _git(*args: str):
+    subprocess.run(["git", *args], check=True, capture_output=True)
+
+
+def _commit(files: dict[str, str]):
+    for name, contents in files.items():
+        Path(name).parent.mkdir(parents=True, exist_ok=True)
+        Path(name).write_text(contents)
+    _git("add", ".")
+    _git("commit", "-q", "-m", f"Change {', '.join(files)}")
+
+
+@pytest.fixture
+def repository(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.chdir(tmp_path)
+    _git("init", "-q", "-b", "main")
+    _git("config", "user.name", "Jane Doe")
+    _git("config", "user.email", "jane@example.com")
+    _commit(
+        {
+            "README.md": "app\n",
+            "libs/core/core.py": "core\n",
+            "libs/core/plugins/extra/extra.py": "extra\n",
+        }
+    )
+    for name in ("app", "core", "extra"):
+        _git("tag", f"{name}-v1.0.0")
+    return tmp_path
+
+
+def test_changed_packages(repository: Path):
+    assert changed_packages(PACKAGES, TAG_TEMPLATE) == {}
+
+    _commit({"libs/core/plugins/extra/extra.py": "extra, changed\n"})
+    assert changed_packages(PACKAGES, TAG_TEMPLATE) == {"extra": "extra-v1.0.0"}
+
+    # Released since: the changes before its new tag don't count
+    _git("tag", "extra-v1.0.1")
+    _commit({"README.md": "app, changed\n"})
+    assert changed_packages(PACKAGES, TAG_TEMPLATE) == {"app": "app-v1.0.0"}
+
+
+def test_packages_never_released_changed(repository: Path):
+    packages = [*PACKAGES, package("new", "libs/new")]
+    _commit({"libs/new/new.py": "new\n"})
+
+    assert changed_packages(packages, TAG_TEMPLATE) == {"new": None}
+
+
+def test_dependency_levels():
+    packages = [
+        package("app", "", ["cli", "web"]),
+        package("cli", "cli", ["core"]),
+        package("web", "web", ["core", "requests"]),
+        package("core", "core"),
+        package("docs", "docs"),
+    ]
+
+    levels = [[p.name for p in level] for level in dependency_levels(packages)]
+
+    # Packages outside of the list (requests) are not waited for
+    assert levels == [["core", "docs"], ["cli", "web"], ["app"]]
+
+
+def test_dependency_cycles_are_refused():
+    packages = [
+        package("core", "core"),
+        package("a", "a", ["core", "b"]),
+        package("b", "b", ["c"]),
+        package("c", "c", ["a"]),
+    ]
+
+    with pytest.raises(ValueError, match="depend on each other: a, b, c"):
+        dependency_levels(packages)
@@ -0,0 +1,73 @@
+"""
+Redaction: secrets never get printed, whether in the plan, in echoed commands or in their output.
+"""
+
+from __future__ import annotations
+from typing import Union, Optional, Any
+
+import pytest
+
+import deliverit.redaction
+from deliverit.plan import Operation, PlannedStep, describe_step
+
+SECRET = "hunter2-secret"
+
+
+def test_plans_are_described_without_secrets(capsys: pytest.CaptureFixture):
+    deliverit.redaction.hide(SECRET)
+    describe_step(
+        PlannedStep(
+            id="publish_to_registry",
+            message="Publish",
+            operation=Operation(name="publish", arguments={"password": SECRET}),
+            commands=[f"twine upload -p {SECRET} dist/*", ["curl", "-u", SECRET]],
+        )
+    )
+
+    output = capsys.readouterr().out
+    assert SECRET not in output
+    assert output.count(deliverit.redaction.REPLACEMENT) == 3
+
+
+def redact_in_chunks(redactor: deliverit.redaction.Redactor, chunks: list[str]) -> str:
+    stream = redactor.stream()
+    return "".join(stream.feed(chunk) for chunk in chunks) + stream.flush()
+
+
+def test_secret_split_across_reads():
+    redactor = deliverit.redaction.Redactor([SECRET])
+    text = f"token: {SECRET}, again: {SECRET}!"
+
+    for split in range(len(text) + 1):
+        assert (
+            redact_in_chunks(redactor, [text[:split], text[split:]])
+            == "token: [HIDDEN], again: [HIDDEN]!"
+        ), f"split at {split}"
+
+
+def test_only_what_could_start_a_secret_is_held_back():
+    stream = deliverit.redaction.Redactor([SECRET]).stream()
+    held_back = len(SECRET) - 1
+
+    # Could be the start of the secret
+    assert stream.feed("log: hunter2") == ""
+    text = "log: hunter2 done, and the rest of the output\n"
+    printed = stream.feed(text[len("log: hunter2") :])
+    assert printed == text[:-held_back]
+    assert stream.flush() == text[-held_back:]
+
+
+def test_secret_that_is_the_prefix_of_another():
+    short, long = "abcd1234", "abcd1234efgh5678"
+    redactor = deliverit.redaction.Redactor([short, long])
+    text = f"<{long}> <{short}> <{short}efgh>"
+
+    for split in range(len(text) + 1):
+        assert (
+            redact_in_chunks(redactor, [text[:split], text[split:]])
+            == "<[HIDDEN]> <[HIDDEN]> <[HIDDEN]efgh>"
+        ), f"split at {split}"
+    # One character at a time: the longer secret is never cut after its prefix
+    assert redact_in_chunks(redactor, list(text)) == (
+        "<[HIDDEN]> <[HIDDEN]> <[HIDDEN]efgh>"
+    )